@@ -1,18 +1,24 @@
-import json
 import logging
 import os
+import threading
 from random import randint
 from time import time
 
 import boto3
 from botocore.exceptions import ClientError
 
-from caching.common import get_last_modified_time
+from caching.common import (
+    decode_cache_body,
+    encode_cache_body,
+    get_last_modified_time,
+    is_not_modified,
+)
 from settings import (
     DD_S3_BUCKET_NAME,
     DD_S3_CACHE_DIRNAME,
     DD_S3_CACHE_LOCK_TTL_SECONDS,
     DD_TAGS_CACHE_TTL_SECONDS,
+    DD_TAGS_CACHE_MAX_STALENESS_SECONDS,
 )
 from telemetry import send_forwarder_internal_metrics
 
@@ -28,11 +34,23 @@ class BaseTagsCache(object):
         cache_filename,
         cache_lock_filename,
         tags_ttl_seconds=DD_TAGS_CACHE_TTL_SECONDS,
+        max_staleness_seconds=DD_TAGS_CACHE_MAX_STALENESS_SECONDS,
     ):
         self.cache_dirname = DD_S3_CACHE_DIRNAME
         self.tags_ttl_seconds = tags_ttl_seconds
+        self.max_staleness_seconds = max_staleness_seconds
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
+        # Last version of the S3 cache, fetched again only once it changes
+        self._cache_etag = None
+        self._cache_tags = {}
+        self._cache_last_modified = -1
         self.tags_by_id = {}
+        # When the last refresh started, and when the last one succeeded
         self.last_tags_fetch_time = 0
+        self.last_successful_tags_fetch_time = 0
+        # Deadline of the current invocation, bounding the wait for a refresh
+        self.deadline = None
         self.cache_prefix = prefix
         self.cache_filename = cache_filename
         self.cache_lock_filename = cache_lock_filename
@@ -59,8 +77,12 @@ class BaseTagsCache(object):
             s3_object = self.s3_client.Object(
                 DD_S3_BUCKET_NAME, self.get_cache_name_with_prefix()
             )
-            s3_object.put(Body=(bytes(json.dumps(data).encode("UTF-8"))))
+            response = s3_object.put(Body=encode_cache_body(data))
+            self._cache_etag = response.get("ETag")
+            self._cache_tags = data
+            self._cache_last_modified = int(time())
         except ClientError:
+            self._cache_etag = None
             send_forwarder_internal_metrics("s3_cache_write_failure")
             self.logger.debug("Unable to write new cache to S3", exc_info=True)
 
@@ -105,19 +127,33 @@ class BaseTagsCache(object):
 
     def get_cache_from_s3(self):
         """Retrieves tags cache from s3 and returns the body along with
-        the last modified datetime for the cache"""
+        the last modified datetime for the cache. The cache is only downloaded
+        if it changed since it was last fetched"""
         cache_object = self.s3_client.Object(
             DD_S3_BUCKET_NAME, self.get_cache_name_with_prefix()
         )
         try:
-            file_content = cache_object.get()
-            tags_cache = json.loads(file_content["Body"].read().decode("utf-8"))
+            if self._cache_etag:
+                file_content = cache_object.get(IfNoneMatch=self._cache_etag)
+            else:
+                file_content = cache_object.get()
+            tags_cache = decode_cache_body(file_content["Body"].read())
             last_modified_unix_time = get_last_modified_time(file_content)
+        except ClientError as e:
+            if is_not_modified(e):
+                send_forwarder_internal_metrics("s3_cache_not_modified")
+                return self._cache_tags, self._cache_last_modified
+            send_forwarder_internal_metrics("s3_cache_fetch_failure")
+            self.logger.debug("Unable to fetch cache from S3", exc_info=True)
+            return {}, -1
         except:
             send_forwarder_internal_metrics("s3_cache_fetch_failure")
             self.logger.debug("Unable to fetch cache from S3", exc_info=True)
             return {}, -1
 
+        self._cache_etag = file_content.get("ETag")
+        self._cache_tags = tags_cache
+        self._cache_last_modified = last_modified_unix_time
         return tags_cache, last_modified_unix_time
 
     def _refresh(self):
@@ -133,6 +169,7 @@ class BaseTagsCache(object):
                     self.cache_filename
                 )
             )
+            self.last_successful_tags_fetch_time = time()
             return
 
         tags_fetched, last_modified = self.get_cache_from_s3()
@@ -145,14 +182,54 @@ class BaseTagsCache(object):
                 success, new_tags_fetched = self.build_tags_cache()
                 if success:
                     self.tags_by_id = new_tags_fetched
+                    self.last_successful_tags_fetch_time = time()
                     self.write_cache_to_s3(self.tags_by_id)
                 elif tags_fetched != {}:
                     self.tags_by_id = tags_fetched
+                    self.last_successful_tags_fetch_time = time()
 
                 self.release_s3_cache_lock()
         # s3 cache fetch succeeded and isn't expired
         elif last_modified > -1:
             self.tags_by_id = tags_fetched
+            self.last_successful_tags_fetch_time = time()
+
+    def _revalidate(self):
+        """Refresh the tags in a background thread, serving the tags already in
+        the local cache meanwhile. A single refresh runs at a time, and it is
+        waited for, until the deadline at most, when the tags were never
+        fetched successfully or are older than max_staleness_seconds
+        """
+        is_too_stale = (
+            self.last_successful_tags_fetch_time == 0
+            or time()
+            > self.last_successful_tags_fetch_time + self.max_staleness_seconds
+        )
+        with self._refresh_lock:
+            if self._refresh_thread is None or not self._refresh_thread.is_alive():
+                self._refresh_thread = threading.Thread(
+                    target=self._refresh_in_background, daemon=True
+                )
+                self._refresh_thread.start()
+            refresh_thread = self._refresh_thread
+
+        if is_too_stale:
+            timeout = None
+            if self.deadline is not None:
+                timeout = max(self.deadline.remaining(), 0)
+            refresh_thread.join(timeout)
+            if refresh_thread.is_alive():
+                send_forwarder_internal_metrics("local_cache_refresh_timeout")
+        else:
+            send_forwarder_internal_metrics("local_cache_served_stale")
+
+    def _refresh_in_background(self):
+        try:
+            self._refresh()
+        except Exception:
+            self.logger.exception(
+                "Failed to refresh the tags cache {}".format(self.cache_filename)
+            )
 
     def _is_expired(self, last_modified=None):
         """Returns bool for whether the fetch TTL has expired"""
@@ -2,6 +2,7 @@ from caching.cloudwatch_log_group_cache import CloudwatchLogGroupTagsCache
 from caching.step_functions_cache import StepFunctionsTagsCache
 from caching.s3_tags_cache import S3TagsCache
 from caching.lambda_cache import LambdaTagsCache
+from caching.log_group_metadata_cache import LogGroupMetadataCache
 
 
 class CacheLayer:
@@ -10,6 +11,16 @@ class CacheLayer:
         self._s3_tags_cache = S3TagsCache(prefix)
         self._step_functions_cache = StepFunctionsTagsCache(prefix)
         self._lambda_cache = LambdaTagsCache(prefix)
+        self._log_group_metadata_cache = LogGroupMetadataCache()
+
+    def set_deadline(self, deadline):
+        """Bounds how long the tags caches wait for a refresh in this invocation"""
+        for cache in (
+            self._s3_tags_cache,
+            self._step_functions_cache,
+            self._lambda_cache,
+        ):
+            cache.deadline = deadline
 
     def get_cloudwatch_log_group_tags_cache(self):
         return self._cloudwatch_log_group_cache
@@ -22,3 +33,6 @@ class CacheLayer:
 
     def get_lambda_tags_cache(self):
         return self._lambda_cache
+
+    def get_log_group_metadata_cache(self):
+        return self._log_group_metadata_cache
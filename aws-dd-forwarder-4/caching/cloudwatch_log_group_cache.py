@@ -1,21 +1,33 @@
 import json
 import logging
 import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from random import randint
 from time import time
 
 import boto3
 from botocore.config import Config
+from botocore.exceptions import ClientError
 
-from caching.common import sanitize_aws_tag_string
+from caching.common import (
+    is_not_modified,
+    is_precondition_failed,
+    sanitize_aws_tag_string,
+)
 from settings import (
     DD_S3_BUCKET_NAME,
     DD_S3_CACHE_DIRNAME,
     DD_S3_LOG_GROUP_CACHE_DIRNAME,
     DD_TAGS_CACHE_TTL_SECONDS,
+    DD_LOG_GROUP_TAGS_CACHE_SHARDS,
+    DD_LOG_GROUP_TAGS_FETCH_MAX_WORKERS,
 )
 from telemetry import send_forwarder_internal_metrics
 
+# Writes of a cache shard conflicting with the ones of other containers are
+# retried on the latest version of the shard this many times at most
+SHARD_WRITE_MAX_ATTEMPTS = 3
 
 class CloudwatchLogGroupTagsCache:
     def __init__(
@@ -27,6 +39,10 @@ class CloudwatchLogGroupTagsCache:
         self.bucket_name = DD_S3_BUCKET_NAME
         self.cache_prefix = prefix
         self.tags_by_log_group = {}
+        self.shard_count = DD_LOG_GROUP_TAGS_CACHE_SHARDS
+        self.fetch_max_workers = DD_LOG_GROUP_TAGS_FETCH_MAX_WORKERS
+        # Last version of each cache shard, fetched again only once it changes
+        self._shards = {}
         # We need to use the standard retry mode for the Cloudwatch Logs client that defaults to 3 retries
         self.cloudwatch_logs_client = boto3.client(
             "logs", config=Config(retries={"mode": "standard"})
@@ -63,67 +79,169 @@ class CloudwatchLogGroupTagsCache:
     def _should_fetch_tags(self):
         return os.environ.get("DD_FETCH_LOG_GROUP_TAGS", "false").lower() == "true"
 
-    def _fetch_log_group_tags(self, log_group_arn):
+    def prefetch(self, log_group_arns):
+        """Fetch the tags of several log groups at once
+
+        The tags of each log group are kept in one of a few shards, S3 cache
+        files shared by all the log groups of the forwarder, so that loading a
+        shard warms the cache for many log groups. Log groups missing from the
+        shards are looked up concurrently, then the updated shards are written
+        back.
+
+        Args:
+            log_group_arns (str[]): the log groups to fetch the tags of
+        """
+        if not self._should_fetch_tags():
+            return
+
         # first, check in-memory cache
-        log_group_tags_struct = self.tags_by_log_group.get(log_group_arn, None)
-        if log_group_tags_struct and not self._is_expired(
-            log_group_tags_struct.get("last_modified", None)
-        ):
+        missing = [
+            log_group_arn
+            for log_group_arn in set(log_group_arns)
+            if self._is_expired(
+                self.tags_by_log_group.get(log_group_arn, {}).get("last_modified")
+            )
+        ]
+        if not missing:
             send_forwarder_internal_metrics("loggroup_local_cache_hit")
-            return log_group_tags_struct.get("tags", [])
+            return
 
-        # then, check cache file, update and return
-        cache_file_name = self._get_cache_file_name(log_group_arn)
-        log_group_tags, last_modified = self._get_log_group_tags_from_cache(
-            cache_file_name
-        )
-        if log_group_tags and not self._is_expired(last_modified):
-            self.tags_by_log_group[log_group_arn] = {
+        # then, check the cache shards of the missing log groups
+        shard_indexes = {self._get_shard_index(arn) for arn in missing}
+        with ThreadPoolExecutor(
+            max_workers=min(self.fetch_max_workers, len(shard_indexes))
+        ) as executor:
+            shards = dict(
+                zip(shard_indexes, executor.map(self._get_shard, shard_indexes))
+            )
+        # Shards that can't be read are not written back, which would drop
+        # the log groups cached in them
+        unreadable_shard_indexes = set()
+        for shard_index, shard in shards.items():
+            if shard is None:
+                unreadable_shard_indexes.add(shard_index)
+                shards[shard_index] = {}
+
+        misses = []
+        for log_group_arn in missing:
+            shard = shards[self._get_shard_index(log_group_arn)]
+            entry = shard.get(log_group_arn)
+            if entry and not self._is_expired(entry.get("last_modified")):
+                self._set_local_tags(log_group_arn, entry["tags"])
+                send_forwarder_internal_metrics("loggroup_s3_cache_hit")
+            else:
+                misses.append(log_group_arn)
+        if not misses:
+            return
+
+        # finally, make api calls, update the shards and return
+        with ThreadPoolExecutor(
+            max_workers=min(self.fetch_max_workers, len(misses))
+        ) as executor:
+            fetched_tags = list(executor.map(self._get_log_group_tags, misses))
+
+        updates = {}
+        for log_group_arn, log_group_tags in zip(misses, fetched_tags):
+            # Log groups whose tags can't be read are cached without tags, so
+            # that they are not looked up again on every invocation
+            log_group_tags = log_group_tags or []
+            shard_index = self._get_shard_index(log_group_arn)
+            updates.setdefault(shard_index, {})[log_group_arn] = {
                 "tags": log_group_tags,
-                "last_modified": time(),
+                "last_modified": int(time()),
             }
-            send_forwarder_internal_metrics("loggroup_s3_cache_hit")
-            return log_group_tags
+            self._set_local_tags(log_group_arn, log_group_tags)
+
+        for shard_index, shard_updates in updates.items():
+            if shard_index not in unreadable_shard_indexes:
+                self._put_shard(shard_index, shards[shard_index], shard_updates)
 
-        # finally, make an api call, update and return
-        log_group_tags = self._get_log_group_tags(log_group_arn) or []
-        self._update_log_group_tags_cache(log_group_arn, log_group_tags)
+    def _fetch_log_group_tags(self, log_group_arn):
+        self.prefetch([log_group_arn])
+        return self.tags_by_log_group.get(log_group_arn, {}).get("tags", [])
+
+    def _set_local_tags(self, log_group_arn, log_group_tags):
         self.tags_by_log_group[log_group_arn] = {
             "tags": log_group_tags,
             "last_modified": time(),
         }
 
-        return log_group_tags
-
-    def _get_log_group_tags_from_cache(self, cache_file_name):
+    def _get_shard(self, shard_index):
+        """Fetches a cache shard, a dict of the tags of its log groups and when
+        they were fetched, keyed by log group ARN, or None if it can't be read.
+        If the shard in memory is the same version as the cache file, the file
+        isn't downloaded again"""
+        cached = self._shards.get(shard_index)
         try:
+            kwargs = {"IfNoneMatch": cached["etag"]} if cached else {}
             response = self.s3_client.get_object(
-                Bucket=self.bucket_name, Key=cache_file_name
+                Bucket=self.bucket_name,
+                Key=self._get_shard_file_name(shard_index),
+                **kwargs,
             )
-            tags_cache = json.loads(response.get("Body").read().decode("utf-8"))
-            last_modified_unix_time = int(response.get("LastModified").timestamp())
+            shard = json.loads(response.get("Body").read().decode("utf-8"))
+        except ClientError as e:
+            if cached and is_not_modified(e):
+                send_forwarder_internal_metrics("loggroup_s3_cache_not_modified")
+                return cached["shard"]
+            if e.response.get("Error", {}).get("Code") == "NoSuchKey":
+                self._shards.pop(shard_index, None)
+            else:
+                send_forwarder_internal_metrics("loggroup_cache_fetch_failure")
+                self.logger.exception(
+                    "Failed to get log group tags from cache", exc_info=True
+                )
+                return None
+            return {}
         except Exception:
             send_forwarder_internal_metrics("loggroup_cache_fetch_failure")
             self.logger.exception(
                 "Failed to get log group tags from cache", exc_info=True
             )
-            return None, -1
+            return None
 
-        return tags_cache, last_modified_unix_time
+        self._shards[shard_index] = {"shard": shard, "etag": response.get("ETag")}
+        return shard
 
-    def _update_log_group_tags_cache(self, log_group, tags):
-        cache_file_name = self._get_cache_file_name(log_group)
-        try:
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=cache_file_name,
-                Body=(bytes(json.dumps(tags).encode("UTF-8"))),
-            )
-        except Exception:
-            send_forwarder_internal_metrics("loggroup_cache_write_failure")
-            self.logger.exception(
-                "Failed to update log group tags cache", exc_info=True
-            )
+    def _put_shard(self, shard_index, shard, updates):
+        """Writes a cache shard with the updated entries, only if the shard is
+        still the version that was read. If another container wrote it in the
+        meantime, the entries are added to the shard read again and the write
+        is retried, so that neither container loses the log groups it added"""
+        for attempt in range(1, SHARD_WRITE_MAX_ATTEMPTS + 1):
+            shard.update(updates)
+            # Log groups that were not seen for a while may no longer exist
+            for log_group_arn, entry in list(shard.items()):
+                if self._is_expired(entry.get("last_modified")):
+                    del shard[log_group_arn]
+            cached = self._shards.get(shard_index)
+            if cached and cached["etag"]:
+                condition = {"IfMatch": cached["etag"]}
+            else:
+                condition = {"IfNoneMatch": "*"}
+            try:
+                response = self.s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=self._get_shard_file_name(shard_index),
+                    Body=(bytes(json.dumps(shard).encode("UTF-8"))),
+                    **condition,
+                )
+            except ClientError as e:
+                if not is_precondition_failed(e) or attempt == SHARD_WRITE_MAX_ATTEMPTS:
+                    break
+                send_forwarder_internal_metrics("loggroup_cache_write_conflict")
+                shard = self._get_shard(shard_index)
+                if shard is None:
+                    break
+                continue
+            except Exception:
+                break
+            self._shards[shard_index] = {"shard": shard, "etag": response.get("ETag")}
+            return
+
+        send_forwarder_internal_metrics("loggroup_cache_write_failure")
+        self.logger.exception("Failed to update log group tags cache", exc_info=True)
+        self._shards.pop(shard_index, None)
 
     def _is_expired(self, last_modified):
         if not last_modified:
@@ -135,9 +253,11 @@ class CloudwatchLogGroupTagsCache:
         )
         return time() > earliest_time_to_refetch_tags
 
-    def _get_cache_file_name(self, log_group_arn):
-        log_group_name = log_group_arn.replace("/", "_").replace(":", "_")
-        return f"{self._get_cache_file_prefix()}/{log_group_name}.json"
+    def _get_shard_index(self, log_group_arn):
+        return zlib.crc32(log_group_arn.encode("UTF-8")) % self.shard_count
+
+    def _get_shard_file_name(self, shard_index):
+        return f"{self._get_cache_file_prefix()}/shards/{shard_index}.json"
 
     def _get_cache_file_prefix(self):
         return f"{self.cache_dirname}/{self.cache_prefix}"
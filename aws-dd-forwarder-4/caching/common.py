@@ -1,9 +1,13 @@
 import os
 import datetime
+import gzip
+import json
 import logging
 import re
 from collections import defaultdict
 
+from settings import DD_S3_CACHE_COMPRESSION_MIN_SIZE_BYTES
+
 logger = logging.getLogger()
 logger.setLevel(logging.getLevelName(os.environ.get("DD_LOG_LEVEL", "INFO").upper()))
 
@@ -14,6 +18,34 @@ Dedupe = re.compile(r"_+", re.UNICODE).sub
 FixInit = re.compile(r"^[_\d]*", re.UNICODE).sub
 
 
+def encode_cache_body(data):
+    """Serializes a cache to JSON, gzipped if it is large"""
+    body = json.dumps(data).encode("UTF-8")
+    if len(body) >= DD_S3_CACHE_COMPRESSION_MIN_SIZE_BYTES:
+        body = gzip.compress(body)
+    return body
+
+
+def decode_cache_body(body):
+    """Deserializes a cache written by encode_cache_body, gzipped or not"""
+    if body[:2] == b"\x1f\x8b":
+        body = gzip.decompress(body)
+    return json.loads(body.decode("UTF-8"))
+
+
+def is_not_modified(client_error):
+    """Returns whether a conditional S3 GET failed because the object is unchanged"""
+    metadata = client_error.response.get("ResponseMetadata", {})
+    return metadata.get("HTTPStatusCode") == 304
+
+
+def is_precondition_failed(client_error):
+    """Returns whether a conditional S3 PUT failed because the object changed"""
+    metadata = client_error.response.get("ResponseMetadata", {})
+    # 409 when another conditional write to the object is in progress
+    return metadata.get("HTTPStatusCode") in (409, 412)
+
+
 def get_last_modified_time(s3_file):
     last_modified_str = s3_file["ResponseMetadata"]["HTTPHeaders"]["last-modified"]
     last_modified_date = datetime.datetime.strptime(
@@ -85,6 +85,6 @@ class LambdaTagsCache(BaseTagsCache):
         if self._is_expired():
             send_forwarder_internal_metrics("local_lambda_cache_expired")
             self.logger.debug("Local cache expired, fetching cache from S3")
-            self._refresh()
+            self._revalidate()
 
         return self.tags_by_id.get(key, [])
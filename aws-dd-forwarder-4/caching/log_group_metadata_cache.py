@@ -0,0 +1,43 @@
+from collections import OrderedDict
+from time import time
+
+from settings import (
+    DD_LOG_GROUP_METADATA_CACHE_SIZE,
+    DD_LOG_GROUP_METADATA_CACHE_TTL_SECONDS,
+)
+
+
+class LogGroupMetadataCache:
+    """In-memory LRU cache of the metadata built for CloudWatch log groups
+
+    Entries expire after a TTL so that changes to the tags they were built
+    from are eventually picked up.
+    """
+
+    def __init__(
+        self,
+        max_size=DD_LOG_GROUP_METADATA_CACHE_SIZE,
+        ttl_seconds=DD_LOG_GROUP_METADATA_CACHE_TTL_SECONDS,
+    ):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+        if time() >= expires_at:
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self.entries[key] = (value, time() + self.ttl_seconds)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
@@ -59,6 +59,6 @@ class S3TagsCache(BaseTagsCache):
         if self._is_expired():
             send_forwarder_internal_metrics("local_s3_tags_cache_expired")
             self.logger.debug("Local cache expired, fetching cache from S3")
-            self._refresh()
+            self._revalidate()
 
         return self.tags_by_id.get(bucket_arn, [])
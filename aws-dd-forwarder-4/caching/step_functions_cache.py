@@ -82,7 +82,7 @@ class StepFunctionsTagsCache(BaseTagsCache):
             self.logger.debug(  # noqa: F821
                 "Local cache expired for Step Functions tags. Fetching cache from S3"
             )
-            self._refresh()
+            self._revalidate()
 
         state_machine_tags = self.tags_by_id.get(state_machine_arn, None)
         if state_machine_tags is None:
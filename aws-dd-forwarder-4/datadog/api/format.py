@@ -1,6 +1,7 @@
 # Unless explicitly stated otherwise all files in this repository are licensed under the BSD-3-Clause License.
 # This product includes software developed at Datadog (https://www.datadoghq.com/).
 # Copyright 2015-Present Datadog, Inc
+from array import array
 from numbers import Number
 import sys
 import time
@@ -34,7 +35,10 @@ def format_points(points):
         # Distributions contain a list of points
         else:
             timestamp = point[0]
-            if isinstance(point[1], Iterable):
+            # Compact distributions hold their values in an array of doubles
+            if isinstance(point[1], array) and point[1].typecode == "d":
+                value = point[1].tolist()
+            elif isinstance(point[1], Iterable):
                 value = [float(p) for p in point[1]]
             else:
                 value = float(point[1])
@@ -25,7 +25,18 @@ except ImportError:
 from datadog.api.exceptions import ApiNotInitialized
 from datadog.threadstats.constants import MetricType
 from datadog.threadstats.events import EventsAggregator
-from datadog.threadstats.metrics import MetricsAggregator, Counter, Gauge, Histogram, Timing, Distribution, Set
+from datadog.threadstats.metrics import (
+    MetricsAggregator,
+    Counter,
+    Gauge,
+    Histogram,
+    Timing,
+    Distribution,
+    Set,
+    CompactHistogram,
+    CompactTiming,
+    CompactDistribution,
+)
 from datadog.threadstats.reporters import HttpReporter
 
 # Loggers
@@ -39,7 +50,7 @@ DD_ENV_TAGS_MAPPING = {
 
 
 class ThreadStats(object):
-    def __init__(self, namespace="", constant_tags=None, compress_payload=False):
+    def __init__(self, namespace="", constant_tags=None, compress_payload=False, compact_values=None):
         """
         Initialize a threadstats object.
 
@@ -52,6 +63,11 @@ class ThreadStats(object):
         :param compress_payload: compress the payload using zlib
         :type compress_payload: bool
 
+        :param compact_values: keep the values of distributions, histograms and timings
+        in arrays of doubles, and a running sum rather than every value of histograms and
+        timings. Defaults to the DATADOG_COMPACT_VALUES environment variable.
+        :type compact_values: bool
+
         :envvar DATADOG_TAGS: Tags to attach to every metric reported by ThreadStats client
         :type DATADOG_TAGS: comma-delimited string
 
@@ -66,6 +82,10 @@ class ThreadStats(object):
         :envvar DD_VERSION: the version of the service running the ThreadStats client.
         If set, it is appended to the constant (global) tags of the client.
         :type DD_VERSION: string
+
+        :envvar DATADOG_COMPACT_VALUES: whether to keep compact values when
+        ``compact_values`` is not given.
+        :type DATADOG_COMPACT_VALUES: boolean string
         """
         # Parameters
         self.namespace = namespace
@@ -77,6 +97,16 @@ class ThreadStats(object):
         if constant_tags is None:
             constant_tags = []
         self.constant_tags = constant_tags + env_tags
+        if compact_values is None:
+            compact_values = os.environ.get("DATADOG_COMPACT_VALUES", "").lower() == "true"
+        if compact_values:
+            self._histogram_class = CompactHistogram
+            self._timing_class = CompactTiming
+            self._distribution_class = CompactDistribution
+        else:
+            self._histogram_class = Histogram
+            self._timing_class = Timing
+            self._distribution_class = Distribution
 
         # State
         self._disabled = True
@@ -278,7 +308,7 @@ class ThreadStats(object):
         """
         if not self._disabled:
             self._metric_aggregator.add_point(
-                metric_name, tags, timestamp or time(), value, Histogram, sample_rate=sample_rate, host=host
+                metric_name, tags, timestamp or time(), value, self._histogram_class, sample_rate=sample_rate, host=host
             )
 
     def distribution(self, metric_name, value, timestamp=None, tags=None, sample_rate=1, host=None):
@@ -292,7 +322,25 @@ class ThreadStats(object):
         """
         if not self._disabled:
             self._metric_aggregator.add_point(
-                metric_name, tags, timestamp or time(), value, Distribution, sample_rate=sample_rate, host=host
+                metric_name,
+                tags,
+                timestamp or time(),
+                value,
+                self._distribution_class,
+                sample_rate=sample_rate,
+                host=host,
+            )
+
+    def distributions(self, metric_name, values, timestamp=None, tags=None, host=None):
+        """
+        Sample several values of a distribution at once, all at the same
+        ``timestamp``. Equivalent to calling ``distribution`` for each value.
+
+        >>> stats.distributions("uploaded_file.size", [1024, 2048])
+        """
+        if not self._disabled:
+            self._metric_aggregator.add_points(
+                metric_name, tags, timestamp or time(), values, self._distribution_class, host=host
             )
 
     def timing(self, metric_name, value, timestamp=None, tags=None, sample_rate=1, host=None):
@@ -303,7 +351,7 @@ class ThreadStats(object):
         """
         if not self._disabled:
             self._metric_aggregator.add_point(
-                metric_name, tags, timestamp or time(), value, Timing, sample_rate=sample_rate, host=host
+                metric_name, tags, timestamp or time(), value, self._timing_class, sample_rate=sample_rate, host=host
             )
 
     @contextmanager
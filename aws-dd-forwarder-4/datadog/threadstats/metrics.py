@@ -4,6 +4,7 @@
 """
 Metric roll-up classes.
 """
+from array import array
 from collections import defaultdict
 import random
 import itertools
@@ -23,6 +24,11 @@ class Metric(object):
         """ Add a point to the given metric. """
         raise NotImplementedError()
 
+    def add_points(self, values):
+        """ Add several points to the given metric. """
+        for value in values:
+            self.add_point(value)
+
     def flush(self, timestamp, interval):
         """ Flush all metrics up to the given timestamp. """
         raise NotImplementedError()
@@ -97,10 +103,24 @@ class Distribution(Metric):
     def add_point(self, value):
         self.value.append(value)
 
+    def add_points(self, values):
+        self.value.extend(values)
+
     def flush(self, timestamp, interval):
         return [(timestamp, self.value, self.name, self.tags, self.host, MetricType.Distribution, interval)]
 
 
+class CompactDistribution(Distribution):
+    """
+    A distribution metric keeping its values in an array of doubles, 8 bytes
+    per value instead of a float object and a list slot.
+    """
+
+    def __init__(self, name, tags, host):
+        super(CompactDistribution, self).__init__(name, tags, host)
+        self.value = array("d")
+
+
 class Histogram(Metric):
     """ A histogram metric. """
 
@@ -147,9 +167,9 @@ class Histogram(Metric):
             (timestamp, self.average(), "%s.avg" % self.name, self.tags, self.host, MetricType.Gauge, interval),
         ]
         length = len(self.samples)
-        self.samples.sort()
+        samples = sorted(self.samples)
         for p in self.percentiles:
-            val = self.samples[int(round(p * length - 1))]
+            val = samples[int(round(p * length - 1))]
             name = "%s.%spercentile" % (self.name, int(p * 100))
             metrics.append((timestamp, val, name, self.tags, self.host, MetricType.Gauge, interval))
         return metrics
@@ -159,6 +179,31 @@ class Histogram(Metric):
         return float(sum_metrics) / self.count
 
 
+class CompactHistogram(Histogram):
+    """
+    A histogram metric keeping a running sum rather than every value, its
+    samples in an array of doubles.
+    """
+
+    def __init__(self, name, tags, host):
+        super(CompactHistogram, self).__init__(name, tags, host)
+        self.sum = 0.0
+        self.samples = array("d")
+
+    def add_point(self, value):
+        self.max = self.max if self.max > value else value
+        self.min = self.min if self.min < value else value
+        self.sum += value
+        if self.count < self.sample_size:
+            self.samples.append(value)
+        else:
+            self.samples[random.randrange(0, self.sample_size)] = value
+        self.count = iternext(self.iter_counter)
+
+    def average(self):
+        return float(self.sum) / self.count
+
+
 class Timing(Histogram):
     """
     A timing metric.
@@ -168,24 +213,55 @@ class Timing(Histogram):
     stats_tag = "ms"
 
 
+class CompactTiming(CompactHistogram):
+    """
+    A timing metric.
+    Inherit from CompactHistogram to workaround and support it in API mode
+    """
+
+    stats_tag = "ms"
+
+
 class MetricsAggregator(object):
     """
     A small class to handle the roll-ups of multiple metrics at once.
+
+    Metrics are spread over shards by the hash of their key, each shard with
+    its own lock, so that threads adding points to different metrics seldom
+    wait for each other.
     """
 
-    def __init__(self, roll_up_interval=10):
-        self._lock = threading.RLock()
-        self._metrics = defaultdict(lambda: {})
+    # Beyond this many tag lists, the keys of the tag lists are forgotten
+    tags_keys_max_size = 10000
+
+    def __init__(self, roll_up_interval=10, shard_count=16):
+        self._locks = [threading.Lock() for _ in range(shard_count)]
+        self._shards = [defaultdict(lambda: {}) for _ in range(shard_count)]
         self._roll_up_interval = roll_up_interval
+        # id of a tag list to the list, a copy of it and its sorted tuple
+        self._tags_keys = {}
 
     def add_point(self, metric, tags, timestamp, value, metric_class, sample_rate=1, host=None):
         # The sample rate is currently ignored for in process stuff
         interval = timestamp - timestamp % self._roll_up_interval
-        key = (metric, host, tuple(sorted(tags)) if tags else None)
-        with self._lock:
-            if key not in self._metrics[interval]:
-                self._metrics[interval][key] = metric_class(metric, tags, host)
-            self._metrics[interval][key].add_point(value)
+        key = (metric, host, self._get_tags_key(tags))
+        shard = hash(key) % len(self._shards)
+        with self._locks[shard]:
+            metrics = self._shards[shard][interval]
+            if key not in metrics:
+                metrics[key] = metric_class(metric, tags, host)
+            metrics[key].add_point(value)
+
+    def add_points(self, metric, tags, timestamp, values, metric_class, host=None):
+        """ Add several points of the same series, taking the lock once. """
+        interval = timestamp - timestamp % self._roll_up_interval
+        key = (metric, host, self._get_tags_key(tags))
+        shard = hash(key) % len(self._shards)
+        with self._locks[shard]:
+            metrics = self._shards[shard][interval]
+            if key not in metrics:
+                metrics[key] = metric_class(metric, tags, host)
+            metrics[key].add_points(values)
 
     def flush(self, timestamp):
         """ Flush all metrics up to the given timestamp. """
@@ -194,10 +270,38 @@ class MetricsAggregator(object):
         else:
             interval = timestamp - timestamp % self._roll_up_interval
 
-        with self._lock:
-            past_intervals = [i for i in self._metrics.keys() if i < interval]
-            metrics = []
-            for i in past_intervals:
-                for m in list(self._metrics.pop(i).values()):
-                    metrics += m.flush(i, self._roll_up_interval)
+        past_metrics = defaultdict(list)
+        for lock, shard in zip(self._locks, self._shards):
+            with lock:
+                past_intervals = [i for i in shard.keys() if i < interval]
+                for i in past_intervals:
+                    past_metrics[i].extend(shard.pop(i).values())
+
+        # In the same order whatever the shards the metrics were in
+        metrics = []
+        for i in sorted(past_metrics):
+            for m in sorted(past_metrics[i], key=lambda m: (m.name, m.host or "", _tags_key(m.tags) or ())):
+                metrics += m.flush(i, self._roll_up_interval)
         return metrics
+
+    def _get_tags_key(self, tags):
+        """
+        Returns the sorted tuple of the tags, memoized by the identity of the
+        list, as the same list of tags is often passed for every point.
+        """
+        if not tags:
+            return None
+        memo = self._tags_keys.get(id(tags))
+        # The list may have been modified since, or be a new list with the id
+        # of one freed, which holding a reference to the list prevents
+        if memo is not None and memo[0] is tags and memo[1] == tags:
+            return memo[2]
+        key = _tags_key(tags)
+        if len(self._tags_keys) >= self.tags_keys_max_size:
+            self._tags_keys.clear()
+        self._tags_keys[id(tags)] = (tags, tags[:], key)
+        return key
+
+
+def _tags_key(tags):
+    return tuple(sorted(tags)) if tags else None
@@ -0,0 +1,41 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+
+
+from time import monotonic
+
+from settings import DD_LAMBDA_TIMEOUT_MARGIN_SECONDS
+
+
+class Deadline(object):
+    """
+    Time by which the forwarder must be done sending data, a safety margin
+    before the Lambda times out. The margin is kept to store the data that
+    could not be sent in the retry storage.
+    """
+
+    def __init__(
+        self, remaining_seconds, margin_seconds=DD_LAMBDA_TIMEOUT_MARGIN_SECONDS
+    ):
+        self.timeout_at = monotonic() + remaining_seconds
+        self.margin_seconds = margin_seconds
+
+    @classmethod
+    def from_context(cls, context):
+        """Returns the deadline of the invocation, None if the context has none"""
+        if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+            return None
+        return cls(context.get_remaining_time_in_millis() / 1000)
+
+    def remaining(self):
+        """Seconds left before the deadline, negative once it has passed"""
+        return self.timeout_at - self.margin_seconds - monotonic()
+
+    def has_time_for(self, seconds):
+        return self.remaining() > seconds
+
+    def remaining_before_timeout(self):
+        """Seconds left before the Lambda times out, margin included"""
+        return self.timeout_at - monotonic()
@@ -6,9 +6,14 @@ import json
 import os
 import logging
 import re
+import sys
 import datetime
 from time import time
 
+from metric_aggregator import LogMetricAggregator
+from steps.parsed_event import get_json_message
+from telemetry import get_log_metric_roll_up_interval, send_log_metric_series
+
 ENHANCED_METRICS_NAMESPACE_PREFIX = "aws.lambda.enhanced"
 
 # Latest Lambda pricing per https://aws.amazon.com/lambda/pricing/
@@ -54,6 +59,14 @@ OUT_OF_MEMORY_ERROR_STRINGS = [
     "failed to allocate memory (NoMemoryError)",  # Ruby
 ]
 
+# Text that messages must contain to match each parser, checked before the
+# parsers run. Every string of OUT_OF_MEMORY_ERROR_STRINGS contains one of
+# OUT_OF_MEMORY_ERROR_SUBSTRINGS.
+JSON_REPORT_TYPE = "platform.report"
+REPORT_LOG_PREFIX = "REPORT"
+TIMED_OUT_PREFIX = "Task"
+OUT_OF_MEMORY_ERROR_SUBSTRINGS = ["MemoryError", "out of memory"]
+
 METRICS_TO_PARSE_FROM_REPORT = [
     DURATION_METRIC_NAME,
     BILLED_DURATION_METRIC_NAME,
@@ -96,28 +109,56 @@ except ImportError:
     DD_SUBMIT_ENHANCED_METRICS = False
 
 
+# Beyond this many distinct tag combinations, the shared tags are forgotten
+SHARED_TAGS_MAX_SIZE = 10000
+
+_shared_tags = {}
+
+
+def share_tags(tags):
+    """Returns a tuple of the tags shared by every metric point with the same tags
+
+    Metric points of the same Lambda, memory size and cold start all hold a
+    reference to the same tuple of interned tags rather than each their copy.
+    """
+    tags = tuple(tags)
+    shared = _shared_tags.get(tags)
+    if shared is None:
+        if len(_shared_tags) >= SHARED_TAGS_MAX_SIZE:
+            _shared_tags.clear()
+        shared = _shared_tags[tags] = tuple(sys.intern(tag) for tag in tags)
+    return shared
+
+
 class DatadogMetricPoint(object):
     """Holds a datapoint's data so that it can be prepared for submission to DD
 
     Properties:
         name (str): metric name, with namespace
         value (int | float): the datapoint's value
+        tags (tuple<str>): the datapoint's tags, shared with other datapoints
 
     """
 
-    def __init__(self, name, value, timestamp=None, tags=[]):
+    __slots__ = ("name", "value", "timestamp", "tags")
+
+    def __init__(self, name, value, timestamp=None, tags=()):
         self.name = name
         self.value = value
-        self.tags = tags
+        self.tags = share_tags(tags)
         self.timestamp = timestamp
 
+    def to_dict(self):
+        """Returns the attributes of this metric as a dict, to serialize it"""
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
     def add_tags(self, tags):
         """Add tags to this metric
 
         Args:
             tags (str[]): list of tags to add to this metric
         """
-        self.tags = self.tags + tags
+        self.tags = share_tags(self.tags + tuple(tags))
 
     def set_timestamp(self, timestamp):
         """Set the metric's timestamp
@@ -137,7 +178,7 @@ class DatadogMetricPoint(object):
             "Submitting metric {} {} {}".format(self.name, self.value, self.tags)
         )
         lambda_stats.distribution(
-            self.name, self.value, timestamp=timestamp, tags=self.tags
+            self.name, self.value, timestamp=timestamp, tags=list(self.tags)
         )
 
 
@@ -161,19 +202,117 @@ def parse_and_submit_enhanced_metrics(logs, cache_layer):
     if not DD_SUBMIT_ENHANCED_METRICS:
         return
 
+    parser = EnhancedMetricsParser(cache_layer.get_lambda_tags_cache())
     for log in logs:
+        parser.add(log)
+    parser.submit()
+
+
+def parse_and_submit_enhanced_metrics_stream(logs, cache_layer):
+    """Yields the logs, parsing the enhanced metrics of each log once the
+    consumer is done with it, and submits them once the stream is consumed,
+    like `parse_and_submit_enhanced_metrics` does after the logs have been
+    forwarded
+
+    Args:
+        logs (iterable<dict>): the stream of logs produced by the split step
+    """
+    if not DD_SUBMIT_ENHANCED_METRICS:
+        yield from logs
+        return
+
+    parser = EnhancedMetricsParser(cache_layer.get_lambda_tags_cache())
+    try:
+        for log in logs:
+            yield log
+            parser.add(log)
+    finally:
+        parser.submit()
+
+
+class EnhancedMetricsParser(object):
+    """Parses the enhanced metrics of a batch of logs, then submits them at once
+
+    Produces the same metrics as `generate_enhanced_lambda_metrics`, but only
+    decodes or matches a message against the regexes once it contains the
+    text each kind of metric requires, which few logs do. The tags of each
+    Lambda are built once per batch, and the metric points are aggregated in
+    series, each submitted in one call.
+    """
+
+    def __init__(self, tags_cache):
+        self.tags_cache = tags_cache
+        self.aggregator = LogMetricAggregator(get_log_metric_roll_up_interval())
+        self._tags_by_arn = {}
+
+    def add(self, log):
         try:
-            enhanced_metrics = generate_enhanced_lambda_metrics(
-                log, cache_layer.get_lambda_tags_cache()
-            )
-            for enhanced_metric in enhanced_metrics:
-                enhanced_metric.submit_to_dd()
+            self._add(log)
         except Exception:
             logger.exception(
-                "Encountered an error while trying to parse and submit enhanced metrics for log %s",
+                "Encountered an error while trying to parse enhanced metrics for log %s",
                 log,
             )
 
+    def submit(self):
+        for name, tags, timestamp, values in self.aggregator.series():
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Submitting metric {name} {list(values)} {tags}")
+            try:
+                send_log_metric_series(name, values, timestamp, tags)
+            except Exception:
+                logger.exception(
+                    "Encountered an error while trying to submit enhanced metric %s",
+                    name,
+                )
+
+    def _add(self, log):
+        # Note: this arn attribute is always lowercased when it's created
+        log_function_arn = log.get("lambda", {}).get("arn")
+        log_message = log.get("message")
+        timestamp = log.get("timestamp")
+
+        is_lambda_log = all((log_function_arn, log_message, timestamp))
+        if not is_lambda_log:
+            return
+
+        parsed_metrics = []
+        # Same order as generate_enhanced_lambda_metrics, skipping the parsers
+        # that cannot match the message
+        if JSON_REPORT_TYPE in log_message:
+            parsed_metrics = parse_metrics_from_json_report(get_json_message(log))
+        if not parsed_metrics and REPORT_LOG_PREFIX in log_message:
+            parsed_metrics = parse_metrics_from_report_log(log_message)
+        if not parsed_metrics and TIMED_OUT_PREFIX in log_message:
+            parsed_metrics = create_timeout_enhanced_metric(log_message)
+        if not parsed_metrics and any(
+            s in log_message for s in OUT_OF_MEMORY_ERROR_SUBSTRINGS
+        ):
+            parsed_metrics = create_out_of_memory_enhanced_metric(log_message)
+        if not parsed_metrics:
+            return
+
+        tags = self._get_tags(log_function_arn)
+        timestamp = int(timestamp)
+        for parsed_metric in parsed_metrics:
+            self.aggregator.add_point(
+                parsed_metric.name,
+                parsed_metric.value,
+                timestamp,
+                parsed_metric.tags + tags,
+            )
+
+    def _get_tags(self, log_function_arn):
+        """Returns the tags from the ARN and the custom tags of the Lambda"""
+        tags = self._tags_by_arn.get(log_function_arn)
+        if tags is None:
+            tags = share_tags(
+                parse_lambda_tags_from_arn(log_function_arn)
+                + self.tags_cache.get(log_function_arn)
+            )
+            self._tags_by_arn[log_function_arn] = tags
+        return tags
+
 
 def generate_enhanced_lambda_metrics(log, tags_cache):
     """Parses a Lambda log for enhanced Lambda metrics and tags
@@ -217,7 +356,7 @@ def generate_enhanced_lambda_metrics(log, tags_cache):
         return []
 
     # Check if its Lambda lifecycle log that is emitted if log format is set to JSON
-    parsed_metrics = parse_metrics_from_json_report_log(log_message)
+    parsed_metrics = parse_metrics_from_json_report(get_json_message(log))
 
     # Check if this is a REPORT log
     if not parsed_metrics:
@@ -238,9 +377,10 @@ def generate_enhanced_lambda_metrics(log, tags_cache):
     # Add the tags from ARN, custom tags cache, and env var
     tags_from_arn = parse_lambda_tags_from_arn(log_function_arn)
     lambda_custom_tags = tags_cache.get(log_function_arn)
+    lambda_tags = tags_from_arn + lambda_custom_tags
 
     for parsed_metric in parsed_metrics:
-        parsed_metric.add_tags(tags_from_arn + lambda_custom_tags)
+        parsed_metric.add_tags(lambda_tags)
         # Submit the metric with the timestamp of the log event
         parsed_metric.set_timestamp(int(timestamp))
 
@@ -278,11 +418,26 @@ def parse_metrics_from_json_report_log(log_message):
     except json.JSONDecodeError:
         return []
 
+    return parse_metrics_from_json_report(body)
+
+
+def parse_metrics_from_json_report(body):
+    """Parses and returns metrics from an already decoded JSON lifecycle log
+
+    Args:
+        body (dict | None): the decoded log message, None if it is not JSON
+
+    Returns:
+        metrics - DatadogMetricPoint[]
+    """
+    if not isinstance(body, dict):
+        return []
+
     stage = body.get("type", "")
     record = body.get("record", {})
     record_metrics = record.get("metrics", {})
 
-    if stage != "platform.report" or not record_metrics:
+    if stage != JSON_REPORT_TYPE or not record_metrics:
         return []
 
     metrics = []
@@ -7,20 +7,30 @@
 import logging
 import json
 import os
-
-from telemetry import send_event_metric, send_log_metric
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from metric_aggregator import LogMetricAggregator
+from telemetry import (
+    get_log_metric_roll_up_interval,
+    send_event_metric,
+    send_log_metric_series,
+)
 from trace_forwarder.connection import TraceConnection
 from logs.datadog_http_client import DatadogHTTPClient
+from logs.datadog_async_http_client import DatadogAsyncHTTPClient
 from logs.datadog_batcher import DatadogBatcher
 from logs.datadog_client import DatadogClient
 from logs.datadog_tcp_client import DatadogTCPClient
 from logs.datadog_scrubber import DatadogScrubber
-from logs.helpers import filter_logs, add_retry_tag
+from logs.exceptions import ScrubbingException
+from logs.helpers import filter_logs, filter_logs_stream, add_retry_tag
 from retry.storage import Storage
 from retry.enums import RetryPrefix
+from retry.replay import Replay
 from settings import (
     DD_API_KEY,
     DD_USE_TCP,
+    DD_USE_ASYNC_HTTP,
     DD_NO_SSL,
     DD_SKIP_SSL_VALIDATION,
     DD_URL,
@@ -28,7 +38,10 @@ from settings import (
     DD_TRACE_INTAKE_URL,
     DD_FORWARD_LOG,
     DD_STORE_FAILED_EVENTS,
+    DD_USE_COMPRESSION,
+    DD_COMPRESSION_LEVEL,
     SCRUBBING_RULE_CONFIGS,
+    DD_MIN_TIME_PER_BATCH_SECONDS,
     INCLUDE_AT_MATCH,
     EXCLUDE_AT_MATCH,
 )
@@ -43,53 +56,138 @@ class Forwarder(object):
             DD_TRACE_INTAKE_URL, DD_API_KEY, DD_SKIP_SSL_VALIDATION
         )
         self.storage = Storage(function_prefix)
+        # Logs, metrics and traces go to independent endpoints, one thread each
+        self.executor = ThreadPoolExecutor(
+            max_workers=len(RetryPrefix), thread_name_prefix="forwarder"
+        )
 
-    def forward(self, logs, metrics, traces):
+    def forward(self, logs, metrics, traces, deadline=None):
         """
-        Forward logs, metrics, and traces to Datadog in a background thread.
+        Forward logs, metrics, and traces to Datadog concurrently.
         """
+        sinks = [
+            partial(self._forward_metrics, metrics),
+            partial(self._forward_traces, traces, deadline=deadline),
+        ]
         if DD_FORWARD_LOG:
-            self._forward_logs(logs)
-        self._forward_metrics(metrics)
-        self._forward_traces(traces)
+            sinks.append(partial(self._forward_logs, logs, deadline=deadline))
+        self._run_concurrently(sinks)
+
+    def forward_stream(self, logs, metrics, traces, deadline=None):
+        """
+        Forward a stream of logs to Datadog one batch at a time, then forward
+        the metrics and traces collected while the logs were consumed.
+        """
+        if DD_FORWARD_LOG:
+            self._forward_logs_stream(logs, deadline=deadline)
+        else:
+            # The logs still need to be consumed to collect metrics and traces
+            for _ in logs:
+                pass
+        self._run_concurrently(
+            [
+                partial(self._forward_metrics, metrics),
+                partial(self._forward_traces, traces, deadline=deadline),
+            ]
+        )
 
-    def retry(self):
+    def retry(self, deadline=None):
         """
-        Retry forwarding logs, metrics, and traces to Datadog.
+        Retry forwarding logs, metrics, and traces to Datadog concurrently.
         """
-        for prefix in RetryPrefix:
-            self._retry_prefix(prefix)
+        self._run_concurrently(
+            [partial(self._retry_prefix, prefix, deadline) for prefix in RetryPrefix]
+        )
 
-    def _retry_prefix(self, prefix):
+    def _run_concurrently(self, sinks):
+        """
+        Runs the sinks in the executor and waits for all of them, so that a sink
+        failing doesn't stop the others. Errors are raised once they are done,
+        grouped in an ExceptionGroup if several sinks failed.
+        """
+        futures = [self.executor.submit(sink) for sink in sinks]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if len(errors) == 1:
+            raise errors[0]
+        if errors:
+            raise ExceptionGroup("Failed to forward data to Datadog", errors)
+
+    def _retry_prefix(self, prefix, deadline=None):
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"Retrying {prefix} data")
 
-        key_data = self.storage.get_data(prefix)
-
-        for k, d in key_data.items():
-            if d is None:
-                continue
+        def forward(k, d):
             match prefix:
                 case RetryPrefix.LOGS:
-                    self._forward_logs(d, key=k)
+                    return self._forward_logs(d, key=k, deadline=deadline)
                 case RetryPrefix.METRICS:
-                    self._forward_metrics(d, key=k)
+                    return self._forward_metrics(d, key=k)
                 case RetryPrefix.TRACES:
-                    self._forward_traces(d, key=k)
+                    return self._forward_traces(d, key=k, deadline=deadline)
 
-    def _forward_logs(self, logs, key=None):
-        """Forward logs to Datadog"""
+        # Stored segments are forwarded one at a time, never all loaded at once
+        Replay(self.storage, prefix, deadline).run(forward)
+
+    def _forward_logs(self, logs, key=None, deadline=None):
+        """Forward logs to Datadog, returning whether all of them were forwarded"""
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"Forwarding {len(logs)} logs")
 
         scrubber = DatadogScrubber(SCRUBBING_RULE_CONFIGS)
-        logs_to_forward = []
+        logs_to_forward = list(self._serialize_logs(logs, scrubber, key))
+        logs_to_forward = filter_logs(
+            logs_to_forward, INCLUDE_AT_MATCH, EXCLUDE_AT_MATCH
+        )
+
+        failed_logs = self._send_logs(logs_to_forward, scrubber, deadline)
+
+        if DD_STORE_FAILED_EVENTS and len(failed_logs) > 0 and not key:
+            self.storage.store_data(RetryPrefix.LOGS, failed_logs)
+
+        send_event_metric("logs_forwarded", len(logs_to_forward) - len(failed_logs))
+        return not failed_logs
+
+    def _forward_logs_stream(self, logs, deadline=None):
+        """Forward logs to Datadog, sending each batch as soon as it is full"""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Forwarding logs as a stream")
+
+        scrubber = DatadogScrubber(SCRUBBING_RULE_CONFIGS)
+        logs_count = 0
+
+        def count(logs_to_forward):
+            nonlocal logs_count
+            for log in logs_to_forward:
+                logs_count += 1
+                yield log
+
+        logs_to_forward = filter_logs_stream(
+            self._serialize_logs(logs, scrubber), INCLUDE_AT_MATCH, EXCLUDE_AT_MATCH
+        )
+        failed_logs = self._send_logs(
+            count(logs_to_forward), scrubber, deadline=deadline
+        )
+
+        if DD_STORE_FAILED_EVENTS and len(failed_logs) > 0:
+            self.storage.store_data(RetryPrefix.LOGS, failed_logs)
+
+        send_event_metric("logs_forwarded", logs_count - len(failed_logs))
+
+    def _serialize_logs(self, logs, scrubber, key=None):
         for log in logs:
             if key:
                 log = add_retry_tag(log)
 
-            # apply scrubbing rules to inner log message if exists
-            if isinstance(log, dict) and log.get("message"):
+            # apply scrubbing rules to inner log message if exists, unless
+            # scrubbing the serialized log below gives the same result
+            if (
+                isinstance(log, dict)
+                and log.get("message")
+                and not (
+                    isinstance(log["message"], str)
+                    and scrubber.scrubs_serialized(log["message"])
+                )
+            ):
                 try:
                     log["message"] = scrubber.scrub(log["message"])
                 except Exception as e:
@@ -97,71 +195,164 @@ class Forwarder(object):
                         f"Exception while scrubbing log message {log['message']}: {e}"
                     )
 
-            logs_to_forward.append(json.dumps(log, ensure_ascii=False))
-
-        logs_to_forward = filter_logs(
-            logs_to_forward, INCLUDE_AT_MATCH, EXCLUDE_AT_MATCH
-        )
+            yield json.dumps(log, ensure_ascii=False)
 
+    def _send_logs(self, logs, scrubber, deadline=None):
+        """Send the logs batch by batch, returning the logs that failed"""
+        failed_logs = []
+        spilled_logs = []
+        if DD_STORE_FAILED_EVENTS and deadline is not None:
+            logs = self._stop_at_deadline(logs, deadline, spilled_logs)
         if DD_USE_TCP:
             batcher = DatadogBatcher(256 * 1000, 256 * 1000, 1)
             cli = DatadogTCPClient(DD_URL, DD_PORT, DD_NO_SSL, DD_API_KEY, scrubber)
+            batches = ((batch, batch) for batch in batcher.batch_stream(logs))
         else:
             batcher = DatadogBatcher(512 * 1000, 4 * 1000 * 1000, 400)
-            cli = DatadogHTTPClient(
-                DD_URL, DD_PORT, DD_NO_SSL, DD_SKIP_SSL_VALIDATION, DD_API_KEY, scrubber
+            http_client_class = (
+                DatadogAsyncHTTPClient if DD_USE_ASYNC_HTTP else DatadogHTTPClient
+            )
+            cli = http_client_class(
+                DD_URL,
+                DD_PORT,
+                DD_NO_SSL,
+                DD_SKIP_SSL_VALIDATION,
+                DD_API_KEY,
+                deadline=deadline,
+            )
+            # Logs are scrubbed before being batched, so that the batcher
+            # measures the payload exactly as it is sent, and compressed while
+            # the batch fills up
+            batches = batcher.batch_payloads(
+                self._scrub_logs(logs, scrubber, failed_logs),
+                DD_COMPRESSION_LEVEL if DD_USE_COMPRESSION else None,
             )
 
-        failed_logs = []
-        with DatadogClient(cli) as client:
-            for batch in batcher.batch(logs_to_forward):
+        spilled_logs_count = 0
+        with DatadogClient(cli, deadline=deadline) as client:
+            for batch, payload in batches:
+                # Keep the time left to store the remaining batches rather than
+                # starting batches that could time out the Lambda
+                if (
+                    DD_STORE_FAILED_EVENTS
+                    and deadline is not None
+                    and not deadline.has_time_for(DD_MIN_TIME_PER_BATCH_SECONDS)
+                ):
+                    spilled_logs_count += len(batch)
+                    failed_logs.extend(batch)
+                    continue
                 try:
-                    client.send(batch)
+                    client.send(payload, batch)
                 except Exception:
                     logger.exception(f"Exception while forwarding log batch {batch}")
                     failed_logs.extend(batch)
                 else:
                     if logger.isEnabledFor(logging.DEBUG):
                         logger.debug(f"Forwarded log batch: {batch}")
-                    if key:
-                        self.storage.delete_data(key)
 
-        if DD_STORE_FAILED_EVENTS and len(failed_logs) > 0 and not key:
-            self.storage.store_data(RetryPrefix.LOGS, failed_logs)
+        # Batches sent in the background are only known to have failed once
+        # the client is closed
+        for batch in client.failed_batches:
+            failed_logs.extend(batch)
+        spilled_logs_count += len(spilled_logs)
+        failed_logs.extend(spilled_logs)
 
-        send_event_metric("logs_forwarded", len(logs_to_forward) - len(failed_logs))
+        if batcher.payloads_size_bytes > 0 and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"Built log payloads of {batcher.payloads_size_bytes} bytes, "
+                f"{batcher.compressed_payloads_size_bytes} bytes once compressed"
+            )
+
+        if spilled_logs_count > 0:
+            logger.warning(
+                f"Stored {spilled_logs_count} logs for retry, "
+                "the Lambda is close to timing out"
+            )
+            send_event_metric("logs_spilled", spilled_logs_count)
+
+        if batcher.dropped_items_count > 0:
+            logger.warning(f"Dropped {batcher.dropped_items_count} oversized logs")
+            send_event_metric("logs_dropped_oversized", batcher.dropped_items_count)
+
+        return failed_logs
+
+    def _stop_at_deadline(self, logs, deadline, spilled_logs):
+        """
+        Yields the logs until the Lambda is close to timing out, then adds the
+        remaining ones to spilled_logs as they are, so that no time is spent
+        scrubbing and compressing logs that are only going to be stored
+        """
+        logs = iter(logs)
+        for log in logs:
+            if not deadline.has_time_for(DD_MIN_TIME_PER_BATCH_SECONDS):
+                spilled_logs.append(log)
+                spilled_logs.extend(logs)
+                return
+            yield log
+
+    def _scrub_logs(self, logs, scrubber, failed_logs):
+        for log in logs:
+            try:
+                yield scrubber.scrub(log)
+            except ScrubbingException:
+                logger.exception("Exception while scrubbing log, could not scrub it")
+                failed_logs.append(log)
 
     def _forward_metrics(self, metrics, key=None):
         """
         Forward custom metrics submitted via logs to Datadog in a background thread
         using `lambda_stats` that is provided by the Datadog Python Lambda Layer.
+        Metrics are aggregated in series first, each series submitted at once.
         """
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"Forwarding {len(metrics)} metrics")
 
         failed_metrics = []
+        aggregator = LogMetricAggregator(get_log_metric_roll_up_interval())
         for metric in metrics:
             try:
-                send_log_metric(metric)
+                aggregator.add(metric)
+            except Exception:
+                logger.exception(f"Exception while adding metric {json.dumps(metric)}")
+                failed_metrics.append(metric)
+
+        for name, tags, timestamp, values in aggregator.series():
+            try:
+                send_log_metric_series(name, values, timestamp, tags)
             except Exception:
                 logger.exception(
-                    f"Exception while forwarding metric {json.dumps(metric)}"
+                    f"Exception while forwarding {len(values)} points of metric {name}"
+                )
+                failed_metrics.extend(
+                    {"m": name, "v": value, "e": timestamp, "t": tags}
+                    for value in values
                 )
-                failed_metrics.append(metric)
             else:
                 if logger.isEnabledFor(logging.DEBUG):
-                    logger.debug(f"Forwarded metric: {json.dumps(metric)}")
-                if key:
-                    self.storage.delete_data(key)
+                    logger.debug(f"Forwarded {len(values)} points of metric {name}")
 
         if DD_STORE_FAILED_EVENTS and len(failed_metrics) > 0 and not key:
             self.storage.store_data(RetryPrefix.METRICS, failed_metrics)
 
         send_event_metric("metrics_forwarded", len(metrics) - len(failed_metrics))
+        return not failed_metrics
 
-    def _forward_traces(self, traces, key=None):
+    def _forward_traces(self, traces, key=None, deadline=None):
         if not len(traces) > 0:
-            return
+            return True
+
+        if (
+            DD_STORE_FAILED_EVENTS
+            and deadline is not None
+            and not deadline.has_time_for(DD_MIN_TIME_PER_BATCH_SECONDS)
+        ):
+            logger.warning(
+                f"Stored {len(traces)} traces for retry, "
+                "the Lambda is close to timing out"
+            )
+            if not key:
+                self.storage.store_data(RetryPrefix.TRACES, traces)
+            return False
 
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"Forwarding {len(traces)} traces")
@@ -175,9 +366,9 @@ class Forwarder(object):
             )
             if DD_STORE_FAILED_EVENTS and not key:
                 self.storage.store_data(RetryPrefix.TRACES, traces)
+            return False
         else:
             if logger.isEnabledFor(logging.DEBUG):
                 logger.debug(f"Forwarded traces: {serialized_trace_paylods}")
-            if key:
-                self.storage.delete_data(key)
             send_event_metric("traces_forwarded", len(traces))
+            return True
@@ -11,13 +11,18 @@ import requests
 from hashlib import sha1
 from datadog_lambda.wrapper import datadog_lambda_wrapper
 from datadog import api
-from enhanced_lambda_metrics import parse_and_submit_enhanced_metrics
-from steps.parsing import parse
-from steps.enrichment import enrich
-from steps.transformation import transform
-from steps.splitting import split
+from enhanced_lambda_metrics import (
+    parse_and_submit_enhanced_metrics,
+    parse_and_submit_enhanced_metrics_stream,
+)
+from steps.parsing import parse, parse_stream
+from steps.enrichment import enrich, enrich_stream
+from steps.transformation import transform, transform_stream
+from steps.splitting import split, split_stream
 from caching.cache_layer import CacheLayer
 from forwarder import Forwarder
+from deadline import Deadline
+from telemetry import send_event_metric
 from settings import (
     DD_API_KEY,
     DD_SKIP_SSL_VALIDATION,
@@ -25,6 +30,7 @@ from settings import (
     DD_FORWARDER_VERSION,
     DD_ADDITIONAL_TARGET_LAMBDAS,
     DD_RETRY_KEYWORD,
+    DD_USE_STREAMING_PIPELINE,
 )
 
 
@@ -68,26 +74,50 @@ def datadog_forwarder(event, context):
     if DD_ADDITIONAL_TARGET_LAMBDAS:
         invoke_additional_target_lambdas(event)
 
+    deadline = Deadline.from_context(context)
     function_prefix = get_function_arn_digest(context)
     init_cache_layer(function_prefix)
     init_forwarder(function_prefix)
+    cache_layer.set_deadline(deadline)
 
-    parsed = parse(event, context, cache_layer)
-    enriched = enrich(parsed, cache_layer)
-    transformed = transform(enriched)
-    metrics, logs, trace_payloads = split(transformed)
+    if DD_USE_STREAMING_PIPELINE:
+        forward_stream(event, context, deadline)
+    else:
+        parsed = parse(event, context, cache_layer)
+        enriched = enrich(parsed, cache_layer)
+        transformed = transform(enriched)
+        metrics, logs, trace_payloads = split(transformed)
 
-    forwarder.forward(logs, metrics, trace_payloads)
-    parse_and_submit_enhanced_metrics(logs, cache_layer)
+        forwarder.forward(logs, metrics, trace_payloads, deadline)
+        parse_and_submit_enhanced_metrics(logs, cache_layer)
 
     try:
         if bool(event.get(DD_RETRY_KEYWORD, False)) is True:
-            forwarder.retry()
+            forwarder.retry(deadline)
     except Exception as e:
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"Failed to retry forwarding {e}")
         pass
 
+    if deadline is not None:
+        # How close the invocation came to timing out
+        send_event_metric(
+            "invocation_remaining_time_ms",
+            int(deadline.remaining_before_timeout() * 1000),
+        )
+
+
+def forward_stream(event, context, deadline=None):
+    """Runs the pipeline one event at a time, from parsing to the logs intake"""
+    metrics, trace_payloads = [], []
+    parsed = parse_stream(event, context, cache_layer)
+    enriched = enrich_stream(parsed, cache_layer)
+    transformed = transform_stream(enriched)
+    logs = split_stream(transformed, metrics, trace_payloads)
+    logs = parse_and_submit_enhanced_metrics_stream(logs, cache_layer)
+
+    forwarder.forward_stream(logs, metrics, trace_payloads, deadline)
+
 
 def init_cache_layer(function_prefix):
     global cache_layer
@@ -0,0 +1,232 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+
+
+import asyncio
+import logging
+import os
+import ssl
+import threading
+
+from logs.datadog_http_client import (
+    DatadogHTTPClient,
+    get_backoff,
+    is_retriable_status,
+)
+from logs.exceptions import RetriableException
+from settings import (
+    DD_MAX_WORKERS,
+    DD_ASYNC_HTTP_QUEUE_SIZE,
+    DD_LOGS_HTTP_MAX_RETRIES,
+)
+
+logger = logging.getLogger()
+logger.setLevel(logging.getLevelName(os.environ.get("DD_LOG_LEVEL", "INFO").upper()))
+
+
+class DatadogAsyncHTTPClient(DatadogHTTPClient):
+    """
+    Client that sends batches of logs over HTTP/1.1 from an asyncio event loop
+    running in a background thread.
+
+    At most max_in_flight requests are in flight at once, and send blocks while
+    queue_size batches are waiting to be sent, which slows the pipeline down
+    rather than keeping every pending batch in memory.
+    """
+
+    _PATH = "/api/v2/logs"
+
+    def __init__(
+        self,
+        host,
+        port,
+        no_ssl,
+        skip_ssl_validation,
+        api_key,
+        timeout=10,
+        deadline=None,
+        max_retries=DD_LOGS_HTTP_MAX_RETRIES,
+        max_in_flight=DD_MAX_WORKERS,
+        queue_size=DD_ASYNC_HTTP_QUEUE_SIZE,
+    ):
+        super().__init__(
+            host,
+            port,
+            no_ssl,
+            skip_ssl_validation,
+            api_key,
+            timeout,
+            deadline,
+            max_retries,
+        )
+        self._host = host
+        self._port = port
+        self._ssl_context = None if no_ssl else _ssl_context(skip_ssl_validation)
+        self._max_in_flight = max_in_flight
+        self._queue_size = queue_size
+        self._loop = None
+        self._thread = None
+
+    def _connect(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._run(self._start())
+
+    def _close(self):
+        try:
+            self._run(self._stop())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+    def send(self, payload, batch=None):
+        """
+        Queues a batch of logs, already scrubbed, serialized and compressed by
+        the batcher, waiting while the queue is full. Requests are retried on
+        server and network errors. The batch, or the payload if not given, is
+        added to failed_batches when it can't be sent.
+        """
+        self._run(self._queue.put((payload, payload if batch is None else batch)))
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _start(self):
+        self._queue = asyncio.Queue(self._queue_size)
+        self._semaphore = asyncio.Semaphore(self._max_in_flight)
+        self._idle_connections = []
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        self._request_head = self._build_request_head()
+
+    async def _stop(self):
+        await self._queue.put(None)
+        await self._dispatcher
+        for _, writer in self._idle_connections:
+            writer.close()
+        self._idle_connections = []
+
+    async def _dispatch(self):
+        tasks = set()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                break
+            await self._semaphore.acquire()
+            task = asyncio.create_task(self._send(*item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        # Resolve all the requests in flight before returning
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def _send(self, payload, batch):
+        try:
+            await self._post_with_retries(payload)
+        except Exception:
+            logger.exception("Exception while forwarding logs")
+            self.failed_batches.append(batch)
+        finally:
+            self._semaphore.release()
+
+    async def _post_with_retries(self, payload):
+        attempt = 0
+        while True:
+            timeout = self._get_attempt_timeout()
+            try:
+                status = await asyncio.wait_for(self._post(payload), timeout)
+            except (OSError, EOFError, asyncio.TimeoutError) as e:
+                error = e
+            else:
+                if not is_retriable_status(status):
+                    if status >= 400:
+                        logger.error(
+                            f"Logs intake rejected a batch of logs with status {status}"
+                        )
+                    return
+                error = RetriableException(
+                    f"Logs intake responded with status {status}"
+                )
+
+            backoff = get_backoff(attempt)
+            attempt += 1
+            if attempt > self._max_retries or not self._has_time_left(backoff):
+                raise error
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Retrying batch of logs in {backoff:.2f}s: {error}")
+            await asyncio.sleep(backoff)
+
+    async def _post(self, payload):
+        if self._idle_connections:
+            reader, writer = self._idle_connections.pop()
+        else:
+            reader, writer = await asyncio.open_connection(
+                self._host, self._port, ssl=self._ssl_context
+            )
+        try:
+            writer.write(self._request_head + b"%d\r\n\r\n" % len(payload))
+            writer.write(payload)
+            await writer.drain()
+            status, keep_alive = await _read_response(reader)
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive:
+            self._idle_connections.append((reader, writer))
+        else:
+            writer.close()
+        return status
+
+    def _build_request_head(self):
+        lines = [f"POST {self._PATH} HTTP/1.1", f"Host: {self._host}:{self._port}"]
+        lines.extend(f"{name}: {value}" for name, value in self._HEADERS.items())
+        # The content length of each request completes the head
+        lines.append("Content-Length: ")
+        return "\r\n".join(lines).encode("latin-1")
+
+
+def _ssl_context(skip_ssl_validation):
+    context = ssl.create_default_context()
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    if skip_ssl_validation:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+async def _read_response(reader):
+    """
+    Reads an HTTP/1.1 response, returning its status and whether the
+    connection can be reused. The body is read and discarded.
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise EOFError("connection closed by the logs intake")
+    version, status = status_line.split(None, 2)[:2]
+    status = int(status)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.partition(b":")
+        headers[name.strip().lower()] = value.strip().lower()
+
+    keep_alive = headers.get(b"connection") != b"close" and version == b"HTTP/1.1"
+    if status < 200 or status in (204, 304):
+        pass
+    elif headers.get(b"transfer-encoding") == b"chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif b"content-length" in headers:
+        await reader.readexactly(int(headers[b"content-length"]))
+    else:
+        await reader.read()
+        keep_alive = False
+    return status, keep_alive
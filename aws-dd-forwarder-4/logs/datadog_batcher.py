@@ -3,12 +3,77 @@
 # This product includes software developed at Datadog (https://www.datadoghq.com/).
 # Copyright 2021 Datadog, Inc.
 
+import zlib
+
+from logs.helpers import get_compression_level
+
+
+class PayloadWriter(object):
+    """
+    Builds a payload from the chunks of bytes written to it.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self.size_bytes = 0
+
+    def write(self, data):
+        self._chunks.append(data)
+        self.size_bytes += len(data)
+
+    def close(self):
+        """Returns the payload, the writer must not be used afterwards"""
+        payload = b"".join(self._chunks)
+        self._chunks = None
+        return payload
+
+    @property
+    def compressed_size_bytes(self):
+        return self.size_bytes
+
+
+class GzipPayloadWriter(PayloadWriter):
+    """
+    Builds a gzip payload, compressing each chunk of bytes as it is written so
+    that only the compressed output is kept in memory.
+    """
+
+    def __init__(self, level):
+        super().__init__()
+        # wbits of 16 + MAX_WBITS writes a gzip header and trailer
+        self._compressor = zlib.compressobj(
+            get_compression_level(level), zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
+        self._compressed_size_bytes = 0
+
+    def write(self, data):
+        self.size_bytes += len(data)
+        compressed = self._compressor.compress(data)
+        if compressed:
+            self._chunks.append(compressed)
+            self._compressed_size_bytes += len(compressed)
+
+    def close(self):
+        compressed = self._compressor.flush()
+        self._chunks.append(compressed)
+        self._compressed_size_bytes += len(compressed)
+        self._compressor = None
+        return super().close()
+
+    @property
+    def compressed_size_bytes(self):
+        """Size of the compressed output so far, final once the writer is closed"""
+        return self._compressed_size_bytes
+
 
 class DatadogBatcher(object):
     def __init__(self, max_item_size_bytes, max_batch_size_bytes, max_items_count):
         self._max_item_size_bytes = max_item_size_bytes
         self._max_batch_size_bytes = max_batch_size_bytes
         self._max_items_count = max_items_count
+        self.dropped_items_count = 0
+        self.payloads_size_bytes = 0
+        self.compressed_payloads_size_bytes = 0
 
     def _sizeof_bytes(self, item):
         return len(str(item).encode("UTF-8"))
@@ -20,7 +85,12 @@ class DatadogBatcher(object):
         is not strictly greater than max_batch_size_bytes.
         All items strictly greater than max_item_size_bytes are dropped.
         """
-        batches = []
+        return list(self.batch_stream(items))
+
+    def batch_stream(self, items):
+        """
+        Same as batch, but yields each batch as soon as it is full.
+        """
         batch = []
         size_bytes = 0
         size_count = 0
@@ -30,7 +100,7 @@ class DatadogBatcher(object):
                 size_count >= self._max_items_count
                 or size_bytes + item_size_bytes > self._max_batch_size_bytes
             ):
-                batches.append(batch)
+                yield batch
                 batch = []
                 size_bytes = 0
                 size_count = 0
@@ -39,6 +109,57 @@ class DatadogBatcher(object):
                 batch.append(item)
                 size_bytes += item_size_bytes
                 size_count += 1
+            else:
+                self.dropped_items_count += 1
         if size_count > 0:
-            batches.append(batch)
-        return batches
+            yield batch
+
+    def batch_payloads(self, items, compression_level=None):
+        """
+        Yields each batch of string items along with its JSON array payload.
+        Each item is encoded to UTF-8 exactly once, and the payload size,
+        including the `[`, `,` and `]` framing, is not strictly greater than
+        max_batch_size_bytes unless the batch holds a single item.
+        When a compression level is given, the payload is gzipped item by item
+        as the batch fills up, batches are still sized by uncompressed bytes.
+        All items strictly greater than max_item_size_bytes are dropped.
+        """
+        batch = []
+        writer = None
+        for item in items:
+            encoded_item = item.encode("UTF-8")
+            item_size_bytes = len(encoded_item)
+            # all items exceeding max_item_size_bytes are dropped here
+            if item_size_bytes > self._max_item_size_bytes:
+                self.dropped_items_count += 1
+                continue
+            if batch and (
+                len(batch) >= self._max_items_count
+                or writer.size_bytes + 2 + item_size_bytes
+                > self._max_batch_size_bytes
+            ):
+                yield batch, self._close_payload(writer)
+                batch = []
+            if batch:
+                writer.write(b",")
+            else:
+                writer = self._new_payload(compression_level)
+            batch.append(item)
+            writer.write(encoded_item)
+        if batch:
+            yield batch, self._close_payload(writer)
+
+    def _new_payload(self, compression_level):
+        if compression_level is None:
+            writer = PayloadWriter()
+        else:
+            writer = GzipPayloadWriter(compression_level)
+        writer.write(b"[")
+        return writer
+
+    def _close_payload(self, writer):
+        writer.write(b"]")
+        payload = writer.close()
+        self.payloads_size_bytes += writer.size_bytes
+        self.compressed_payloads_size_bytes += writer.compressed_size_bytes
+        return payload
@@ -13,22 +13,33 @@ class DatadogClient(object):
     Client that implements a exponential retrying logic to send a batch of logs.
     """
 
-    def __init__(self, client, max_backoff=30):
+    def __init__(self, client, max_backoff=30, deadline=None):
         self._client = client
         self._max_backoff = max_backoff
+        self._deadline = deadline
 
-    def send(self, logs):
+    def send(self, logs, batch=None):
         backoff = 1
         while True:
             try:
-                self._client.send(logs)
+                self._client.send(logs, batch)
                 return
             except RetriableException:
+                # Give up rather than retrying past the deadline
+                if self._deadline is not None and not self._deadline.has_time_for(
+                    backoff
+                ):
+                    raise
                 time.sleep(backoff)
                 if backoff < self._max_backoff:
                     backoff *= 2
                 continue
 
+    @property
+    def failed_batches(self):
+        """Batches the client failed to send in the background"""
+        return self._client.failed_batches
+
     def __enter__(self):
         self._client.__enter__()
         return self
@@ -6,26 +6,102 @@
 
 import os
 import logging
+import random
+import threading
+import time
+from functools import partial
+from time import monotonic
 
-from concurrent.futures import as_completed
+import requests
 from requests_futures.sessions import FuturesSession
-from logs.helpers import compress_logs
-from logs.exceptions import ScrubbingException
+from telemetry import send_event_metric
 
 from settings import (
     DD_USE_COMPRESSION,
-    DD_COMPRESSION_LEVEL,
     DD_MAX_WORKERS,
     DD_FORWARDER_VERSION,
+    DD_LOGS_HTTP_IDLE_TIMEOUT_SECONDS,
+    DD_ASYNC_HTTP_QUEUE_SIZE,
+    DD_LOGS_HTTP_MAX_RETRIES,
+    DD_LOGS_HTTP_MAX_BACKOFF_SECONDS,
 )
+from logs.exceptions import RetriableException
 
 logger = logging.getLogger()
 logger.setLevel(logging.getLevelName(os.environ.get("DD_LOG_LEVEL", "INFO").upper()))
 
 
+class PersistentSession(object):
+    """
+    FuturesSession kept across the invocations of a warm container, so that
+    its thread pool and connections to the logs intake are reused.
+    """
+
+    def __init__(
+        self,
+        max_workers=DD_MAX_WORKERS,
+        idle_timeout_seconds=DD_LOGS_HTTP_IDLE_TIMEOUT_SECONDS,
+    ):
+        self._max_workers = max_workers
+        self._idle_timeout_seconds = idle_timeout_seconds
+        self._session = None
+        self._healthy = True
+        self._last_used_at = None
+
+    def acquire(self):
+        """
+        Returns the session, created on first use and created again after a
+        connection error. Connections idle for too long are dropped first, the
+        intake may have closed them while the container was frozen.
+        """
+        if self._session is not None and not self._healthy:
+            logger.debug("Connection error on the last use, reconnecting")
+            self._session.close()
+            self._session = None
+            send_event_metric("logs_http_reconnects", 1)
+
+        if self._session is None:
+            self._session = FuturesSession(max_workers=self._max_workers)
+            self._healthy = True
+        elif monotonic() - self._last_used_at > self._idle_timeout_seconds:
+            logger.debug("Dropping idle connections to the logs intake")
+            for adapter in self._session.adapters.values():
+                adapter.close()
+            send_event_metric("logs_http_reconnects", 1)
+        else:
+            send_event_metric("logs_http_pool_reuse", 1)
+
+        self._last_used_at = monotonic()
+        return self._session
+
+    def release(self, healthy=True):
+        """Records the end of a use, once all its requests are resolved"""
+        self._healthy = healthy
+        self._last_used_at = monotonic()
+
+
+# Created lazily, shared by all the clients of the container
+persistent_session = PersistentSession()
+
+
+def is_retriable_status(status):
+    return status >= 500 or status == 429
+
+
+def get_backoff(attempt, max_backoff=DD_LOGS_HTTP_MAX_BACKOFF_SECONDS):
+    """Exponential backoff with full jitter, so that retries don't align"""
+    return random.uniform(0, min(max_backoff, 2**attempt))
+
+
 class DatadogHTTPClient(object):
     """
     Client that sends a batch of logs over HTTP.
+
+    Batches failing with a server or network error are retried until the
+    deadline, and are listed in failed_batches once the client is closed if
+    none of the attempts succeeded. Only the batches that failed are kept, and
+    send blocks while max_pending batches are being sent or waiting for a
+    worker of the session.
     """
 
     _POST = "POST"
@@ -38,16 +114,29 @@ class DatadogHTTPClient(object):
     _HEADERS["DD-EVP-ORIGIN-VERSION"] = DD_FORWARDER_VERSION
 
     def __init__(
-        self, host, port, no_ssl, skip_ssl_validation, api_key, scrubber, timeout=10
+        self,
+        host,
+        port,
+        no_ssl,
+        skip_ssl_validation,
+        api_key,
+        timeout=10,
+        deadline=None,
+        max_retries=DD_LOGS_HTTP_MAX_RETRIES,
+        max_pending=DD_MAX_WORKERS + DD_ASYNC_HTTP_QUEUE_SIZE,
     ):
         self._HEADERS.update({"DD-API-KEY": api_key})
         protocol = "http" if no_ssl else "https"
         self._url = "{}://{}:{}/api/v2/logs".format(protocol, host, port)
-        self._scrubber = scrubber
         self._timeout = timeout
+        self._deadline = deadline
+        self._max_retries = max_retries
         self._session = None
         self._ssl_validation = not skip_ssl_validation
-        self._futures = []
+        self._max_pending = max_pending
+        self._pending = threading.Semaphore(max_pending)
+        self._healthy = True
+        self.failed_batches = []
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(
                 f"Initialized http client for logs intake: "
@@ -56,35 +145,98 @@ class DatadogHTTPClient(object):
             )
 
     def _connect(self):
-        self._session = FuturesSession(max_workers=DD_MAX_WORKERS)
+        self._session = persistent_session.acquire()
         self._session.headers.update(self._HEADERS)
 
     def _close(self):
-        # Resolve all the futures and log exceptions if any
-        for future in as_completed(self._futures):
-            try:
-                future.result()
-            except Exception:
-                logger.exception("Exception while forwarding logs")
-
-        self._session.close()
-
-    def send(self, logs):
+        # Wait for the pending batches to be resolved, the session is kept for
+        # the next invocation but nothing must be left in flight
+        for _ in range(self._max_pending):
+            self._pending.acquire()
+        for _ in range(self._max_pending):
+            self._pending.release()
+        persistent_session.release(self._healthy)
+
+    def send(self, payload, batch=None):
         """
-        Sends a batch of log, only retry on server and network errors.
+        Sends a batch of logs, already scrubbed, serialized as a JSON array of
+        UTF-8 bytes and gzipped when compression is enabled by the batcher,
+        only retry on server and network errors. The batch, or the payload if
+        not given, is added to failed_batches when it can't be sent.
         """
+        self._pending.acquire()
         try:
-            data = self._scrubber.scrub("[{}]".format(",".join(logs)))
-        except ScrubbingException:
-            raise Exception("could not scrub the payload")
-        if DD_USE_COMPRESSION:
-            data = compress_logs(data, DD_COMPRESSION_LEVEL)
-
-        # FuturesSession returns immediately with a future object
-        future = self._session.post(
-            self._url, data, timeout=self._timeout, verify=self._ssl_validation
+            future = self._session.executor.submit(self._post_with_retries, payload)
+        except Exception:
+            self._pending.release()
+            raise
+        future.add_done_callback(
+            partial(self._resolve, payload if batch is None else batch)
         )
-        self._futures.append(future)
+
+    def _resolve(self, batch, future):
+        # The batch is only referenced until its future is resolved, and the
+        # slot is released last so that _close sees every failed batch
+        try:
+            future.result()
+        except requests.exceptions.ConnectionError:
+            self._healthy = False
+            self.failed_batches.append(batch)
+            logger.exception("Connection error while forwarding logs")
+        except Exception:
+            self.failed_batches.append(batch)
+            logger.exception("Exception while forwarding logs")
+        finally:
+            self._pending.release()
+
+    def _post_with_retries(self, payload):
+        attempt = 0
+        while True:
+            timeout = self._get_attempt_timeout()
+            try:
+                # Runs in a worker of the session, post synchronously
+                response = super(FuturesSession, self._session).request(
+                    self._POST,
+                    self._url,
+                    data=payload,
+                    timeout=timeout,
+                    verify=self._ssl_validation,
+                )
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                error = e
+            else:
+                if not is_retriable_status(response.status_code):
+                    if response.status_code >= 400:
+                        logger.error(
+                            f"Logs intake rejected a batch of logs with status "
+                            f"{response.status_code}: {response.text}"
+                        )
+                    return
+                error = RetriableException(
+                    f"Logs intake responded with status {response.status_code}"
+                )
+
+            backoff = get_backoff(attempt)
+            attempt += 1
+            if attempt > self._max_retries or not self._has_time_left(backoff):
+                raise error
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Retrying batch of logs in {backoff:.2f}s: {error}")
+            time.sleep(backoff)
+
+    def _get_attempt_timeout(self):
+        if self._deadline is None:
+            return self._timeout
+        remaining = self._deadline.remaining()
+        if remaining <= 0:
+            raise RetriableException("No time left to send the batch of logs")
+        return min(self._timeout, remaining)
+
+    def _has_time_left(self, backoff):
+        return self._deadline is None or self._deadline.has_time_for(backoff)
 
     def __enter__(self):
         self._connect()
@@ -5,9 +5,13 @@
 
 
 import os
+import re
 from logs.exceptions import ScrubbingException
 from logs.helpers import compileRegex
 
+# Characters json.dumps escapes in strings when ensure_ascii is False
+JSON_ESCAPED_CHARACTERS_REGEX = re.compile(r'["\\\x00-\x1f]')
+
 
 class DatadogScrubber(object):
     def __init__(self, configs):
@@ -16,21 +20,41 @@ class DatadogScrubber(object):
             if config.name in os.environ:
                 rules.append(
                     ScrubbingRule(
-                        compileRegex(config.name, config.pattern), config.placeholder
+                        compileRegex(config.name, config.pattern),
+                        config.placeholder,
+                        config.literal,
+                        config.json_safe,
                     )
                 )
         self._rules = rules
+        self.json_safe = all(rule.json_safe for rule in rules)
 
     def scrub(self, payload):
+        if self._rules and not isinstance(payload, str):
+            raise ScrubbingException()
         for rule in self._rules:
             try:
-                payload = rule.regex.sub(rule.placeholder, payload)
+                # checking for the literal is much cheaper than a regex scan
+                if rule.literal is None or rule.literal in payload:
+                    payload = rule.regex.sub(rule.placeholder, payload)
             except Exception:
                 raise ScrubbingException()
         return payload
 
+    def scrubs_serialized(self, message):
+        """
+        Whether scrubbing the JSON serialization of the message gives the same
+        result as serializing the scrubbed message, in which case the message
+        doesn't need to be scrubbed on its own before the whole log is.
+        """
+        if not self._rules:
+            return True
+        return self.json_safe and not JSON_ESCAPED_CHARACTERS_REGEX.search(message)
+
 
 class ScrubbingRule(object):
-    def __init__(self, regex, placeholder):
+    def __init__(self, regex, placeholder, literal=None, json_safe=False):
         self.regex = regex
         self.placeholder = placeholder
+        self.literal = literal
+        self.json_safe = json_safe
@@ -27,6 +27,8 @@ class DatadogTCPClient(object):
         self._api_key = api_key
         self._scrubber = scrubber
         self._sock = None
+        # Batches are sent synchronously, failures are raised by send
+        self.failed_batches = []
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(
                 f"Initialized tcp client for logs intake: "
@@ -51,7 +53,7 @@ class DatadogTCPClient(object):
         self._close()
         self._connect()
 
-    def send(self, logs):
+    def send(self, logs, batch=None):
         try:
             frame = self._scrubber.scrub(
                 "".join(["{} {}\n".format(self._api_key, log) for log in logs])
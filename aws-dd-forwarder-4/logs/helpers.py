@@ -26,15 +26,23 @@ def filter_logs(logs, include_pattern=None, exclude_pattern=None):
     if include_pattern is None and exclude_pattern is None:
         return logs
 
+    return list(filter_logs_stream(logs, include_pattern, exclude_pattern))
+
+
+def filter_logs_stream(logs, include_pattern=None, exclude_pattern=None):
+    """
+    Applies log filtering rules to a stream of logs, yielding the logs to send.
+    """
+    if include_pattern is None and exclude_pattern is None:
+        yield from logs
+        return
+
     logger.debug(f"Applying exclude pattern: {exclude_pattern}")
     exclude_regex = compileRegex("EXCLUDE_AT_MATCH", exclude_pattern)
 
     logger.debug(f"Applying include pattern: {include_pattern}")
     include_regex = compileRegex("INCLUDE_AT_MATCH", include_pattern)
 
-    # Add logs that should be sent to logs_to_send
-    logs_to_send = []
-
     for log in logs:
         try:
             if exclude_regex is not None and re.search(exclude_regex, log):
@@ -45,23 +53,27 @@ def filter_logs(logs, include_pattern=None, exclude_pattern=None):
                 logger.debug("Include pattern did not match, excluding log event")
                 continue
 
-            logs_to_send.append(log)
+            yield log
 
         except ScrubbingException:
             raise Exception("could not filter the payload")
 
-    return logs_to_send
-
 
-def compress_logs(batch, level):
+def get_compression_level(level):
     if level < 0:
-        compression_level = 0
+        return 0
     elif level > 9:
-        compression_level = 9
-    else:
-        compression_level = level
+        return 9
+    return level
+
+
+def compress_logs(batch, level):
+    compression_level = get_compression_level(level)
+
+    if isinstance(batch, str):
+        batch = bytes(batch, "utf-8")
 
-    return gzip.compress(bytes(batch, "utf-8"), compression_level)
+    return gzip.compress(batch, compression_level)
 
 
 def compileRegex(rule, pattern):
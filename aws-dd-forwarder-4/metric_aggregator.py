@@ -0,0 +1,58 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+
+
+import sys
+from array import array
+
+from settings import DD_LOG_METRICS_ROLL_UP_INTERVAL_SECONDS
+
+
+class LogMetricAggregator(object):
+    """
+    Groups the custom metrics forwarded from logs in series of the same name,
+    tags and roll-up interval, so that each series is handed to the metrics
+    writer at once rather than one point at a time. The values of a series
+    are kept in an array of doubles.
+    """
+
+    def __init__(self, roll_up_interval=DD_LOG_METRICS_ROLL_UP_INTERVAL_SECONDS):
+        self.roll_up_interval = roll_up_interval
+        self._series = {}
+        # Tags as submitted, to the same tags sorted and interned
+        self._tags = {}
+
+    def add(self, metric):
+        """Adds a metric extracted from a log, in the {"m", "v", "e", "t"} format"""
+        self.add_point(metric["m"], metric["v"], metric["e"], metric["t"])
+
+    def add_point(self, name, value, timestamp, tags):
+        timestamp = int(timestamp)
+        interval = timestamp - timestamp % self.roll_up_interval
+        key = (sys.intern(name), self._intern_tags(tags), interval)
+        values = self._series.get(key)
+        if values is None:
+            values = self._series[key] = array("d")
+        values.append(value)
+
+    def series(self):
+        """
+        Yields the (name, tags, timestamp, values) of each series, forgetting
+        each series once it is yielded
+        """
+        for key in list(self._series):
+            name, tags, interval = key
+            yield name, list(tags), interval, self._series.pop(key)
+
+    def __len__(self):
+        return len(self._series)
+
+    def _intern_tags(self, tags):
+        submitted = tuple(tags)
+        interned = self._tags.get(submitted)
+        if interned is None:
+            interned = tuple(sys.intern(tag) for tag in sorted(submitted))
+            self._tags[submitted] = interned
+        return interned
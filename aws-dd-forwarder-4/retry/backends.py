@@ -0,0 +1,97 @@
+import logging
+import os
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.getLevelName(os.environ.get("DD_LOG_LEVEL", "INFO").upper()))
+
+# Most keys a single delete_objects request accepts
+S3_DELETE_OBJECTS_MAX_KEYS = 1000
+
+
+class S3Backend(object):
+    """Stores the retry data as objects of an S3 bucket"""
+
+    def __init__(self, bucket_name):
+        self.bucket_name = bucket_name
+        self.s3_client = boto3.client("s3")
+
+    def list_keys(self, prefix, start_after=None):
+        """Yields the keys in order, listing a page of keys at a time"""
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        kwargs = {"Bucket": self.bucket_name, "Prefix": prefix}
+        if start_after:
+            kwargs["StartAfter"] = start_after
+        for page in paginator.paginate(**kwargs):
+            for content in page.get("Contents", []):
+                yield content["Key"]
+
+    def get(self, key):
+        """Returns the object, None if it doesn't exist"""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "NoSuchKey":
+                return None
+            raise
+        return response["Body"].read()
+
+    def put(self, key, body):
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=body)
+
+    def delete(self, keys):
+        for i in range(0, len(keys), S3_DELETE_OBJECTS_MAX_KEYS):
+            chunk = keys[i : i + S3_DELETE_OBJECTS_MAX_KEYS]
+            objects = [{"Key": key} for key in chunk]
+            response = self.s3_client.delete_objects(
+                Bucket=self.bucket_name, Delete={"Objects": objects, "Quiet": True}
+            )
+            for error in response.get("Errors", []):
+                logger.error(
+                    f"Failed to delete retry data for key {error.get('Key')} "
+                    f"because of {error.get('Message')}"
+                )
+
+
+class LocalBackend(object):
+    """Stores the retry data as files of a local directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def list_keys(self, prefix, start_after=None):
+        keys = []
+        for root, _, files in os.walk(self._path(prefix)):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.relpath(os.path.join(root, name), self.directory)
+                keys.append(path.replace(os.sep, "/"))
+        return iter(sorted(k for k in keys if not start_after or k > start_after))
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, body):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Readers never see a partially written file
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(body)
+        os.replace(f"{path}.tmp", path)
+
+    def delete(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, *key.split("/"))
@@ -0,0 +1,83 @@
+import logging
+import os
+
+from settings import DD_MIN_TIME_PER_BATCH_SECONDS, DD_RETRY_CHECKPOINT_INTERVAL
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.getLevelName(os.environ.get("DD_LOG_LEVEL", "INFO").upper()))
+
+
+class Replay(object):
+    """
+    Forwards the data stored for a retry prefix one segment at a time.
+
+    A segment is deleted once forward returns True for it, meaning all of its
+    data was acknowledged. Deletions are batched every checkpoint_interval
+    segments, after which the last segment replayed is recorded, so that a
+    round stopped by the deadline resumes where it left off in the next
+    invocation rather than replaying the segments that failed again.
+    """
+
+    def __init__(
+        self,
+        storage,
+        prefix,
+        deadline=None,
+        checkpoint_interval=DD_RETRY_CHECKPOINT_INTERVAL,
+    ):
+        self.storage = storage
+        self.prefix = prefix
+        self.deadline = deadline
+        self.checkpoint_interval = checkpoint_interval
+        self.replayed_count = 0
+        self.forwarded_count = 0
+        self._has_checkpoint = False
+
+    def run(self, forward):
+        """
+        Calls forward(key, data) for each stored segment, returning whether
+        the round went through all of them
+        """
+        start_after = self.storage.get_checkpoint(self.prefix)
+        self._has_checkpoint = start_after is not None
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Replaying {self.prefix} data after {start_after}")
+
+        forwarded_keys = []
+        last_key = None
+        for key, data in self.storage.iter_data(self.prefix, start_after):
+            if self._is_short_of_time():
+                self._checkpoint(forwarded_keys, last_key)
+                logger.warning(
+                    f"Stopped replaying {self.prefix} data after "
+                    f"{self.replayed_count} segments, the Lambda is close to "
+                    "timing out"
+                )
+                return False
+
+            if data is not None and forward(key, data):
+                forwarded_keys.append(key)
+                self.forwarded_count += 1
+            self.replayed_count += 1
+            last_key = key
+            if len(forwarded_keys) >= self.checkpoint_interval:
+                self._checkpoint(forwarded_keys, last_key)
+                forwarded_keys = []
+
+        self.storage.delete_keys(forwarded_keys)
+        # The next round starts over from the first segment
+        if self._has_checkpoint:
+            self.storage.set_checkpoint(self.prefix, None)
+        return True
+
+    def _is_short_of_time(self):
+        return self.deadline is not None and not self.deadline.has_time_for(
+            DD_MIN_TIME_PER_BATCH_SECONDS
+        )
+
+    def _checkpoint(self, forwarded_keys, last_key):
+        self.storage.delete_keys(forwarded_keys)
+        # Until a segment is replayed, the previous checkpoint still holds
+        if last_key is not None:
+            self.storage.set_checkpoint(self.prefix, last_key)
+            self._has_checkpoint = True
@@ -1,74 +1,138 @@
+import gzip
 import json
 import logging
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from time import time
+from uuid import uuid4
 
-import boto3
 from botocore.exceptions import ClientError
 
-from settings import DD_S3_BUCKET_NAME, DD_S3_RETRY_DIRNAME
+from retry.backends import S3Backend
+from settings import (
+    DD_S3_BUCKET_NAME,
+    DD_S3_RETRY_DIRNAME,
+    DD_RETRY_SEGMENT_MAX_SIZE_BYTES,
+    DD_RETRY_FETCH_MAX_WORKERS,
+)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.getLevelName(os.environ.get("DD_LOG_LEVEL", "INFO").upper()))
 
+GZIP_MAGIC_NUMBER = b"\x1f\x8b"
+
 
 class Storage(object):
-    def __init__(self, function_prefix):
-        self.bucket_name = DD_S3_BUCKET_NAME
-        self.s3_client = boto3.client("s3")
+    """
+    Stores the data that failed to be forwarded, in gzipped segments of at
+    most DD_RETRY_SEGMENT_MAX_SIZE_BYTES of JSON, in S3 unless another backend
+    is given.
+    """
+
+    def __init__(
+        self,
+        function_prefix,
+        backend=None,
+        segment_max_size_bytes=DD_RETRY_SEGMENT_MAX_SIZE_BYTES,
+        fetch_max_workers=DD_RETRY_FETCH_MAX_WORKERS,
+    ):
+        self.backend = backend or S3Backend(DD_S3_BUCKET_NAME)
         self.function_prefix = function_prefix
+        self.segment_max_size_bytes = segment_max_size_bytes
+        self.fetch_max_workers = fetch_max_workers
 
     def get_data(self, prefix):
-        keys = self._list_keys(prefix)
-        key_data = {}
-        for key in keys:
-            key_data[key] = self._fetch_data_for_key(key)
+        key_data = dict(self.iter_data(prefix))
 
         if logger.isEnabledFor(logging.DEBUG):
-            logger.debug(f"Found {len(keys)} retry keys for prefix {prefix}")
+            logger.debug(f"Found {len(key_data)} retry keys for prefix {prefix}")
 
         return key_data
 
+    def iter_data(self, prefix, start_after=None):
+        """
+        Yields the keys of the prefix in order, after start_after if given,
+        with their data. Keys are listed lazily and at most fetch_max_workers
+        segments are fetched ahead, so that the data of every key is never
+        loaded at once.
+        """
+        executor = ThreadPoolExecutor(max_workers=self.fetch_max_workers)
+        pending = deque()
+        try:
+            for key in self._list_keys(prefix, start_after):
+                pending.append((key, executor.submit(self._fetch_data_for_key, key)))
+                if len(pending) >= self.fetch_max_workers:
+                    key, future = pending.popleft()
+                    yield key, future.result()
+            while pending:
+                key, future = pending.popleft()
+                yield key, future.result()
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def get_checkpoint(self, prefix):
+        """Returns the last key replayed by an unfinished retry round"""
+        try:
+            checkpoint = self.backend.get(self._get_checkpoint_key(prefix))
+        except (ClientError, OSError):
+            logger.error(f"Failed to fetch retry checkpoint for prefix {prefix}")
+            return None
+        return checkpoint.decode("UTF-8") if checkpoint else None
+
+    def set_checkpoint(self, prefix, key):
+        """Records the last key replayed, or clears the checkpoint if None"""
+        checkpoint_key = self._get_checkpoint_key(prefix)
+        try:
+            if key is None:
+                self.backend.delete([checkpoint_key])
+            else:
+                self.backend.put(checkpoint_key, key.encode("UTF-8"))
+        except (ClientError, OSError):
+            logger.error(f"Failed to store retry checkpoint for prefix {prefix}")
+
     def store_data(self, prefix, data):
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"Storing retry data for prefix {prefix}")
-        random_suffix = str(time())
+        # Keys of concurrent invocations must not collide
+        random_suffix = f"{time()}-{uuid4().hex[:8]}"
         key_prefix = self._get_key_prefix(prefix)
-        key = f"{key_prefix}{random_suffix}"
-        serialized_data = self._serialize(data)
-        try:
-            self.s3_client.put_object(
-                Bucket=self.bucket_name, Key=key, Body=serialized_data
-            )
-        except ClientError:
-            logger.error(f"Failed to store retry data for prefix {prefix}")
+        for index, segment in enumerate(self._segments(data)):
+            key = f"{key_prefix}{random_suffix}-{index}.json.gz"
+            try:
+                self.backend.put(key, gzip.compress(segment))
+            except (ClientError, OSError):
+                logger.error(f"Failed to store retry data for prefix {prefix}")
 
     def delete_data(self, key):
+        self.delete_keys([key])
+
+    def delete_keys(self, keys):
+        """Deletes the data of all the keys, in a single request if possible"""
+        if not keys:
+            return
         try:
-            self.s3_client.delete_object(Bucket=self.bucket_name, Key=key)
-        except ClientError:
-            logger.error(f"Failed to delete retry data for key {key}")
+            self.backend.delete(keys)
+        except (ClientError, OSError):
+            logger.error(f"Failed to delete retry data for keys {keys}")
 
-    def _list_keys(self, prefix):
+    def _list_keys(self, prefix, start_after=None):
         key_prefix = self._get_key_prefix(prefix)
         try:
-            response = self.s3_client.list_objects_v2(
-                Bucket=self.bucket_name, Prefix=key_prefix
-            )
-            return [content["Key"] for content in response.get("Contents", [])]
-        except ClientError as e:
+            yield from self.backend.list_keys(key_prefix, start_after)
+        except (ClientError, OSError) as e:
             logger.error(
                 f"Failed to list retry keys for prefix {key_prefix} because of {e}"
             )
-            return []
 
     def _fetch_data_for_key(self, key):
         try:
-            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
-            body = response.get("Body")
-            data = body.read()
+            data = self.backend.get(key)
+            # The key was deleted since it was listed
+            if data is None:
+                return None
             return self._deserialize(data)
-        except ClientError:
+        except (ClientError, OSError):
             logger.error(f"Failed to fetch retry data for key {key}")
             return None
         except Exception as e:
@@ -80,8 +144,30 @@ class Storage(object):
     def _get_key_prefix(self, retry_prefix):
         return f"{DD_S3_RETRY_DIRNAME}/{self.function_prefix}/{str(retry_prefix)}/"
 
-    def _serialize(self, data):
-        return bytes(json.dumps(data).encode("UTF-8"))
+    def _get_checkpoint_key(self, retry_prefix):
+        function_dirname = f"{DD_S3_RETRY_DIRNAME}/{self.function_prefix}"
+        return f"{function_dirname}/checkpoints/{retry_prefix}"
+
+    def _segments(self, data):
+        """
+        Serializes the data in JSON arrays of at most segment_max_size_bytes,
+        unless a single item is larger
+        """
+        items = []
+        size = 2
+        for item in data:
+            serialized = json.dumps(item).encode("UTF-8")
+            if items and size + len(serialized) + 1 > self.segment_max_size_bytes:
+                yield b"[" + b",".join(items) + b"]"
+                items = []
+                size = 2
+            items.append(serialized)
+            size += len(serialized) + 1
+        if items:
+            yield b"[" + b",".join(items) + b"]"
 
     def _deserialize(self, data):
+        # Data stored before segments were compressed is plain JSON
+        if data[:2] == GZIP_MAGIC_NUMBER:
+            data = gzip.decompress(data)
         return json.loads(data.decode("UTF-8"))
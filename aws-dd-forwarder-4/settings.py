@@ -65,6 +65,24 @@ DD_FORWARD_LOG = get_env_var("DD_FORWARD_LOG", "true", boolean=True)
 #
 DD_USE_TCP = get_env_var("DD_USE_TCP", "false", boolean=True)
 
+## @param DD_USE_STREAMING_PIPELINE - boolean - optional -default: false
+## Change this value to `true` to stream events one at a time through the
+## enrichment, transformation, splitting and batching steps. Each batch of logs
+## is sent as soon as it is full, which bounds the memory used by an invocation
+## by the batch size rather than by the size of the incoming payload.
+#
+DD_USE_STREAMING_PIPELINE = get_env_var(
+    "DD_USE_STREAMING_PIPELINE", "false", boolean=True
+)
+
+## @param DD_USE_ASYNC_HTTP - boolean - optional -default: false
+## Change this value to `true` to send logs over HTTP from an asyncio event loop
+## rather than from a pool of DD_MAX_WORKERS threads. At most DD_MAX_WORKERS
+## requests are in flight, and the pipeline waits while a few batches are pending.
+## Proxies set through the HTTPS_PROXY environment variable are not supported.
+#
+DD_USE_ASYNC_HTTP = get_env_var("DD_USE_ASYNC_HTTP", "false", boolean=True)
+
 ## @param DD_USE_COMPRESSION - boolean - optional -default: true
 ## Only valid when sending logs over HTTP
 ## Change this value to `false` to send your logs without any compression applied
@@ -156,22 +174,34 @@ if DD_USE_PRIVATE_LINK:
 
 
 class ScrubbingRuleConfig(object):
-    def __init__(self, name, pattern, placeholder):
+    def __init__(self, name, pattern, placeholder, literal=None, json_safe=False):
         self.name = name
         self.pattern = pattern
         self.placeholder = placeholder
+        # A string every match contains, payloads without it are not scanned
+        self.literal = literal
+        # Whether the pattern never matches `"`, `\` nor control characters,
+        # which are escaped in JSON strings, isn't anchored, and the rule gives
+        # the same result when applied again on its own output
+        self.json_safe = json_safe
 
 
 # Scrubbing sensitive data
 # Option to redact all pattern that looks like an ip address / email address / custom pattern
 SCRUBBING_RULE_CONFIGS = [
     ScrubbingRuleConfig(
-        "REDACT_IP", r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}", "xxx.xxx.xxx.xxx"
+        "REDACT_IP",
+        r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}",
+        "xxx.xxx.xxx.xxx",
+        literal=".",
+        json_safe=True,
     ),
     ScrubbingRuleConfig(
         "REDACT_EMAIL",
         r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+",
         "xxxxx@xxxxx.com",
+        # Not JSON safe, the placeholder may form a new email with what follows
+        literal="@",
     ),
     ScrubbingRuleConfig(
         "DD_SCRUBBING_RULE",
@@ -298,15 +328,51 @@ DD_S3_TAGS_CACHE_FILENAME = "s3.json"
 DD_S3_TAGS_CACHE_LOCK_FILENAME = "s3.lock"
 
 DD_S3_LOG_GROUP_CACHE_DIRNAME = "log-group"
+# The tags of all the log groups are cached in this many S3 files
+DD_LOG_GROUP_TAGS_CACHE_SHARDS = 16
+# Cache shards fetched, and log groups looked up, at once
+DD_LOG_GROUP_TAGS_FETCH_MAX_WORKERS = 8
 
 DD_TAGS_CACHE_TTL_SECONDS = int(get_env_var("DD_TAGS_CACHE_TTL_SECONDS", default=300))
+# Expired tags are served while they are refreshed in the background, unless
+# they were fetched longer ago than this, in which case the refresh is waited for
+DD_TAGS_CACHE_MAX_STALENESS_SECONDS = int(
+    get_env_var("DD_TAGS_CACHE_MAX_STALENESS_SECONDS", default=3600)
+)
 DD_S3_CACHE_LOCK_TTL_SECONDS = 60
+# Tags caches are stored gzipped in S3 from this size on
+DD_S3_CACHE_COMPRESSION_MIN_SIZE_BYTES = 16 * 1000
+# Metadata computed by the awslogs handler for each log group, kept in memory only
+DD_LOG_GROUP_METADATA_CACHE_SIZE = 1024
+DD_LOG_GROUP_METADATA_CACHE_TTL_SECONDS = 60
+# Connections to the logs intake idle for longer are dropped before reuse
+DD_LOGS_HTTP_IDLE_TIMEOUT_SECONDS = 30
+# Batches waiting for a connection of the HTTP clients before send blocks
+DD_ASYNC_HTTP_QUEUE_SIZE = 4
+# Batches failing with a server or network error are retried with a jittered
+# exponential backoff, as long as the invocation has time left
+DD_LOGS_HTTP_MAX_RETRIES = 5
+DD_LOGS_HTTP_MAX_BACKOFF_SECONDS = 30
+# Time kept before the Lambda timeout to store the logs that could not be sent
+DD_LAMBDA_TIMEOUT_MARGIN_SECONDS = 2
+# Below this much time left, batches are stored for retry instead of being sent
+DD_MIN_TIME_PER_BATCH_SECONDS = 1
 GET_RESOURCES_LAMBDA_FILTER = "lambda"
 GET_RESOURCES_STEP_FUNCTIONS_FILTER = "states"
 GET_RESOURCES_S3_FILTER = "s3:bucket"
 
 
+# Custom metrics forwarded from logs are rolled up over intervals this long,
+# the interval ThreadStats uses, when they are submitted through ThreadStats
+DD_LOG_METRICS_ROLL_UP_INTERVAL_SECONDS = 10
+
 # Retryer
 DD_S3_RETRY_DIRNAME = "failed_events"
+# Failed events are stored in gzipped segments of at most this much JSON
+DD_RETRY_SEGMENT_MAX_SIZE_BYTES = 4 * 1000 * 1000
+# Retry segments fetched at once
+DD_RETRY_FETCH_MAX_WORKERS = 8
+# Retried segments deleted at once, after which the progress of the round is saved
+DD_RETRY_CHECKPOINT_INTERVAL = 10
 DD_RETRY_KEYWORD = "retry"
 DD_STORE_FAILED_EVENTS = get_env_var("DD_STORE_FAILED_EVENTS", "false", boolean=True)
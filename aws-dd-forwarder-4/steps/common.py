@@ -1,4 +1,6 @@
 import re
+from functools import lru_cache
+
 from steps.enums import (
     AwsEventSource,
     AwsEventType,
@@ -25,6 +27,47 @@ CLOUDTRAIL_REGEX = re.compile(
     r"\d+_CloudTrail(|-Digest|-Insight)_\w{2}(|-gov|-cn)-\w{4,9}-\d_(|.+)\d{8}T\d{4,6}Z(|.+).json.gz$",
     re.I,
 )
+# Literal part of CLOUDTRAIL_REGEX, much cheaper to look for, ruling out most keys
+CLOUDTRAIL_KEYWORD_REGEX = re.compile(r"_CloudTrail", re.I)
+
+# Number of log groups and S3 directories whose source is memoized
+SOURCE_CACHE_SIZE = 1024
+
+# The enums are flattened once into tables of plain strings, in precedence order
+AWSLOGS_STRING = str(AwsEventType.AWSLOGS)
+RECORDS_STRING = str(AwsEventTypeKeyword.RECORDS)
+AWS_SOURCE_STRING = str(AwsEventSource.AWS)
+CLOUDTRAIL_SOURCE_STRING = str(AwsEventSource.CLOUDTRAIL)
+CLOUDWATCH_SOURCE_STRING = str(AwsEventSource.CLOUDWATCH)
+S3_SOURCE_STRING = str(AwsEventSource.S3)
+
+
+def build_prefix_index(prefixes):
+    """Indexes (prefix, source) pairs by the first character of the prefix
+
+    The pairs keep their relative order, so the first one matching a string
+    is still the one with the highest precedence.
+    """
+    index = {}
+    for prefix, source in prefixes:
+        index.setdefault(prefix[:1], []).append((prefix, source))
+    return {character: tuple(pairs) for character, pairs in index.items()}
+
+
+CLOUDWATCH_SOURCE_PREFIXES = build_prefix_index(
+    (str(prefix), str(prefix.event_source)) for prefix in AwsCwEventSourcePrefix
+)
+CLOUDWATCH_SOURCE_KEYWORDS = tuple(
+    str(source) for source in AwsEventSource.cloudwatch_sources()
+)
+S3_SOURCE_KEYWORDS = tuple(
+    (str(keyword), str(keyword.event_source)) for keyword in AwsS3EventSourceKeyword
+)
+# A keyword without "/" is found in a key if and only if it is found in its
+# directory or in its file name, so the result for the directory can be reused
+S3_SOURCE_KEYWORDS_SPLIT_BY_DIRECTORY = not any(
+    "/" in keyword for keyword, _ in S3_SOURCE_KEYWORDS
+)
 
 
 def parse_event_source(event, override):
@@ -36,45 +79,67 @@ def parse_event_source(event, override):
     lowercased = str(override).lower()
 
     # Determines if the key matches any known sources for Cloudwatch logs
-    if event.get(str(AwsEventType.AWSLOGS), None):
+    if event.get(AWSLOGS_STRING, None):
         return find_cloudwatch_source(lowercased)
 
     # Determines if the key matches any known sources for S3 logs
-    if records := event.get(str(AwsEventTypeKeyword.RECORDS), None):
-        if len(records) > 0 and str(AwsEventSource.S3) in records[0]:
+    if records := event.get(RECORDS_STRING, None):
+        if len(records) > 0 and S3_SOURCE_STRING in records[0]:
             if is_cloudtrail(lowercased):
-                return str(AwsEventSource.CLOUDTRAIL)
+                return CLOUDTRAIL_SOURCE_STRING
 
             return find_s3_source(lowercased)
 
-    return str(AwsEventSource.AWS)
+    return AWS_SOURCE_STRING
 
 
 def is_cloudtrail(key):
+    if not CLOUDTRAIL_KEYWORD_REGEX.search(key):
+        return False
     match = CLOUDTRAIL_REGEX.search(key)
     return bool(match)
 
 
+@lru_cache(maxsize=SOURCE_CACHE_SIZE)
 def find_cloudwatch_source(log_group):
-    for prefix in AwsCwEventSourcePrefix:
-        if log_group.startswith(str(prefix)):
-            return str(prefix.event_source)
+    for prefix, source in CLOUDWATCH_SOURCE_PREFIXES.get(log_group[:1], ()):
+        if log_group.startswith(prefix):
+            return source
 
     # directly look for the source in the log group
-    for source in AwsEventSource.cloudwatch_sources():
-        if str(source) in log_group:
-            return str(source)
+    for source in CLOUDWATCH_SOURCE_KEYWORDS:
+        if source in log_group:
+            return source
 
-    return str(AwsEventSource.CLOUDWATCH)
+    return CLOUDWATCH_SOURCE_STRING
 
 
 def find_s3_source(key):
-    for keyword in AwsS3EventSourceKeyword:
-        keyword_str = str(keyword)
-        if keyword_str in key:
-            return str(keyword.event_source)
+    if S3_SOURCE_KEYWORDS_SPLIT_BY_DIRECTORY:
+        directory, _, filename = key.rpartition("/")
+        # Only keywords with a higher precedence can change the directory result
+        index = find_s3_directory_keyword_index(directory)
+        index = find_s3_keyword_index(filename, index)
+    else:
+        index = find_s3_keyword_index(key)
+
+    if index < len(S3_SOURCE_KEYWORDS):
+        return S3_SOURCE_KEYWORDS[index][1]
+
+    return S3_SOURCE_STRING
+
+
+@lru_cache(maxsize=SOURCE_CACHE_SIZE)
+def find_s3_directory_keyword_index(directory):
+    return find_s3_keyword_index(directory)
 
-    return str(AwsEventSource.S3)
+
+def find_s3_keyword_index(text, end=len(S3_SOURCE_KEYWORDS)):
+    """Returns the index of the first S3 keyword found in the text, or `end`"""
+    for index in range(end):
+        if S3_SOURCE_KEYWORDS[index][0] in text:
+            return index
+    return end
 
 
 def add_service_tag(metadata):
@@ -116,6 +181,36 @@ def merge_dicts(a, b, path=None):
     return a
 
 
+def merge_metadata(event, metadata):
+    """Same as merge_dicts(event, metadata), specialized for logs and their metadata
+
+    The metadata only nests dicts one level deep (aws, lambda), whose keys are
+    usually missing from the event. That level is merged inline, without the
+    recursive calls and the path lists of merge_dicts, which is only called
+    for the keys both have.
+    """
+    for key in metadata:
+        if key not in event:
+            event[key] = metadata[key]
+            continue
+
+        existing = event[key]
+        value = metadata[key]
+        if isinstance(existing, dict) and isinstance(value, dict):
+            for nested_key in value:
+                if nested_key not in existing:
+                    existing[nested_key] = value[nested_key]
+                else:
+                    merge_dicts(
+                        existing, {nested_key: value[nested_key]}, [str(key)]
+                    )
+        elif existing != value:
+            raise Exception(
+                "Conflict while merging metadatas and the log entry at %s" % str(key)
+            )
+    return event
+
+
 def generate_metadata(context):
     metadata = {
         SOURCECATEGORY_STRING: AWS_STRING,
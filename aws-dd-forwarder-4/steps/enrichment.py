@@ -1,5 +1,4 @@
 import logging
-import json
 import os
 import re
 from settings import (
@@ -10,6 +9,7 @@ from settings import (
 )
 from enhanced_lambda_metrics import parse_lambda_tags_from_arn
 from steps.enums import AwsEventSource
+from steps.parsed_event import get_json_message, set_json_message
 
 HOST_IDENTITY_REGEXP = re.compile(
     r"^arn:aws:sts::.*?:assumed-role\/(?P<role>.*?)/(?P<host>i-([0-9a-f]{8}|[0-9a-f]{17}))$"
@@ -26,15 +26,31 @@ def enrich(events, cache_layer):
         events (dict[]): the list of event dicts we want to enrich
     """
     for event in events:
-        add_metadata_to_lambda_log(event, cache_layer)
-        extract_ddtags_from_message(event)
-        extract_host_from_cloudtrails(event)
-        extract_host_from_guardduty(event)
-        extract_host_from_route53(event)
+        enrich_event(event, cache_layer)
 
     return events
 
 
+def enrich_stream(events, cache_layer):
+    """Same as `enrich`, one event at a time
+
+    Args:
+        events (iterable<dict>): the stream of event dicts we want to enrich
+    """
+    for event in events:
+        yield enrich_event(event, cache_layer)
+
+
+def enrich_event(event, cache_layer):
+    add_metadata_to_lambda_log(event, cache_layer)
+    extract_ddtags_from_message(event)
+    extract_host_from_cloudtrails(event)
+    extract_host_from_guardduty(event)
+    extract_host_from_route53(event)
+
+    return event
+
+
 def add_metadata_to_lambda_log(event, cache_layer):
     """Mutate log dict to add tags, host, and service metadata
 
@@ -155,9 +171,10 @@ def extract_ddtags_from_message(event):
             extracted_ddtags = event["message"].pop(DD_CUSTOM_TAGS)
         if isinstance(event["message"], str):
             try:
-                message_dict = json.loads(event["message"])
+                # Copy the decoded message as it is shared with the other stages
+                message_dict = dict(get_json_message(event))
                 extracted_ddtags = message_dict.pop(DD_CUSTOM_TAGS)
-                event["message"] = json.dumps(message_dict)
+                set_json_message(event, message_dict)
             except Exception:
                 if logger.isEnabledFor(logging.DEBUG):
                     logger.debug(f"Failed to extract ddtags from: {event}")
@@ -192,9 +209,8 @@ def extract_host_from_cloudtrails(event):
     if event is not None and event.get(DD_SOURCE) == str(AwsEventSource.CLOUDTRAIL):
         message = event.get("message", {})
         if isinstance(message, str):
-            try:
-                message = json.loads(message)
-            except json.JSONDecodeError:
+            message = get_json_message(event)
+            if message is None:
                 logger.debug("Failed to decode cloudtrail message")
                 return
 
@@ -223,9 +239,8 @@ def extract_host_from_route53(event):
     if event is not None and event.get(DD_SOURCE) == str(AwsEventSource.ROUTE53):
         message = event.get("message", {})
         if isinstance(message, str):
-            try:
-                message = json.loads(message)
-            except json.JSONDecodeError:
+            message = get_json_message(event)
+            if message is None:
                 logger.debug("Failed to decode Route53 message")
                 return
 
@@ -10,6 +10,7 @@ from steps.common import (
     add_service_tag,
     generate_metadata,
     merge_dicts,
+    merge_metadata,
     parse_event_source,
 )
 from customized_log_group import (
@@ -18,6 +19,7 @@ from customized_log_group import (
     get_lambda_function_name_from_logstream_name,
 )
 from steps.handlers.aws_attributes import AwsAttributes
+from steps.parsed_event import ParsedEvent
 from steps.enums import AwsEventSource, AwsCwEventSourcePrefix
 from settings import (
     DD_SOURCE,
@@ -28,17 +30,54 @@ from settings import (
 logger = logging.getLogger()
 logger.setLevel(logging.getLevelName(os.environ.get("DD_LOG_LEVEL", "INFO").upper()))
 
+# Sources of the K8S control plane logs, from the EKS log stream name
+EKS_LOG_STREAM_PREFIXES = (
+    ("kube-apiserver-audit-", "kubernetes.audit"),
+    ("kube-scheduler-", "kube_scheduler"),
+    ("kube-apiserver-", "kube-apiserver"),
+    ("kube-controller-manager-", "kube-controller-manager"),
+    ("authenticator-", "aws-iam-authenticator"),
+)
+# Sources whose metadata depends on the content of the log events
+LOG_EVENTS_DEPENDENT_SOURCES = (
+    str(AwsEventSource.STEPFUNCTION),
+    str(AwsEventSource.VERIFIED_ACCESS),
+)
+
+
+def get_log_stream_class(log_stream):
+    """Returns everything the metadata of a log group depends on in a log stream name
+
+    Log streams of the same class share the same metadata, apart from the log
+    stream name itself.
+    """
+    return (
+        str(AwsCwEventSourcePrefix.CLOUDTRAIL) in log_stream,
+        str(AwsCwEventSourcePrefix.TRANSITGATEWAY) in log_stream,
+        str(AwsCwEventSourcePrefix.BEDROCK) in log_stream,
+        is_step_functions_log_group(log_stream),
+        # Also None when the log group is not a customized Lambda log group
+        get_lambda_function_name_from_logstream_name(log_stream),
+        next(
+            (
+                prefix
+                for prefix, _ in EKS_LOG_STREAM_PREFIXES
+                if log_stream.startswith(prefix)
+            ),
+            None,
+        ),
+    )
+
 
 class AwsLogsHandler:
     def __init__(self, context, cache_layer):
         self.context = context
         self.cache_layer = cache_layer
 
-    def handle(self, event):
-        # Generate metadata
-        metadata = generate_metadata(self.context)
-        # Get logs
-        logs = self.extract_logs(event)
+    def handle(self, event, logs=None):
+        # Get logs, unless they were already extracted from the event
+        if logs is None:
+            logs = self.extract_logs(event)
         # Build aws attributes
         aws_attributes = AwsAttributes(
             logs.get("logGroup"),
@@ -46,6 +85,51 @@ class AwsLogsHandler:
             logs.get("logEvents"),
             logs.get("owner"),
         )
+        # Get metadata, computed once per log group and log stream class
+        metadata = self.get_metadata(event, aws_attributes)
+        # Merge aws attributes and metadata once, then overlay them on every log
+        template = merge_dicts(aws_attributes.to_dict(), metadata)
+        # Create and send structured logs to Datadog
+        for log in logs["logEvents"]:
+            yield self.apply_template(ParsedEvent(log), template)
+
+    def prefetch_cloudwatch_tags(self, logs_payloads):
+        """Fetch at once the tags of the log groups of several payloads"""
+        log_group_arns = []
+        for logs in logs_payloads:
+            aws_attributes = AwsAttributes(logs.get("logGroup"))
+            self.set_account_region(aws_attributes)
+            log_group_arns.append(aws_attributes.get_log_group_arn())
+        self.cache_layer.get_cloudwatch_log_group_tags_cache().prefetch(log_group_arns)
+
+    @staticmethod
+    def apply_template(log, template):
+        # The nested dicts of the template end up shared by all the logs of
+        # the payload, the following steps only read them
+        return merge_metadata(log, template)
+
+    def get_metadata(self, event, aws_attributes):
+        log_group_metadata_cache = self.cache_layer.get_log_group_metadata_cache()
+        key = (
+            aws_attributes.get_log_group(),
+            get_log_stream_class(aws_attributes.get_log_stream()),
+            aws_attributes.get_owner(),
+            self.context.invoked_function_arn,
+        )
+        if cached := log_group_metadata_cache.get(key):
+            metadata, lambda_arn = cached
+            aws_attributes.set_lambda_arn(lambda_arn)
+            return metadata
+
+        metadata = self.build_metadata(event, aws_attributes)
+        # The host of these sources is read from the log events themselves
+        if metadata[DD_SOURCE] not in LOG_EVENTS_DEPENDENT_SOURCES:
+            log_group_metadata_cache.set(key, (metadata, aws_attributes.lambda_arn))
+        return metadata
+
+    def build_metadata(self, event, aws_attributes):
+        # Generate metadata
+        metadata = generate_metadata(self.context)
         # Set account and region from lambda function ARN
         self.set_account_region(aws_attributes)
         # Set the source on the logs
@@ -66,10 +150,7 @@ class AwsLogsHandler:
         # need to send their events with the correct log source.
         if metadata[DD_SOURCE] == str(AwsEventSource.EKS):
             self.process_eks_logs(metadata, aws_attributes)
-        # Create and send structured logs to Datadog
-        for log in logs["logEvents"]:
-            merged = merge_dicts(log, aws_attributes.to_dict())
-            yield merge_dicts(merged, metadata)
+        return metadata
 
     @staticmethod
     def extract_logs(event):
@@ -178,16 +259,10 @@ class AwsLogsHandler:
 
     def process_eks_logs(self, metadata, aws_attributes):
         log_stream = aws_attributes.get_log_stream()
-        if log_stream.startswith("kube-apiserver-audit-"):
-            metadata[DD_SOURCE] = "kubernetes.audit"
-        elif log_stream.startswith("kube-scheduler-"):
-            metadata[DD_SOURCE] = "kube_scheduler"
-        elif log_stream.startswith("kube-apiserver-"):
-            metadata[DD_SOURCE] = "kube-apiserver"
-        elif log_stream.startswith("kube-controller-manager-"):
-            metadata[DD_SOURCE] = "kube-controller-manager"
-        elif log_stream.startswith("authenticator-"):
-            metadata[DD_SOURCE] = "aws-iam-authenticator"
+        for prefix, source in EKS_LOG_STREAM_PREFIXES:
+            if log_stream.startswith(prefix):
+                metadata[DD_SOURCE] = source
+                break
         # In case the conditions above don't match we maintain eks as the source
 
     def get_state_machine_arn(self, aws_attributes):
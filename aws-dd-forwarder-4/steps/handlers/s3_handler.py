@@ -1,9 +1,12 @@
+import codecs
 import gzip
+import itertools
 import json
 import logging
 import os
 import re
 import urllib.parse
+import zlib
 from io import BufferedReader, BytesIO
 
 import boto3
@@ -18,9 +21,120 @@ from settings import (
     DD_USE_VPC,
     GOV_STRING,
 )
-from steps.common import add_service_tag, is_cloudtrail, merge_dicts, parse_event_source
+from steps.common import (
+    add_service_tag,
+    is_cloudtrail,
+    merge_metadata,
+    parse_event_source,
+)
 from steps.enums import AwsEventSource, AwsS3EventSourceKeyword
 
+# Size of the chunks read from S3 objects and of the chunks they inflate to
+STREAM_CHUNK_SIZE = 256 * 1024
+GZIP_MAGIC_NUMBER = b"\x1f\x8b"
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# Line boundaries of str.splitlines, see https://docs.python.org/3/library/stdtypes.html#str.splitlines
+LINE_BOUNDARIES = "\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029"
+LINE_BOUNDARY = re.compile("[%s]" % LINE_BOUNDARIES)
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# First characters of the separators of multiline logs
+MULTILINE_SEPARATOR_START = re.compile("[\n\r\f]")
+# Prefix of a number, literal or string escape running to the end of the text
+JSON_TOKEN_TAIL = re.compile(r"[\w.+\\-]*\Z")
+
+
+def decode_chunks(chunks, encoding="utf-8", errors="strict"):
+    """Decodes an iterator of bytes chunks into an iterator of non empty texts"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+class JsonStreamReader:
+    """Reads a JSON document from an iterator of texts, one value at a time
+
+    Only the text of the value being read is kept in memory, which allows
+    walking through arrays too large to be decoded at once.
+    """
+
+    def __init__(self, texts):
+        self.texts = iter(texts)
+        self.buffer = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _read(self, min_size=1):
+        """
+        Appends at least min_size characters of the next texts to the unread
+        part of the buffer, or whatever is left of them. Returns False if
+        there was nothing left.
+        """
+        parts = [self.buffer[self.pos :]]
+        size = 0
+        while size < min_size:
+            text = next(self.texts, None)
+            if text is None:
+                break
+            parts.append(text)
+            size += len(text)
+        if not size:
+            return False
+        self.buffer = "".join(parts)
+        self.pos = 0
+        return True
+
+    def _is_truncated(self, error):
+        """Whether a decoding error may only be due to the end of the buffer"""
+        return (
+            error.pos >= len(self.buffer)
+            or error.msg.startswith("Unterminated string")
+            or JSON_TOKEN_TAIL.match(self.buffer, error.pos) is not None
+        )
+
+    def peek(self):
+        """Returns the next non whitespace character, or an empty string at the end"""
+        while True:
+            self.pos = JSON_WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                return ""
+
+    def expect(self, characters):
+        """Consumes the next non whitespace character, one of the given ones"""
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError(
+                "Expected one of %r at position %d, got %r"
+                % (characters, self.pos, character)
+            )
+        self.pos += 1
+        return character
+
+    def value(self):
+        """Decodes the next JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                # Read at least as much as is buffered before decoding again,
+                # so that a value spanning many texts is decoded in linear time
+                if not self._is_truncated(e) or not self._read(
+                    len(self.buffer) - self.pos
+                ):
+                    raise
+                continue
+            # A number at the end of the buffer could continue in the next text
+            if JSON_TOKEN_TAIL.match(self.buffer, end) is None or not self._read():
+                self.pos = end
+                return value
+
 
 class S3EventDataStore:
     def __init__(self):
@@ -28,11 +142,12 @@ class S3EventDataStore:
         self.key = None
         self.source = None
         self.data = None
+        self.body = None
         self.cloudtrail_bucket = False
 
 
 class S3EventHandler:
-    def __init__(self, context, metadata, cache_layer):
+    def __init__(self, context, metadata, cache_layer, stream=False):
         self.logger = logging.getLogger()
         self.logger.setLevel(
             logging.getLevelName(os.environ.get("DD_LOG_LEVEL", "INFO").upper())
@@ -40,6 +155,9 @@ class S3EventHandler:
         self.context = context
         self.metadata = metadata
         self.cache_layer = cache_layer
+        # When streaming, the object is read, inflated and split into lines
+        # chunk by chunk instead of being loaded in memory all at once
+        self.stream = stream
         self.multiline_regex_start_pattern = (
             re.compile("^{}".format(DD_MULTILINE_LOG_REGEX_PATTERN))
             if DD_MULTILINE_LOG_REGEX_PATTERN
@@ -227,7 +345,10 @@ class S3EventHandler:
             Bucket=self.data_store.bucket, Key=self.data_store.key
         )
         body = response.get("Body")
-        self.data_store.data = body.read()
+        if self.stream:
+            self.data_store.body = body
+        else:
+            self.data_store.data = body.read()
 
     def _get_s3_client(self):
         # Need to use path style to access s3 via VPC Endpoints
@@ -243,6 +364,10 @@ class S3EventHandler:
         return s3
 
     def _get_structured_lines_for_s3_handler(self):
+        if self.data_store.body is not None:
+            yield from self._get_structured_lines_from_stream()
+            return
+
         self._decompress_data()
 
         if is_cloudtrail(self.data_store.key):
@@ -261,17 +386,187 @@ class S3EventHandler:
                 # file around 60MB gzipped
                 self.data_store.data = b"".join(BufferedReader(decompress_stream))
 
-    def _extract_cloudtrail_logs(self):
-        try:
-            cloudtrail_data = json.loads(self.data_store.data)
-            if cloudtrail_data.get("Records", None) is None:
-                return
+    def _get_structured_lines_from_stream(self):
+        chunks = self._get_data_chunks()
 
-            self.data_store.cloudtrail_bucket = True
-            # only parse as a cloudtrail bucket if we have a Records field to parse
-            for event in cloudtrail_data.get("Records"):
+        if is_cloudtrail(self.data_store.key):
+            # Keep the chunks read until the file is known to hold CloudTrail
+            # records, to split it into lines otherwise
+            head = []
+
+            def read_chunks():
+                for chunk in chunks:
+                    if not self.data_store.cloudtrail_bucket:
+                        head.append(chunk)
+                    elif head:
+                        head.clear()
+                    yield chunk
+
+            yield from self._extract_cloudtrail_logs(read_chunks())
+            if not self.data_store.cloudtrail_bucket:
+                yield from self._extract_other_logs_from_chunks(
+                    itertools.chain(head, chunks)
+                )
+            return
+
+        yield from self._extract_other_logs_from_chunks(chunks)
+
+    def _get_data_chunks(self):
+        """Returns the (decompressed) object body as an iterator of bytes chunks"""
+        body = self.data_store.body
+        chunks = iter(lambda: body.read(STREAM_CHUNK_SIZE), b"")
+        first_chunk = next(chunks, b"")
+        chunks = itertools.chain([first_chunk], chunks)
+
+        # Decompress data that has a .gz extension or magic header http://www.onicos.com/staff/iz/formats/gzip.html
+        if (
+            self.data_store.key[-3:] == ".gz"
+            or first_chunk[:2] == GZIP_MAGIC_NUMBER
+        ):
+            return self._decompress_chunks(chunks)
+        return chunks
+
+    def _decompress_chunks(self, chunks):
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        member_started = False
+        for chunk in chunks:
+            while chunk:
+                if not member_started:
+                    # Like gzip.GzipFile, skip the zero padding between members
+                    chunk = chunk.lstrip(b"\x00")
+                    if not chunk:
+                        break
+                    member_started = True
+                # Bound the size of the inflated chunk to keep memory flat
+                # even for highly compressible objects
+                data = decompressor.decompress(chunk, STREAM_CHUNK_SIZE)
+                if data:
+                    yield data
+                if decompressor.eof:
+                    # Objects can be made of several concatenated gzip members
+                    chunk = decompressor.unused_data
+                    decompressor = zlib.decompressobj(GZIP_WBITS)
+                    member_started = False
+                else:
+                    chunk = decompressor.unconsumed_tail
+        if member_started:
+            data = decompressor.flush()
+            if not decompressor.eof:
+                raise EOFError(
+                    "Compressed file ended before the end-of-stream marker was reached"
+                )
+            if data:
+                yield data
+
+    def _extract_other_logs_from_chunks(self, chunks):
+        # Same as _extract_other_logs, but lines are yielded as soon as they are complete
+        if self.multiline_regex_start_pattern and self.multiline_regex_pattern:
+            texts = decode_chunks(chunks, errors="ignore")
+            # Match the start pattern against a large enough head of the file
+            first_texts = []
+            first_texts_size = 0
+            for text in texts:
+                first_texts.append(text)
+                first_texts_size += len(text)
+                if first_texts_size >= STREAM_CHUNK_SIZE:
+                    break
+            first_text = "".join(first_texts)
+            texts = itertools.chain([first_text], texts)
+
+            if self.multiline_regex_start_pattern.match(first_text):
+                lines = self._split_multiline_texts(texts)
+            else:
+                self.logger.debug(
+                    "DD_MULTILINE_LOG_REGEX_PATTERN %s did not match start of file, splitting by line",
+                    DD_MULTILINE_LOG_REGEX_PATTERN,
+                )
+                lines = self._split_texts(texts)
+
+            for line in lines:
+                yield self._format_event(line)
+
+        else:
+            for line in self._split_chunks(chunks):
+                line = line.decode("utf-8", errors="ignore").strip()
+                if len(line) == 0:
+                    continue
+
+                yield self._format_event(line)
+
+    def _split_chunks(self, chunks):
+        """Same as bytes.splitlines over the concatenated chunks
+
+        A CRLF sequence split across two chunks produces an extra empty line,
+        which is skipped like any other blank line.
+        """
+        # Parts of the line in progress, none of them holds a line boundary
+        parts = []
+        for chunk in chunks:
+            end = max(chunk.rfind(b"\n"), chunk.rfind(b"\r")) + 1
+            if end == 0:
+                parts.append(chunk)
+                continue
+            parts.append(chunk[:end])
+            yield from b"".join(parts).splitlines()
+            parts = [chunk[end:]] if end < len(chunk) else []
+        if parts:
+            yield from b"".join(parts).splitlines()
+
+    def _split_texts(self, texts):
+        """Same as str.splitlines over the concatenated texts"""
+        parts = []
+        for text in texts:
+            parts.append(text)
+            if LINE_BOUNDARY.search(text) is None:
+                continue
+            lines = "".join(parts).splitlines(keepends=True)
+            parts = []
+            # Keep the last line for later if it is incomplete, or if it ends with
+            # a CR that could be followed by a LF in the next text
+            if lines and (
+                lines[-1][-1] not in LINE_BOUNDARIES or lines[-1][-1] == "\r"
+            ):
+                parts.append(lines.pop())
+            for line in lines:
+                yield line[:-2] if line.endswith("\r\n") else line[:-1]
+        if parts:
+            yield from "".join(parts).splitlines()
+
+    def _split_multiline_texts(self, texts):
+        """Same as splitting the concatenated texts with the multiline regex
+
+        The separators start with a line boundary, so the pending text is only
+        searched again once a text holding one arrives, and at the end.
+        """
+        parts = []
+        for text in itertools.chain(texts, [None]):
+            if text is not None:
+                parts.append(text)
+                if MULTILINE_SEPARATOR_START.search(text) is None:
+                    continue
+            pending = "".join(parts)
+            start = 0
+            for match in self.multiline_regex_pattern.finditer(pending):
+                # The separator could continue in the next text
+                if match.end() >= len(pending):
+                    break
+                if match.start() > start:
+                    yield pending[start : match.start()]
+                start = match.end()
+            parts = [pending[start:]] if start < len(pending) else []
+        if parts:
+            yield parts[0]
+
+    def _extract_cloudtrail_logs(self, chunks=None):
+        if chunks is None:
+            chunks = [self.data_store.data]
+        try:
+            # Walk through the Records array one record at a time rather than
+            # decoding the whole file, which can be hundreds of MB for busy trails
+            reader = JsonStreamReader(decode_chunks(chunks, "utf-8-sig"))
+            for event in self._read_cloudtrail_records(reader):
                 # Create structured object and send it
-                structured_line = merge_dicts(
+                structured_line = merge_metadata(
                     event,
                     {
                         "aws": {
@@ -286,6 +581,37 @@ class S3EventHandler:
         except Exception as e:
             self.logger.debug("Unable to parse cloudtrail log: %s" % e)
 
+    def _read_cloudtrail_records(self, reader):
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise ValueError("Expected an object key, got %r" % key)
+            reader.expect(":")
+
+            if key == "Records" and reader.peek() == "[":
+                # only parse as a cloudtrail bucket if we have a Records field to parse
+                self.data_store.cloudtrail_bucket = True
+                reader.expect("[")
+                if reader.peek() == "]":
+                    return
+                while True:
+                    yield reader.value()
+                    if reader.expect(",]") == "]":
+                        return
+
+            value = reader.value()
+            if key == "Records" and value is not None:
+                self.data_store.cloudtrail_bucket = True
+                yield from value
+                return
+
+            if reader.expect(",}") == "}":
+                return
+
     def _extract_other_logs(self):
         # Check if using multiline log regex pattern
         # and determine whether line or pattern separated logs
@@ -0,0 +1,88 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+
+import json
+
+_NOT_DECODED = object()
+
+
+class ParsedEvent(dict):
+    """A log event that JSON-decodes its `message` at most once
+
+    The event behaves exactly like the dict it wraps. The decoded message is
+    cached next to the raw string it was decoded from, so any stage that
+    replaces `message` with a new value invalidates the cache implicitly.
+    """
+
+    __slots__ = ("_raw_message", "_json_message")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._raw_message = None
+        self._json_message = _NOT_DECODED
+
+    def get_json_message(self):
+        message = self.get("message")
+        if not isinstance(message, str):
+            return None
+        if message is not self._raw_message or self._json_message is _NOT_DECODED:
+            self._raw_message = message
+            self._json_message = _decode(message)
+        return self._json_message
+
+    def set_json_message(self, obj):
+        message = json.dumps(obj)
+        self["message"] = message
+        self._raw_message = message
+        self._json_message = obj
+
+    def detach_json_message(self):
+        obj = self.get_json_message()
+        self._raw_message = None
+        self._json_message = _NOT_DECODED
+        return obj
+
+
+def get_json_message(event):
+    """Returns the JSON-decoded `message` of the event
+
+    The decoded object is shared with every other stage reading the same
+    event and must not be mutated in place, use `set_json_message` or
+    `detach_json_message` instead.
+
+    Returns None when the message is not a string holding valid JSON.
+    """
+    if isinstance(event, ParsedEvent):
+        return event.get_json_message()
+    message = event.get("message")
+    if not isinstance(message, str):
+        return None
+    return _decode(message)
+
+
+def set_json_message(event, obj):
+    """Replaces the `message` of the event with the serialized object"""
+    if isinstance(event, ParsedEvent):
+        event.set_json_message(obj)
+    else:
+        event["message"] = json.dumps(obj)
+
+
+def detach_json_message(event):
+    """Returns the decoded `message` of the event for in-place modifications
+
+    The event keeps its raw `message` but forgets the decoded object, so the
+    caller becomes its sole owner.
+    """
+    if isinstance(event, ParsedEvent):
+        return event.detach_json_message()
+    return get_json_message(event)
+
+
+def _decode(message):
+    try:
+        return json.loads(message)
+    except ValueError:
+        return None
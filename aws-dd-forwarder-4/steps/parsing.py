@@ -13,9 +13,10 @@ from steps.handlers.s3_handler import S3EventHandler
 from steps.common import (
     generate_metadata,
     get_service_from_tags_and_remove_duplicates,
-    merge_dicts,
+    merge_metadata,
 )
 from steps.enums import AwsEventType, AwsEventTypeKeyword, AwsEventSource
+from steps.parsed_event import ParsedEvent
 from settings import (
     DD_SOURCE,
     DD_SERVICE,
@@ -46,18 +47,56 @@ def parse(event, context, cache_layer):
             case AwsEventType.SNS:
                 events = sns_handler(event, metadata)
             case AwsEventType.KINESIS:
-                events = kinesis_awslogs_handler(event, context, cache_layer)
+                events = kinesis_awslogs_handler(
+                    event, context, cache_layer, prefetch_tags=True
+                )
                 return collect_and_count(events)
     except Exception as e:
         # Logs through the socket the error
-        err_message = "Error parsing the object. Exception: {} for event {}".format(
-            str(e), event
-        )
-        events = [err_message]
+        events = [parsing_error_message(e, event)]
 
     return normalize_events(events, metadata)
 
 
+def parse_stream(event, context, cache_layer):
+    """Parse Lambda input to a stream of normalized events
+
+    Same as `parse`, except that events are yielded one at a time as they are
+    read from the trigger instead of being collected into a list first.
+    """
+    metadata = generate_metadata(context)
+    try:
+        event_type = parse_event_type(event)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Parsed event type: {event_type}")
+        set_forwarder_telemetry_tags(context, event_type)
+        match event_type:
+            case AwsEventType.AWSLOGS:
+                aws_handler = AwsLogsHandler(context, cache_layer)
+                events = aws_handler.handle(event)
+                return count_events(catch_parsing_errors(events, event, metadata))
+            case AwsEventType.S3:
+                s3_handler = S3EventHandler(
+                    context, metadata, cache_layer, stream=True
+                )
+                events = s3_handler.handle(event)
+            case AwsEventType.EVENTS:
+                events = cwevent_handler(event, metadata)
+            case AwsEventType.SNS:
+                events = sns_handler(event, metadata)
+            case AwsEventType.KINESIS:
+                events = kinesis_awslogs_handler(event, context, cache_layer)
+                return count_events(catch_parsing_errors(events, event, metadata))
+    except Exception as e:
+        events = [parsing_error_message(e, event)]
+
+    return count_events(normalize_stream(events, metadata))
+
+
+def parsing_error_message(e, event):
+    return "Error parsing the object. Exception: {} for event {}".format(str(e), event)
+
+
 def parse_event_type(event):
     if records := event.get(str(AwsEventTypeKeyword.RECORDS), None):
         record = records[0]
@@ -108,13 +147,23 @@ def sns_handler(event, metadata):
 
 
 # Handle CloudWatch logs from Kinesis
-def kinesis_awslogs_handler(event, context, cache_layer):
+def kinesis_awslogs_handler(event, context, cache_layer, prefetch_tags=False):
     def reformat_record(record):
         return {"awslogs": {"data": record["kinesis"]["data"]}}
 
     awslogs_handler = AwsLogsHandler(context, cache_layer)
+    if not prefetch_tags:
+        return itertools.chain.from_iterable(
+            awslogs_handler.handle(reformat_record(r)) for r in event["Records"]
+        )
+
+    # The records may come from many log groups, whose tags are fetched at
+    # once after extracting the logs of every record
+    records = [reformat_record(r) for r in event["Records"]]
+    logs_payloads = [awslogs_handler.extract_logs(r) for r in records]
+    awslogs_handler.prefetch_cloudwatch_tags(logs_payloads)
     return itertools.chain.from_iterable(
-        awslogs_handler.handle(reformat_record(r)) for r in event["Records"]
+        awslogs_handler.handle(r, logs) for r, logs in zip(records, logs_payloads)
     )
 
 
@@ -124,13 +173,9 @@ def normalize_events(events, metadata):
 
     for event in events:
         events_counter += 1
-        if isinstance(event, dict):
-            normalized.append(merge_dicts(event, metadata))
-        elif isinstance(event, str):
-            normalized.append(merge_dicts({"message": event}, metadata))
-        else:
-            # drop this log
-            continue
+        normalized_event = normalize_event(event, metadata)
+        if normalized_event is not None:
+            normalized.append(normalized_event)
 
     """Submit count of total events"""
     send_event_metric("incoming_events", events_counter)
@@ -138,6 +183,21 @@ def normalize_events(events, metadata):
     return normalized
 
 
+def normalize_stream(events, metadata):
+    # Dropped events are yielded as None so that they are still counted
+    for event in events:
+        yield normalize_event(event, metadata)
+
+
+def normalize_event(event, metadata):
+    if isinstance(event, dict):
+        return merge_metadata(ParsedEvent(event), metadata)
+    elif isinstance(event, str):
+        return merge_metadata(ParsedEvent(message=event), metadata)
+    # drop this log
+    return None
+
+
 def collect_and_count(events):
     collected = []
     counter = 0
@@ -148,3 +208,26 @@ def collect_and_count(events):
     send_event_metric("incoming_events", counter)
 
     return collected
+
+
+def count_events(events):
+    """Yields the events that were not dropped, then submits the count of all events"""
+    counter = 0
+    try:
+        for event in events:
+            counter += 1
+            if event is not None:
+                yield event
+    finally:
+        send_event_metric("incoming_events", counter)
+
+
+def catch_parsing_errors(events, event, metadata):
+    """Turns an exception raised while reading the events into an error log
+
+    Events already yielded are kept, as they may have been forwarded.
+    """
+    try:
+        yield from events
+    except Exception as e:
+        yield normalize_event(parsing_error_message(e, event), metadata)
@@ -1,7 +1,7 @@
 import logging
-import json
 import os
 from settings import DD_CUSTOM_TAGS
+from steps.parsed_event import get_json_message
 
 logger = logging.getLogger()
 logger.setLevel(logging.getLevelName(os.environ.get("DD_LOG_LEVEL", "INFO").upper()))
@@ -28,10 +28,27 @@ def split(events):
     return metrics, logs, trace_payloads
 
 
+def split_stream(events, metrics, trace_payloads):
+    """Yield the logs of the events while collecting metrics and trace payloads
+
+    The metrics and trace_payloads lists are only complete once all the logs
+    have been consumed.
+    """
+    for event in events:
+        metric = extract_metric(event)
+        trace_payload = extract_trace_payload(event)
+        if metric:
+            metrics.append(metric)
+        elif trace_payload:
+            trace_payloads.append(trace_payload)
+        else:
+            yield event
+
+
 def extract_metric(event):
     """Extract metric from an event if possible"""
     try:
-        metric = json.loads(event["message"])
+        metric = get_json_message(event)
         required_attrs = {"m", "v", "e", "t"}
         if not all(attr in metric for attr in required_attrs):
             return None
@@ -43,6 +60,9 @@ def extract_metric(event):
         lambda_log_metadata = event.get("lambda", {})
         lambda_log_arn = lambda_log_metadata.get("arn")
 
+        # Copy the decoded message as it is shared with the other stages
+        metric = dict(metric)
+        metric["t"] = list(metric["t"])
         if lambda_log_arn:
             metric["t"] += [f"function_arn:{lambda_log_arn.lower()}"]
 
@@ -56,7 +76,7 @@ def extract_trace_payload(event):
     """Extract trace payload from an event if possible"""
     try:
         message = event["message"]
-        obj = json.loads(event["message"])
+        obj = get_json_message(event)
 
         obj_has_traces = "traces" in obj
         traces_is_a_list = isinstance(obj["traces"], list)
@@ -6,6 +6,7 @@ import os
 from settings import DD_SOURCE
 
 from steps.enums import AwsEventSource
+from steps.parsed_event import detach_json_message
 
 logger = logging.getLogger()
 logger.setLevel(logging.getLevelName(os.environ.get("DD_LOG_LEVEL", "INFO").upper()))
@@ -33,6 +34,24 @@ def transform(events):
     return events
 
 
+def transform_stream(events):
+    """Same as `transform`, one event at a time
+
+    Security Hub findings are yielded in place of their event rather than
+    being moved to the end of the list.
+
+    Args:
+        events (iterable<dict>): the stream of event dicts we want to transform
+    """
+    for event in events:
+        event = parse_aws_waf_logs(event)
+        findings = separate_security_hub_findings(event)
+        if findings:
+            yield from findings
+        else:
+            yield event
+
+
 def separate_security_hub_findings(event):
     """Replace Security Hub event with series of events based on findings
 
@@ -95,17 +114,20 @@ def parse_aws_waf_logs(event):
     if event.get(DD_SOURCE) != str(AwsEventSource.WAF):
         return event
 
-    event_copy = copy.deepcopy(event)
-
-    message = event_copy.get("message", {})
-    if isinstance(message, str):
-        try:
-            message = json.loads(message)
-        except json.JSONDecodeError:
+    if isinstance(event.get("message"), str):
+        # The message is replaced by its parsed form in the copy, so the
+        # decoded object can be taken from the event and modified in place
+        message = detach_json_message(event)
+        if message is None:
             logger.debug(
-                "Failed to decode waf message, first bytes were `%s`", message[:8192]
+                "Failed to decode waf message, first bytes were `%s`",
+                event["message"][:8192],
             )
             return event
+        event_copy = copy.deepcopy(event)
+    else:
+        event_copy = copy.deepcopy(event)
+        message = event_copy.get("message", {})
 
     headers = message.get("httpRequest", {}).get("headers")
     if headers:
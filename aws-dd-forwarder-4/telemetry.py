@@ -10,7 +10,7 @@ try:
 except ImportError:
     DD_SUBMIT_ENHANCED_METRICS = False
 
-from settings import DD_FORWARDER_VERSION
+from settings import DD_FORWARDER_VERSION, DD_LOG_METRICS_ROLL_UP_INTERVAL_SECONDS
 
 DD_FORWARDER_TELEMETRY_NAMESPACE_PREFIX = "aws.dd_forwarder"
 DD_FORWARDER_TELEMETRY_TAGS = []
@@ -52,10 +52,33 @@ def send_event_metric(metric_name, metric_value):
     )
 
 
-def send_log_metric(metric):
+def _get_series_writer():
+    """Returns the series API of the ThreadStats writer, if there is one"""
+    thread_stats = getattr(lambda_stats, "thread_stats", None)
+    return getattr(thread_stats, "distributions", None)
+
+
+def get_log_metric_roll_up_interval():
+    """Returns the interval the points of log metrics can be aggregated over
+    without changing the metrics submitted. ThreadStats rolls the points up over
+    this interval anyway, while the other writers submit each point with its
+    own timestamp, so their points are only aggregated on the same timestamp"""
+    if DD_SUBMIT_ENHANCED_METRICS and _get_series_writer() is not None:
+        return DD_LOG_METRICS_ROLL_UP_INTERVAL_SECONDS
+    return 1
+
+
+def send_log_metric_series(name, values, timestamp, tags):
+    """Send all the values of a series of custom metrics at once"""
     if not DD_SUBMIT_ENHANCED_METRICS:
         return
 
-    lambda_stats.distribution(
-        metric["m"], metric["v"], timestamp=metric["e"], tags=metric["t"]
-    )
+    distributions = _get_series_writer()
+    if distributions is None:
+        # Other writers, and ThreadStats of datadog releases before the series
+        # API, only take one value at a time
+        for value in values:
+            lambda_stats.distribution(name, value, timestamp=timestamp, tags=tags)
+        return
+
+    distributions(name, values, timestamp=timestamp, tags=tags)
@@ -0,0 +1,18 @@
+import importlib
+import sys
+from unittest.mock import MagicMock, patch
+
+
+def import_unmocked(*names):
+    """Imports the given modules as they are, even when a test module already
+    imported replaced some of the packages they depend on by mocks in
+    sys.modules. The modules are imported together so that they share the
+    same dependencies, and sys.modules is left as it was."""
+    with patch.dict(sys.modules):
+        mocked = [n for n, m in sys.modules.items() if isinstance(m, MagicMock)]
+        for name in list(sys.modules):
+            # Submodules cached before the mock would not be bound to the
+            # package imported again
+            if any(name == n or name.startswith(n + ".") for n in mocked):
+                del sys.modules[name]
+        return [importlib.import_module(name) for name in names]
@@ -371,5 +371,108 @@ class TestParsingStepFunctionLogs(unittest.TestCase):
         )
 
 
+class TestLogGroupMetadataReuse(unittest.TestCase):
+    def create_event(self, log_group, log_stream, messages):
+        data = {
+            "owner": "123456789012",
+            "logGroup": log_group,
+            "logStream": log_stream,
+            "logEvents": [
+                {"id": str(i), "timestamp": i, "message": message}
+                for i, message in enumerate(messages)
+            ],
+        }
+        return {
+            "awslogs": {
+                "data": base64.b64encode(
+                    gzip.compress(bytes(json.dumps(data), "utf-8"))
+                )
+            }
+        }
+
+    @patch("caching.cloudwatch_log_group_cache.CloudwatchLogGroupTagsCache.__init__")
+    def setUp(self, mock_cache_init):
+        mock_cache_init.return_value = None
+        self.cache_layer = CacheLayer("")
+        self.cache_layer._cloudwatch_log_group_cache.get = MagicMock(
+            return_value=["team:a"]
+        )
+        self.awslogs_handler = AwsLogsHandler(Context(), self.cache_layer)
+
+    def test_metadata_is_reused_for_the_same_log_group(self):
+        log_group = "/aws/lambda/my-function"
+        first = list(
+            self.awslogs_handler.handle(
+                self.create_event(log_group, "2024/01/01/[$LATEST]a", ["a", "b"])
+            )
+        )
+        second = list(
+            self.awslogs_handler.handle(
+                self.create_event(log_group, "2024/01/01/[$LATEST]b", ["c"])
+            )
+        )
+
+        self.cache_layer._cloudwatch_log_group_cache.get.assert_called_once()
+        self.assertEqual(
+            first[0]["aws"]["awslogs"]["logStream"], "2024/01/01/[$LATEST]a"
+        )
+        self.assertEqual(
+            second[0]["aws"]["awslogs"]["logStream"], "2024/01/01/[$LATEST]b"
+        )
+        for log in first + second:
+            self.assertEqual(log["ddsource"], "lambda")
+            self.assertEqual(log["ddtags"].split(",")[-2:], ["team:a", "env:none"])
+            self.assertEqual(
+                log["lambda"], {"arn": "invoked_function_arnfunction:my-function"}
+            )
+
+    def test_metadata_depends_on_the_log_stream_class(self):
+        log_group = "/aws/eks/cluster/cluster"
+        sources = [
+            log["ddsource"]
+            for log_stream in ["kube-scheduler-1", "authenticator-1", "other"]
+            for log in self.awslogs_handler.handle(
+                self.create_event(log_group, log_stream, ["a"])
+            )
+        ]
+        self.assertEqual(sources, ["kube_scheduler", "aws-iam-authenticator", "eks"])
+
+    def test_metadata_depending_on_log_events_is_not_reused(self):
+        self.cache_layer._step_functions_cache.get = MagicMock(return_value=[])
+        hosts = []
+        for name in ["first", "second"]:
+            message = json.dumps(
+                {
+                    "execution_arn": f"arn:aws:states:us-east-1:12345678910:execution:{name}:run"
+                }
+            )
+            logs = self.awslogs_handler.handle(
+                self.create_event("/aws/vendedlogs/states/sm", "states/sm", [message])
+            )
+            hosts += [log["host"] for log in logs]
+
+        self.assertEqual(
+            hosts,
+            [
+                "arn:aws:states:us-east-1:12345678910:stateMachine:first",
+                "arn:aws:states:us-east-1:12345678910:stateMachine:second",
+            ],
+        )
+
+    def test_conflicting_log_attributes_are_merged(self):
+        log = AwsLogsHandler.apply_template(
+            {"message": "a", "aws": {"custom": 1}},
+            {"aws": {"awslogs": {"logGroup": "my-log-group"}}, "ddsource": "s"},
+        )
+        self.assertEqual(
+            log,
+            {
+                "message": "a",
+                "aws": {"custom": 1, "awslogs": {"logGroup": "my-log-group"}},
+                "ddsource": "s",
+            },
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
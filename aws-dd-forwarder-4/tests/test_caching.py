@@ -1,10 +1,30 @@
+import gzip
+import io
+import threading
 import unittest
+from time import time
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+from deadline import Deadline
+from caching.cloudwatch_log_group_cache import CloudwatchLogGroupTagsCache
+from caching.lambda_cache import LambdaTagsCache
+from caching.log_group_metadata_cache import LogGroupMetadataCache
+from caching.s3_tags_cache import S3TagsCache
 from caching.common import (
+    decode_cache_body,
+    encode_cache_body,
     sanitize_aws_tag_string,
     parse_get_resources_response_for_tags_by_arn,
     get_dd_tag_string_from_aws_dict,
 )
 
+NOT_MODIFIED = ClientError(
+    {"Error": {"Code": "304"}, "ResponseMetadata": {"HTTPStatusCode": 304}},
+    "GetObject",
+)
+
 
 class TestCaching(unittest.TestCase):
     def test_sanitize_tag_string(self):
@@ -91,5 +111,261 @@ class TestCaching(unittest.TestCase):
         )
 
 
+class TestCacheBody(unittest.TestCase):
+    def test_small_caches_are_plain_json(self):
+        body = encode_cache_body({"arn": ["team:a"]})
+        self.assertEqual(body, b'{"arn": ["team:a"]}')
+        self.assertEqual(decode_cache_body(body), {"arn": ["team:a"]})
+
+    def test_large_caches_are_compressed(self):
+        data = {f"arn:{i}": ["team:a", "env:prod"] for i in range(1000)}
+        body = encode_cache_body(data)
+        self.assertEqual(body[:2], b"\x1f\x8b")
+        self.assertLess(len(body), len(gzip.decompress(body)))
+        self.assertEqual(decode_cache_body(body), data)
+
+
+@patch("caching.base_tags_cache.send_forwarder_internal_metrics")
+class TestConditionalCacheFetch(unittest.TestCase):
+    def test_tags_cache_is_fetched_once_unchanged(self, send_metrics):
+        cache = LambdaTagsCache("")
+        cache.s3_client = MagicMock()
+        cache_object = cache.s3_client.Object.return_value
+        cache_object.get.return_value = {
+            "Body": io.BytesIO(encode_cache_body({"arn": ["team:a"]})),
+            "ETag": '"etag"',
+            "ResponseMetadata": {
+                "HTTPHeaders": {"last-modified": "Mon, 01 Jan 2024 00:00:00 GMT"}
+            },
+        }
+        tags, last_modified = cache.get_cache_from_s3()
+        self.assertEqual(tags, {"arn": ["team:a"]})
+
+        cache_object.get.side_effect = NOT_MODIFIED
+        self.assertEqual(cache.get_cache_from_s3(), (tags, last_modified))
+        cache_object.get.assert_called_with(IfNoneMatch='"etag"')
+        send_metrics.assert_called_with("s3_cache_not_modified")
+
+    def test_tags_cache_written_is_not_fetched_again(self, send_metrics):
+        cache = LambdaTagsCache("")
+        cache.s3_client = MagicMock()
+        cache_object = cache.s3_client.Object.return_value
+        cache_object.put.return_value = {"ETag": '"etag"'}
+        cache_object.get.side_effect = NOT_MODIFIED
+        cache.write_cache_to_s3({"arn": ["team:a"]})
+        tags, _ = cache.get_cache_from_s3()
+        self.assertEqual(tags, {"arn": ["team:a"]})
+        cache_object.get.assert_called_once_with(IfNoneMatch='"etag"')
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.objects = {}
+        self.writes = 0
+        self.get_object = MagicMock(side_effect=self._get_object)
+        self.put_object = MagicMock(side_effect=self._put_object)
+
+    def _get_object(self, Bucket, Key, IfNoneMatch=None):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        body, etag = self.objects[Key]
+        if IfNoneMatch == etag:
+            raise NOT_MODIFIED
+        return {"Body": io.BytesIO(body), "ETag": etag}
+
+    def _put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None):
+        _, current_etag = self.objects.get(Key, (None, None))
+        if (IfMatch and IfMatch != current_etag) or (
+            IfNoneMatch == "*" and current_etag
+        ):
+            raise ClientError(
+                {
+                    "Error": {"Code": "PreconditionFailed"},
+                    "ResponseMetadata": {"HTTPStatusCode": 412},
+                },
+                "PutObject",
+            )
+        self.writes += 1
+        etag = f'"{self.writes}"'
+        self.objects[Key] = (Body, etag)
+        return {"ETag": etag}
+
+
+@patch.dict("os.environ", {"DD_FETCH_LOG_GROUP_TAGS": "true"})
+@patch("caching.cloudwatch_log_group_cache.send_forwarder_internal_metrics")
+class TestCloudwatchLogGroupTagsCache(unittest.TestCase):
+    def setUp(self):
+        self.s3_client = FakeS3Client()
+        self.cache = self.new_cache()
+        self.arns = [f"arn:aws:logs:us-east-1:0:log-group:group-{i}" for i in range(50)]
+
+    def new_cache(self):
+        cache = CloudwatchLogGroupTagsCache("")
+        cache.s3_client = self.s3_client
+        cache.cloudwatch_logs_client = MagicMock()
+        cache.cloudwatch_logs_client.list_tags_for_resource.side_effect = (
+            lambda resourceArn: {"tags": {"name": resourceArn.split(":")[-1]}}
+        )
+        return cache
+
+    def test_prefetch_fetches_shards_and_misses_once(self, send_metrics):
+        self.cache.prefetch(self.arns)
+        list_tags = self.cache.cloudwatch_logs_client.list_tags_for_resource
+        self.assertEqual(list_tags.call_count, len(self.arns))
+        self.assertEqual(self.s3_client.put_object.call_count, self.cache.shard_count)
+        self.assertEqual(self.cache.get(self.arns[3]), ["name:group-3"])
+
+        # A cold start reads the tags from the shards only
+        cache = self.new_cache()
+        cache.prefetch(self.arns)
+        cache.cloudwatch_logs_client.list_tags_for_resource.assert_not_called()
+        self.assertEqual(cache.get(self.arns[7]), ["name:group-7"])
+
+    def test_get_loads_the_shard_of_the_log_group(self, send_metrics):
+        self.cache.prefetch(self.arns)
+        cache = self.new_cache()
+        self.s3_client.get_object.reset_mock()
+        for arn in self.arns:
+            if cache._get_shard_index(arn) == 0:
+                cache.get(arn)
+        self.assertEqual(self.s3_client.get_object.call_count, 1)
+
+    def test_unchanged_shards_are_not_downloaded_again(self, send_metrics):
+        self.cache.prefetch(self.arns[:1])
+        self.cache.tags_by_log_group.clear()
+        self.assertEqual(self.cache.get(self.arns[0]), ["name:group-0"])
+        send_metrics.assert_any_call("loggroup_s3_cache_not_modified")
+
+    def test_unreadable_log_groups_are_cached(self, send_metrics):
+        list_tags = self.cache.cloudwatch_logs_client.list_tags_for_resource
+        list_tags.side_effect = ClientError(
+            {"Error": {"Code": "AccessDeniedException"}}, "ListTagsForResource"
+        )
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(self.cache.get(self.arns[0]), [])
+        cache = self.new_cache()
+        self.assertEqual(cache.get(self.arns[0]), [])
+        cache.cloudwatch_logs_client.list_tags_for_resource.assert_not_called()
+
+    def test_shards_failing_to_download_are_not_overwritten(self, send_metrics):
+        self.cache.prefetch(self.arns[:1])
+        shards = dict(self.s3_client.objects)
+        self.s3_client.get_object.side_effect = ClientError(
+            {"Error": {"Code": "SlowDown"}}, "GetObject"
+        )
+        cache = self.new_cache()
+        with self.assertLogs(level="ERROR"):
+            cache.prefetch(self.arns)
+        # The tags are still fetched, but the shards are left untouched
+        self.assertEqual(cache.get(self.arns[1]), ["name:group-1"])
+        self.assertEqual(self.s3_client.objects, shards)
+        send_metrics.assert_any_call("loggroup_cache_fetch_failure")
+
+    def test_concurrent_shard_writes_are_merged(self, send_metrics):
+        arns = [f"arn:aws:logs:us-east-1:0:log-group:group-{i}" for i in range(200)]
+        arns = [arn for arn in arns if self.cache._get_shard_index(arn) == 0]
+        other = self.new_cache()
+        put_object = self.s3_client._put_object
+
+        def put_after_other_container(**kwargs):
+            # Another container writes the shard after this one read it
+            self.s3_client.put_object.side_effect = put_object
+            other.prefetch(arns[1:2])
+            return put_object(**kwargs)
+
+        self.s3_client.put_object.side_effect = put_after_other_container
+        self.cache.prefetch(arns[:1])
+        send_metrics.assert_any_call("loggroup_cache_write_conflict")
+
+        self.s3_client.put_object.side_effect = put_after_other_container
+        self.cache.prefetch(arns[2:3])
+        cache = self.new_cache()
+        cache.prefetch(arns[:3])
+        cache.cloudwatch_logs_client.list_tags_for_resource.assert_not_called()
+
+
+@patch("caching.s3_tags_cache.send_forwarder_internal_metrics")
+@patch("caching.base_tags_cache.send_forwarder_internal_metrics")
+class TestTagsCacheRevalidation(unittest.TestCase):
+    def setUp(self):
+        self.cache = S3TagsCache("")
+        self.cache.tags_by_id = {"arn": ["team:old"]}
+        self.refreshed = threading.Event()
+        self.cache._refresh = MagicMock(side_effect=self._refresh)
+
+    def _refresh(self):
+        self.cache.last_tags_fetch_time = time()
+        if self.refreshed.wait(5):
+            self.cache.tags_by_id = {"arn": ["team:new"]}
+            self.cache.last_successful_tags_fetch_time = time()
+
+    def test_serves_expired_tags_while_refreshing(self, *mocks):
+        expired_time = time() - self.cache.tags_ttl_seconds - 1
+        self.cache.last_successful_tags_fetch_time = expired_time
+        self.cache.last_tags_fetch_time = expired_time
+        self.assertEqual(self.cache.get("arn"), ["team:old"])
+        self.cache.last_tags_fetch_time = expired_time
+        self.assertEqual(self.cache.get("arn"), ["team:old"])
+        # Concurrent refreshes share the one in flight
+        self.cache._refresh.assert_called_once()
+        self.refreshed.set()
+        self.cache._refresh_thread.join()
+        self.assertEqual(self.cache.tags_by_id, {"arn": ["team:new"]})
+
+    def test_waits_for_refresh_past_max_staleness(self, *mocks):
+        stale_time = time() - self.cache.max_staleness_seconds - 1
+        self.cache.last_successful_tags_fetch_time = stale_time
+        # Failed refreshes since then don't make the tags any fresher
+        self.cache.last_tags_fetch_time = time() - self.cache.tags_ttl_seconds - 1
+        self.refreshed.set()
+        self.assertEqual(self.cache.get("arn"), ["team:new"])
+
+    def test_waits_for_refresh_until_the_deadline(self, *mocks):
+        self.cache.deadline = Deadline(0.1, margin_seconds=0)
+        self.assertEqual(self.cache.get("arn"), ["team:old"])
+        mocks[0].assert_any_call("local_cache_refresh_timeout")
+        self.refreshed.set()
+        self.cache._refresh_thread.join()
+        self.assertEqual(self.cache.get("arn"), ["team:new"])
+
+    def test_waits_for_first_refresh(self, *mocks):
+        self.refreshed.set()
+        self.assertEqual(self.cache.get("arn"), ["team:new"])
+
+    def test_refresh_errors_are_logged(self, *mocks):
+        self.cache._refresh.side_effect = Exception("GetResources failed")
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(self.cache.get("arn"), ["team:old"])
+
+
+class TestLogGroupMetadataCache(unittest.TestCase):
+    def test_get_and_set(self):
+        cache = LogGroupMetadataCache()
+        self.assertIsNone(cache.get("key"))
+        cache.set("key", {"ddsource": "lambda"})
+        self.assertEqual(cache.get("key"), {"ddsource": "lambda"})
+
+    @patch("caching.log_group_metadata_cache.time")
+    def test_entries_expire(self, mock_time):
+        cache = LogGroupMetadataCache(ttl_seconds=60)
+        mock_time.return_value = 1000
+        cache.set("key", "value")
+        mock_time.return_value = 1059
+        self.assertEqual(cache.get("key"), "value")
+        mock_time.return_value = 1060
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual(len(cache.entries), 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = LogGroupMetadataCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from deadline import Deadline
+from forwarder import Forwarder
+from logs.datadog_client import DatadogClient
+from logs.exceptions import RetriableException
+
+
+class Context:
+    def __init__(self, remaining_time_in_millis):
+        self.remaining_time_in_millis = remaining_time_in_millis
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_time_in_millis
+
+
+class TestDeadline(unittest.TestCase):
+    @patch("deadline.monotonic", return_value=100)
+    def test_remaining_keeps_margin(self, monotonic):
+        deadline = Deadline.from_context(Context(10000))
+        deadline.margin_seconds = 2
+        monotonic.return_value = 103
+        self.assertEqual(deadline.remaining(), 5)
+        self.assertEqual(deadline.remaining_before_timeout(), 7)
+        self.assertTrue(deadline.has_time_for(4))
+        self.assertFalse(deadline.has_time_for(5))
+
+    def test_no_deadline_without_context(self):
+        self.assertIsNone(Deadline.from_context(None))
+        self.assertIsNone(Deadline.from_context(object()))
+
+
+class TestDatadogClient(unittest.TestCase):
+    @patch("logs.datadog_client.time.sleep")
+    def test_retries_until_sent(self, sleep):
+        client = MagicMock()
+        client.send.side_effect = [RetriableException(), RetriableException(), None]
+        DatadogClient(client).send(b"[1]")
+        self.assertEqual(client.send.call_count, 3)
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [1, 2])
+
+    @patch("logs.datadog_client.time.sleep")
+    def test_stops_retrying_at_deadline(self, sleep):
+        client = MagicMock()
+        client.send.side_effect = RetriableException()
+        deadline = Deadline(1.5, margin_seconds=0)
+        with self.assertRaises(RetriableException):
+            DatadogClient(client, deadline=deadline).send(b"[1]")
+        # The second backoff would end past the deadline
+        self.assertEqual(client.send.call_count, 2)
+        sleep.assert_called_once_with(1)
+
+
+@patch("forwarder.send_event_metric")
+@patch("forwarder.DD_STORE_FAILED_EVENTS", True)
+@patch("forwarder.DD_USE_TCP", False)
+class TestSendLogs(unittest.TestCase):
+    def setUp(self):
+        self.forwarder = Forwarder.__new__(Forwarder)
+        self.forwarder.storage = MagicMock()
+        self.scrubber = MagicMock(scrub=lambda log: log)
+
+    @patch("forwarder.DatadogHTTPClient")
+    def test_spills_batches_when_short_of_time(self, client_class, send_event_metric):
+        client_class.return_value.failed_batches = []
+        logs = ['{"message":"log 1"}', '{"message":"log 2"}']
+        deadline = Deadline(0.5, margin_seconds=0)
+        with self.assertLogs(level="WARNING"):
+            failed_logs = self.forwarder._send_logs(
+                iter(logs), self.scrubber, deadline=deadline
+            )
+        self.assertEqual(failed_logs, logs)
+        client_class.return_value.send.assert_not_called()
+        send_event_metric.assert_called_once_with("logs_spilled", 2)
+
+    @patch("forwarder.DatadogHTTPClient")
+    def test_stores_remaining_logs_without_building_payloads(
+        self, client_class, send_event_metric
+    ):
+        client = client_class.return_value
+        client.failed_batches = []
+        # Short of time once the first batch of 400 logs is sent
+        deadline = MagicMock()
+        deadline.has_time_for.side_effect = lambda seconds: not client.send.called
+        self.scrubber = MagicMock(scrub=MagicMock(side_effect=lambda log: log))
+        logs = [f'{{"message":"log {i}"}}' for i in range(403)]
+        with self.assertLogs(level="WARNING"):
+            failed_logs = self.forwarder._send_logs(
+                iter(logs), self.scrubber, deadline=deadline
+            )
+        client.send.assert_called_once()
+        self.assertEqual(failed_logs, logs[400:])
+        # The logs read after the deadline are not scrubbed
+        self.assertEqual(self.scrubber.scrub.call_count, 401)
+        send_event_metric.assert_called_once_with("logs_spilled", 3)
+
+    @patch("forwarder.DatadogHTTPClient")
+    def test_sends_batches_with_time_left(self, client_class, send_event_metric):
+        client_class.return_value.failed_batches = []
+        logs = ['{"message":"log 1"}', '{"message":"log 2"}']
+        deadline = Deadline(30, margin_seconds=0)
+        failed_logs = self.forwarder._send_logs(
+            iter(logs), self.scrubber, deadline=deadline
+        )
+        self.assertEqual(failed_logs, [])
+        client_class.return_value.send.assert_called_once()
+        send_event_metric.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
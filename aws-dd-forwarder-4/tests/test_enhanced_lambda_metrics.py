@@ -12,7 +12,10 @@ from enhanced_lambda_metrics import (
     parse_lambda_tags_from_arn,
     generate_enhanced_lambda_metrics,
     create_out_of_memory_enhanced_metric,
+    EnhancedMetricsParser,
+    DatadogMetricPoint,
 )
+from metric_aggregator import LogMetricAggregator
 
 from caching.lambda_cache import LambdaTagsCache
 
@@ -94,20 +97,20 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
 
     def test_parse_metrics_from_report_log(self):
         parsed_metrics = parse_metrics_from_report_log(self.malformed_report)
-        verify_as_json(parsed_metrics)
+        verify_as_json([metric.to_dict() for metric in parsed_metrics])
 
     def test_parse_metrics_from_standard_report(self):
         parsed_metrics = parse_metrics_from_report_log(self.standard_report)
         # The timestamps are None because the timestamp is added after the metrics are parsed
-        verify_as_json(parsed_metrics)
+        verify_as_json([metric.to_dict() for metric in parsed_metrics])
 
     def test_parse_metrics_from_cold_start_report(self):
         parsed_metrics = parse_metrics_from_report_log(self.cold_start_report)
-        verify_as_json(parsed_metrics)
+        verify_as_json([metric.to_dict() for metric in parsed_metrics])
 
     def test_parse_metrics_from_report_with_xray(self):
         parsed_metrics = parse_metrics_from_report_log(self.report_with_xray)
-        verify_as_json(parsed_metrics)
+        verify_as_json([metric.to_dict() for metric in parsed_metrics])
 
     def test_parse_metrics_from_json_no_report(self):
         # Ensure we ignore unrelated JSON logs
@@ -117,15 +120,15 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
     def test_parse_metrics_from_json_report_log(self):
         parsed_metrics = parse_metrics_from_json_report_log(self.standard_json_report)
         # The timestamps are None because the timestamp is added after the metrics are parsed
-        verify_as_json(parsed_metrics)
+        verify_as_json([metric.to_dict() for metric in parsed_metrics])
 
     def test_parse_metrics_from_cold_start_json_report_log(self):
         parsed_metrics = parse_metrics_from_json_report_log(self.cold_start_json_report)
-        verify_as_json(parsed_metrics)
+        verify_as_json([metric.to_dict() for metric in parsed_metrics])
 
     def test_parse_metrics_from_timeout_json_report_log(self):
         parsed_metrics = parse_metrics_from_json_report_log(self.timeout_json_report)
-        verify_as_json(parsed_metrics)
+        verify_as_json([metric.to_dict() for metric in parsed_metrics])
 
     def test_create_out_of_memory_enhanced_metric(self):
         go_out_of_memory_error = "fatal error: runtime: out of memory"
@@ -197,7 +200,7 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
         }
 
         generated_metrics = generate_enhanced_lambda_metrics(logs_input, tags_cache)
-        verify_as_json(generated_metrics)
+        verify_as_json([metric.to_dict() for metric in generated_metrics])
 
     def test_generate_enhanced_lambda_metrics(self):
         tags_cache = LambdaTagsCache("")
@@ -221,7 +224,7 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
         }
 
         generated_metrics = generate_enhanced_lambda_metrics(logs_input, tags_cache)
-        verify_as_json(generated_metrics)
+        verify_as_json([metric.to_dict() for metric in generated_metrics])
 
     def test_generate_enhanced_lambda_metrics_with_tags(
         self,
@@ -249,7 +252,7 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
         }
 
         generated_metrics = generate_enhanced_lambda_metrics(logs_input, tags_cache)
-        verify_as_json(generated_metrics)
+        verify_as_json([metric.to_dict() for metric in generated_metrics])
 
     def test_generate_enhanced_lambda_metrics_once_with_missing_arn(self):
         tags_cache = LambdaTagsCache("")
@@ -403,7 +406,7 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
 
         os.environ["DD_FETCH_LAMBDA_TAGS"] = "True"
         generated_metrics = generate_enhanced_lambda_metrics(logs_input, tags_cache)
-        verify_as_json(generated_metrics)
+        verify_as_json([metric.to_dict() for metric in generated_metrics])
         del os.environ["DD_FETCH_LAMBDA_TAGS"]
 
     @patch("caching.lambda_cache.send_forwarder_internal_metrics")
@@ -442,9 +445,119 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
 
         os.environ["DD_FETCH_LAMBDA_TAGS"] = "True"
         generated_metrics = generate_enhanced_lambda_metrics(logs_input, tags_cache)
-        verify_as_json(generated_metrics)
+        verify_as_json([metric.to_dict() for metric in generated_metrics])
         del os.environ["DD_FETCH_LAMBDA_TAGS"]
 
 
+class TestDatadogMetricPoint(unittest.TestCase):
+    def test_points_share_tags(self):
+        tags = parse_lambda_tags_from_arn("arn:aws:lambda:us-east-1:0:function:f")
+        report = TestEnhancedLambdaMetrics.cold_start_report
+        first, second = (parse_metrics_from_report_log(report) for _ in range(2))
+        for metric in first + second:
+            metric.add_tags(tags)
+        self.assertEqual(first[0].tags, ("memorysize:128", "cold_start:true", *tags))
+        for metric in first[1:] + second:
+            self.assertIs(metric.tags, first[0].tags)
+        with self.assertRaises(AttributeError):
+            first[0].other = 1
+
+    def test_serializes_attributes(self):
+        metric = DatadogMetricPoint("name", 1.0, timestamp=10, tags=["a:b"])
+        self.assertEqual(
+            json.loads(json.dumps(metric.to_dict())),
+            {"name": "name", "value": 1.0, "timestamp": 10, "tags": ["a:b"]},
+        )
+
+
+class TestEnhancedMetricsParser(unittest.TestCase):
+    messages = [
+        "START RequestId: 8edab1f8-7d34-4a8e-a965-15ccbbb78d4c Version: $LATEST",
+        TestEnhancedLambdaMetrics.standard_report,
+        TestEnhancedLambdaMetrics.cold_start_report,
+        TestEnhancedLambdaMetrics.malformed_report,
+        TestEnhancedLambdaMetrics.standard_json_report,
+        TestEnhancedLambdaMetrics.timeout_json_report,
+        json.dumps({"level": "info", "msg": "Task created", "type": "app"}),
+        "2019-07-18T18:58:22.286Z b5264ab7 Task timed out after 30.03 seconds",
+        "Task\ttimed out after 3.00 seconds",
+        "[ERROR] MemoryError\nTraceback (most recent call last):",
+        "fatal error: runtime: out of memory",
+        "the cache ran out of memory",
+    ]
+
+    def logs(self):
+        return [
+            {
+                "message": message,
+                "lambda": {"arn": f"arn:aws:lambda:us-east-1:0:function:f{i % 2}"},
+                "timestamp": 1591714946151 + i,
+            }
+            for i, message in enumerate(self.messages * 2)
+        ]
+
+    def test_same_metrics_as_generate_enhanced_lambda_metrics(self):
+        tags_cache = MagicMock()
+        tags_cache.get.return_value = ["team:metrics"]
+        parser = EnhancedMetricsParser(tags_cache)
+
+        expected = LogMetricAggregator(parser.aggregator.roll_up_interval)
+        for log in self.logs():
+            for metric in generate_enhanced_lambda_metrics(log, tags_cache):
+                expected.add_point(
+                    metric.name, metric.value, metric.timestamp, metric.tags
+                )
+
+        tags_cache.get.reset_mock()
+        for log in self.logs():
+            parser.add(log)
+
+        self.assertEqual(list(parser.aggregator.series()), list(expected.series()))
+        self.assertEqual(tags_cache.get.call_count, 2)
+
+    @patch("enhanced_lambda_metrics.send_log_metric_series")
+    def test_submits_series(self, send_log_metric_series):
+        parser = EnhancedMetricsParser(MagicMock(get=MagicMock(return_value=[])))
+        for log in self.logs():
+            parser.add(log)
+        parser.submit()
+        submitted = {c.args[0] for c in send_log_metric_series.call_args_list}
+        self.assertEqual(
+            submitted,
+            {
+                "aws.lambda.enhanced.duration",
+                "aws.lambda.enhanced.billed_duration",
+                "aws.lambda.enhanced.max_memory_used",
+                "aws.lambda.enhanced.init_duration",
+                "aws.lambda.enhanced.estimated_cost",
+                "aws.lambda.enhanced.timeouts",
+                "aws.lambda.enhanced.out_of_memory",
+            },
+        )
+        self.assertEqual(len(parser.aggregator), 0)
+
+    @patch("telemetry.DD_SUBMIT_ENHANCED_METRICS", True)
+    def test_keeps_log_timestamps_with_writers_without_series(self):
+        # Writers other than ThreadStats submit each point as it is given
+        writer = MagicMock(spec=["distribution"])
+        tags_cache = MagicMock(get=MagicMock(return_value=["team:metrics"]))
+        expected = sorted(
+            (metric.name, metric.value, metric.timestamp, sorted(metric.tags))
+            for log in self.logs()
+            for metric in generate_enhanced_lambda_metrics(log, tags_cache)
+        )
+
+        with patch("telemetry.lambda_stats", writer, create=True):
+            parser = EnhancedMetricsParser(tags_cache)
+            for log in self.logs():
+                parser.add(log)
+            parser.submit()
+        submitted = sorted(
+            (c.args[0], c.args[1], c.kwargs["timestamp"], sorted(c.kwargs["tags"]))
+            for c in writer.distribution.call_args_list
+        )
+        self.assertEqual(submitted, expected)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,111 @@
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from deadline import Deadline
+from forwarder import Forwarder
+from retry.enums import RetryPrefix
+
+
+@patch("forwarder.DD_FORWARD_LOG", True)
+class TestForward(unittest.TestCase):
+    def setUp(self):
+        for target in ("forwarder.TraceConnection", "forwarder.Storage"):
+            patcher = patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.forwarder = Forwarder("function_prefix")
+        self.addCleanup(self.forwarder.executor.shutdown)
+
+    def test_forwards_sinks_concurrently(self):
+        def slow(*args, **kwargs):
+            time.sleep(0.2)
+
+        with patch.multiple(
+            self.forwarder,
+            _forward_logs=slow,
+            _forward_metrics=slow,
+            _forward_traces=slow,
+        ):
+            start = time.monotonic()
+            self.forwarder.forward([{}], [{}], [{}])
+            elapsed = time.monotonic() - start
+        self.assertLess(elapsed, 0.5)
+
+    def test_sink_failures_are_isolated(self):
+        with patch.multiple(
+            self.forwarder,
+            _forward_logs=MagicMock(side_effect=ZeroDivisionError),
+            _forward_metrics=MagicMock(),
+            _forward_traces=MagicMock(),
+        ):
+            with self.assertRaises(ZeroDivisionError):
+                self.forwarder.forward([{}], [{"m": 1}], [])
+            self.forwarder._forward_metrics.assert_called_once_with([{"m": 1}])
+
+    def test_errors_are_grouped(self):
+        def fail(*args, **kwargs):
+            raise ValueError()
+
+        with patch.multiple(
+            self.forwarder,
+            _forward_logs=fail,
+            _forward_metrics=fail,
+            _forward_traces=lambda *args, **kwargs: None,
+        ):
+            with self.assertRaises(ExceptionGroup) as context:
+                self.forwarder.forward([{}], [{}], [])
+        self.assertEqual(len(context.exception.exceptions), 2)
+
+    def test_retries_every_prefix(self):
+        with patch.object(self.forwarder, "_retry_prefix") as retry_prefix:
+            self.forwarder.retry()
+        self.assertCountEqual(
+            [c.args[0] for c in retry_prefix.call_args_list], list(RetryPrefix)
+        )
+
+    def test_retry_deletes_forwarded_keys(self):
+        self.forwarder.storage.get_checkpoint.return_value = None
+        self.forwarder.storage.iter_data.return_value = iter(
+            [("key 1", [{"m": 1}]), ("key 2", [{"m": 2}]), ("key 3", None)]
+        )
+        with patch.object(self.forwarder, "_forward_metrics") as forward_metrics:
+            forward_metrics.side_effect = [True, False]
+            self.forwarder._retry_prefix(RetryPrefix.METRICS)
+        self.assertEqual(forward_metrics.call_count, 2)
+        self.forwarder.storage.delete_keys.assert_called_once_with(["key 1"])
+
+    @patch("forwarder.DD_STORE_FAILED_EVENTS", True)
+    def test_stores_traces_when_short_of_time(self):
+        with self.assertLogs(level="WARNING"):
+            self.forwarder._forward_traces(
+                [{"trace": 1}], deadline=Deadline(0.5, margin_seconds=0)
+            )
+        self.forwarder.trace_connection.send_traces.assert_not_called()
+        self.forwarder.storage.store_data.assert_called_once_with(
+            RetryPrefix.TRACES, [{"trace": 1}]
+        )
+
+    @patch("forwarder.DD_STORE_FAILED_EVENTS", True)
+    @patch("forwarder.send_event_metric")
+    @patch("forwarder.send_log_metric_series")
+    @patch("forwarder.get_log_metric_roll_up_interval", MagicMock(return_value=10))
+    def test_forwards_metrics_by_series(self, send_series, send_event_metric):
+        send_series.side_effect = [None, Exception("error")]
+        metrics = [
+            {"m": "a", "v": 1, "e": 1700000001, "t": ["x:1"]},
+            {"m": "a", "v": 2, "e": 1700000002, "t": ["x:1"]},
+            {"m": "b", "v": 3, "e": 1700000001, "t": ["x:1"]},
+        ]
+        with self.assertLogs(level="ERROR"):
+            self.assertFalse(self.forwarder._forward_metrics(metrics))
+        self.assertEqual(send_series.call_count, 2)
+        self.assertEqual(list(send_series.call_args_list[0].args[1]), [1, 2])
+        self.forwarder.storage.store_data.assert_called_once_with(
+            RetryPrefix.METRICS, [{"m": "b", "v": 3, "e": 1700000000, "t": ["x:1"]}]
+        )
+        send_event_metric.assert_called_once_with("metrics_forwarded", 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,28 @@
+import gzip
+import threading
 import unittest
 import os
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
 
+from deadline import Deadline
 from logs.datadog_scrubber import DatadogScrubber
+from logs.datadog_async_http_client import DatadogAsyncHTTPClient
 from logs.datadog_batcher import DatadogBatcher
-from logs.helpers import filter_logs
+from logs.datadog_http_client import (
+    DatadogHTTPClient,
+    PersistentSession,
+    get_backoff,
+)
+from logs.exceptions import ScrubbingException
+from logs.helpers import filter_logs, filter_logs_stream
 from settings import ScrubbingRuleConfig, SCRUBBING_RULE_CONFIGS, get_env_var
+from tests.module_helpers import import_unmocked
+
+requests, requests_futures_sessions = import_unmocked(
+    "requests", "requests_futures.sessions"
+)
 
 
 class TestScrubLogs(unittest.TestCase):
@@ -36,6 +54,37 @@ class TestScrubLogs(unittest.TestCase):
         self.assertEqual(payload, "abcdefxxxxxefgxxxxxhij")
         os.environ.pop("DD_SCRUBBING_RULE", None)
 
+    def test_literal_skips_payloads_without_it(self):
+        os.environ["REDACT_EMAIL"] = ""
+        scrubber = DatadogScrubber(SCRUBBING_RULE_CONFIGS)
+        with patch.object(scrubber._rules[0], "regex") as regex:
+            self.assertEqual(scrubber.scrub("no email here"), "no email here")
+            regex.sub.assert_not_called()
+        self.assertEqual(
+            scrubber.scrub("email is abc.edf@example.com"), "email is xxxxx@xxxxx.com"
+        )
+        os.environ.pop("REDACT_EMAIL", None)
+
+    def test_non_string_payload(self):
+        os.environ["REDACT_IP"] = ""
+        scrubber = DatadogScrubber(SCRUBBING_RULE_CONFIGS)
+        with self.assertRaises(ScrubbingException):
+            scrubber.scrub({"ip_address": "127.0.0.1"})
+        os.environ.pop("REDACT_IP", None)
+
+    def test_scrubs_serialized(self):
+        os.environ["REDACT_IP"] = ""
+        scrubber = DatadogScrubber(SCRUBBING_RULE_CONFIGS)
+        self.assertTrue(scrubber.scrubs_serialized("ip_address is 127.0.0.1"))
+        self.assertFalse(scrubber.scrubs_serialized('ip_address is "127.0.0.1"'))
+        self.assertFalse(scrubber.scrubs_serialized("ip_address is\n127.0.0.1"))
+        self.assertFalse(scrubber.scrubs_serialized("ip_address is\x010.0.0.1"))
+        os.environ["REDACT_EMAIL"] = ""
+        scrubber = DatadogScrubber(SCRUBBING_RULE_CONFIGS)
+        self.assertFalse(scrubber.scrubs_serialized("ip_address is 127.0.0.1"))
+        os.environ.pop("REDACT_IP", None)
+        os.environ.pop("REDACT_EMAIL", None)
+
 
 class TestDatadogBatcher(unittest.TestCase):
     def test_batch(self):
@@ -53,6 +102,341 @@ class TestDatadogBatcher(unittest.TestCase):
         batches = list(batcher.batch(logs))
         self.assertEqual(len(batches), 2)
 
+    def test_batch_stream_yields_full_batches(self):
+        consumed = []
+
+        def logs():
+            for log in ["a" * 100, "b" * 100, "c" * 100]:
+                consumed.append(log)
+                yield log
+
+        batches = DatadogBatcher(256, 512, 2).batch_stream(logs())
+        self.assertEqual(next(batches), ["a" * 100, "b" * 100])
+        self.assertEqual(len(consumed), 3)
+        self.assertEqual(list(batches), [["c" * 100]])
+
+    def test_batch_stream_counts_dropped_items(self):
+        batcher = DatadogBatcher(100, 512, 2)
+        batches = batcher.batch(["a" * 100, "b" * 101, "c" * 100])
+        self.assertEqual(batches, [["a" * 100, "c" * 100]])
+        self.assertEqual(batcher.dropped_items_count, 1)
+
+    def test_batch_payloads(self):
+        batcher = DatadogBatcher(256, 512, 2)
+        batches = list(batcher.batch_payloads(['{"a":1}', '{"b":2}', '{"c":3}']))
+        self.assertEqual(
+            batches,
+            [
+                (['{"a":1}', '{"b":2}'], b'[{"a":1},{"b":2}]'),
+                (['{"c":3}'], b'[{"c":3}]'),
+            ],
+        )
+
+    def test_batch_payloads_size_includes_framing(self):
+        logs = ["a" * 5] * 3
+        # 2 logs of 5 bytes take 13 bytes with the framing
+        batches = DatadogBatcher(5, 13, 10).batch_payloads(logs)
+        self.assertEqual([batch for batch, _ in batches], [logs[:2], logs[2:]])
+        batches = DatadogBatcher(5, 12, 10).batch_payloads(logs)
+        self.assertEqual([batch for batch, _ in batches], [logs[:1]] * 3)
+        for _, payload in DatadogBatcher(5, 19, 10).batch_payloads(logs * 3):
+            self.assertLessEqual(len(payload), 19)
+
+    def test_batch_payloads_measures_encoded_logs(self):
+        batcher = DatadogBatcher(6, 100, 10)
+        batches = list(batcher.batch_payloads(["日本", "日本語", "abc"]))
+        self.assertEqual(batches, [(["日本", "abc"], "[日本,abc]".encode("UTF-8"))])
+        self.assertEqual(batcher.dropped_items_count, 1)
+
+    def test_batch_payloads_compressed(self):
+        logs = [f'{{"message":"log {i}"}}' for i in range(50)] + ["x" * 300]
+        plain = DatadogBatcher(256, 512, 20)
+        compressed = DatadogBatcher(256, 512, 20)
+        plain_batches = list(plain.batch_payloads(logs))
+        compressed_batches = list(compressed.batch_payloads(logs, 6))
+        self.assertEqual(len(compressed_batches), len(plain_batches))
+        for (batch, payload), (compressed_batch, compressed_payload) in zip(
+            plain_batches, compressed_batches
+        ):
+            self.assertEqual(compressed_batch, batch)
+            self.assertEqual(gzip.decompress(compressed_payload), payload)
+        self.assertEqual(compressed.dropped_items_count, 1)
+        self.assertEqual(
+            compressed.payloads_size_bytes,
+            sum(len(payload) for _, payload in plain_batches),
+        )
+        self.assertEqual(
+            compressed.compressed_payloads_size_bytes,
+            sum(len(payload) for _, payload in compressed_batches),
+        )
+        self.assertEqual(plain.payloads_size_bytes, plain.compressed_payloads_size_bytes)
+
+    def test_batch_payloads_compression_level_is_clamped(self):
+        batcher = DatadogBatcher(256, 512, 20)
+        for level in (-1, 10):
+            batches = list(batcher.batch_payloads(["abc"], level))
+            self.assertEqual(gzip.decompress(batches[0][1]), b"[abc]")
+
+
+@patch("logs.datadog_http_client.send_event_metric")
+@patch("logs.datadog_http_client.monotonic")
+@patch("logs.datadog_http_client.FuturesSession")
+class TestPersistentSession(unittest.TestCase):
+    def test_reuses_session(self, futures_session, monotonic, send_event_metric):
+        monotonic.return_value = 100
+        session = PersistentSession(max_workers=4, idle_timeout_seconds=30)
+        first = session.acquire()
+        session.release()
+        monotonic.return_value = 110
+        self.assertIs(session.acquire(), first)
+        futures_session.assert_called_once_with(max_workers=4)
+        first.close.assert_not_called()
+        send_event_metric.assert_called_once_with("logs_http_pool_reuse", 1)
+
+    def test_evicts_idle_connections(
+        self, futures_session, monotonic, send_event_metric
+    ):
+        adapter = MagicMock()
+        futures_session.return_value.adapters = {"https://": adapter}
+        monotonic.return_value = 100
+        session = PersistentSession(max_workers=4, idle_timeout_seconds=30)
+        first = session.acquire()
+        session.release()
+        monotonic.return_value = 131
+        self.assertIs(session.acquire(), first)
+        adapter.close.assert_called_once_with()
+        send_event_metric.assert_called_once_with("logs_http_reconnects", 1)
+
+    def test_reconnects_after_connection_error(
+        self, futures_session, monotonic, send_event_metric
+    ):
+        futures_session.side_effect = [MagicMock(), MagicMock()]
+        monotonic.return_value = 100
+        session = PersistentSession(max_workers=4, idle_timeout_seconds=30)
+        first = session.acquire()
+        session.release(healthy=False)
+        second = session.acquire()
+        self.assertIsNot(second, first)
+        first.close.assert_called_once_with()
+        send_event_metric.assert_called_once_with("logs_http_reconnects", 1)
+        session.release()
+        self.assertIs(session.acquire(), second)
+
+
+class Batch(list):
+    """A batch of logs that can be referenced weakly"""
+
+
+class LocalIntakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status = server.statuses.pop(0) if server.statuses else 202
+        server.release.wait(5)
+        with server.lock:
+            server.in_flight -= 1
+            if status < 300:
+                server.payloads.append(body)
+            server.api_keys.add(self.headers["DD-API-KEY"])
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalIntakeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), LocalIntakeHandler)
+        self.server.lock = threading.Lock()
+        self.server.release = threading.Event()
+        self.server.release.set()
+        self.server.statuses = []
+        self.server.payloads = []
+        self.server.api_keys = set()
+        self.server.in_flight = 0
+        self.server.max_in_flight = 0
+        threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        ).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self, **kwargs):
+        return self.client_class(
+            "127.0.0.1", self.server.server_port, True, False, "api_key", **kwargs
+        )
+
+
+@patch("logs.datadog_http_client.get_backoff", return_value=0)
+class TestDatadogHTTPClient(LocalIntakeTestCase):
+    client_class = DatadogHTTPClient
+
+    def setUp(self):
+        super().setUp()
+        # The client module may have been imported by another test module
+        # while requests was mocked, bind it to the real packages
+        for name, value in {
+            "requests": requests,
+            "FuturesSession": requests_futures_sessions.FuturesSession,
+            "persistent_session": PersistentSession(),
+        }.items():
+            patcher = patch(f"logs.datadog_http_client.{name}", value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_send(self, get_backoff):
+        with self.client() as client:
+            client.send(b"[1]", ["1"])
+            client.send(b"[2]", ["2"])
+        self.assertCountEqual(self.server.payloads, [b"[1]", b"[2]"])
+        self.assertEqual(client.failed_batches, [])
+
+    def test_bounds_pending_batches(self, get_backoff):
+        self.server.release.clear()
+        with self.client(max_pending=2) as client:
+            client.send(b"[1]")
+            client.send(b"[2]")
+            # Blocks until one of the pending batches is resolved
+            sender = threading.Thread(target=client.send, args=(b"[3]",))
+            sender.start()
+            sender.join(0.2)
+            self.assertTrue(sender.is_alive())
+            self.server.release.set()
+            sender.join()
+        self.assertEqual(len(self.server.payloads), 3)
+
+    def test_forgets_sent_batches(self, get_backoff):
+        batch = Batch(["1"])
+        sent_batch = weakref.ref(batch)
+        with self.client(max_pending=1) as client:
+            client.send(b"[1]", batch)
+            del batch
+            # Only returns once the first batch is resolved
+            client.send(b"[2]", ["2"])
+            self.assertIsNone(sent_batch())
+        self.assertEqual(client.failed_batches, [])
+
+    def test_retries_server_errors(self, get_backoff):
+        self.server.statuses = [503, 429]
+        with self.client() as client:
+            client.send(b"[1]", ["1"])
+        self.assertEqual(self.server.payloads, [b"[1]"])
+        self.assertEqual([c.args[0] for c in get_backoff.call_args_list], [0, 1])
+        self.assertEqual(client.failed_batches, [])
+
+    def test_returns_batches_failing_after_max_retries(self, get_backoff):
+        self.server.statuses = [500, 500, 500]
+        with self.assertLogs(level="ERROR"):
+            with self.client(max_retries=2) as client:
+                client.send(b"[1]", ["1"])
+        self.assertEqual(self.server.statuses, [])
+        self.assertEqual(client.failed_batches, [["1"]])
+
+    def test_returns_batches_failing_after_deadline(self, get_backoff):
+        get_backoff.return_value = 60
+        self.server.statuses = [500]
+        with self.assertLogs(level="ERROR"):
+            with self.client(deadline=Deadline(30, margin_seconds=0)) as client:
+                client.send(b"[1]", ["1"])
+        self.assertEqual(self.server.statuses, [])
+        self.assertEqual(client.failed_batches, [["1"]])
+
+    def test_does_not_send_past_deadline(self, get_backoff):
+        with self.assertLogs(level="ERROR"):
+            with self.client(deadline=Deadline(-1, margin_seconds=0)) as client:
+                client.send(b"[1]", ["1"])
+        self.assertEqual(self.server.payloads, [])
+        self.assertEqual(client.failed_batches, [["1"]])
+
+    def test_client_errors_are_not_retried(self, get_backoff):
+        self.server.statuses = [400]
+        with self.assertLogs(level="ERROR"):
+            with self.client() as client:
+                client.send(b"[1]", ["1"])
+        self.assertEqual(self.server.statuses, [])
+        self.assertEqual(client.failed_batches, [])
+
+
+@patch("logs.datadog_async_http_client.get_backoff", return_value=0)
+class TestDatadogAsyncHTTPClient(LocalIntakeTestCase):
+    client_class = DatadogAsyncHTTPClient
+
+    def test_send(self, get_backoff):
+        payloads = [f'[{{"message":"log {i}"}}]'.encode() for i in range(20)]
+        with self.client(max_in_flight=4) as client:
+            for payload in payloads:
+                client.send(payload)
+        self.assertCountEqual(self.server.payloads, payloads)
+        self.assertEqual(self.server.api_keys, {"api_key"})
+        self.assertEqual(client.failed_batches, [])
+
+    def test_bounds_requests_in_flight(self, get_backoff):
+        self.server.release.clear()
+        with self.client(max_in_flight=2, queue_size=1) as client:
+            # 2 batches in flight, 1 waiting for a slot and 1 in the queue
+            for payload in (b"[1]", b"[2]", b"[3]", b"[4]"):
+                client.send(payload)
+            # The queue is full until one of the requests completes
+            sender = threading.Thread(target=client.send, args=(b"[5]",))
+            sender.start()
+            sender.join(0.2)
+            self.assertTrue(sender.is_alive())
+            self.server.release.set()
+            sender.join()
+        self.assertEqual(self.server.max_in_flight, 2)
+        self.assertEqual(len(self.server.payloads), 5)
+
+    def test_retries_server_errors(self, get_backoff):
+        self.server.statuses = [503, 429]
+        with self.client(max_in_flight=1) as client:
+            client.send(b"[1]", ["1"])
+        self.assertEqual(self.server.payloads, [b"[1]"])
+        self.assertEqual([c.args[0] for c in get_backoff.call_args_list], [0, 1])
+        self.assertEqual(client.failed_batches, [])
+
+    def test_returns_batches_failing_after_max_retries(self, get_backoff):
+        self.server.statuses = [500, 500, 500]
+        with self.assertLogs(level="ERROR"):
+            with self.client(max_in_flight=1, max_retries=2) as client:
+                client.send(b"[1]", ["1"])
+        self.assertEqual(self.server.statuses, [])
+        self.assertEqual(client.failed_batches, [["1"]])
+
+    def test_returns_batches_failing_after_deadline(self, get_backoff):
+        get_backoff.return_value = 60
+        self.server.statuses = [500]
+        with self.assertLogs(level="ERROR"):
+            with self.client(deadline=Deadline(30, margin_seconds=0)) as client:
+                client.send(b"[1]", ["1"])
+        self.assertEqual(client.failed_batches, [["1"]])
+
+    def test_client_errors_are_not_retried(self, get_backoff):
+        self.server.statuses = [400]
+        with self.assertLogs(level="ERROR"):
+            with self.client() as client:
+                client.send(b"[1]")
+        self.assertEqual(self.server.statuses, [])
+        self.assertEqual(self.server.payloads, [])
+        self.assertEqual(client.failed_batches, [])
+
+
+class TestBackoff(unittest.TestCase):
+    def test_get_backoff(self):
+        for attempt in range(10):
+            backoff = get_backoff(attempt, max_backoff=30)
+            self.assertGreaterEqual(backoff, 0)
+            self.assertLessEqual(backoff, min(30, 2**attempt))
+
 
 class TestFilterLogs(unittest.TestCase):
     example_logs = [
@@ -100,6 +484,14 @@ class TestFilterLogs(unittest.TestCase):
         filtered_logs = filter_logs(self.example_logs)
         self.assertEqual(filtered_logs, self.example_logs)
 
+    def test_filter_logs_stream(self):
+        filtered_logs = filter_logs_stream(
+            iter(self.example_logs), include_pattern=r"^(START|END)"
+        )
+
+        self.assertEqual(next(filtered_logs), "START RequestId: ...")
+        self.assertEqual(list(filtered_logs), ["END RequestId: ..."])
+
 
 if __name__ == "__main__":
     unittest.main()
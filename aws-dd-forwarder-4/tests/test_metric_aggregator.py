@@ -0,0 +1,150 @@
+import threading
+import unittest
+from array import array
+from unittest.mock import MagicMock, patch
+
+from metric_aggregator import LogMetricAggregator
+from telemetry import send_log_metric_series
+from tests.module_helpers import import_unmocked
+
+threadstats, threadstats_metrics = import_unmocked(
+    "datadog.threadstats", "datadog.threadstats.metrics"
+)
+ThreadStats = threadstats.ThreadStats
+Distribution = threadstats_metrics.Distribution
+Gauge = threadstats_metrics.Gauge
+MetricsAggregator = threadstats_metrics.MetricsAggregator
+
+
+class TestLogMetricAggregator(unittest.TestCase):
+    def test_groups_points_in_series(self):
+        aggregator = LogMetricAggregator(roll_up_interval=10)
+        aggregator.add({"m": "a", "v": 1, "e": 1700000001, "t": ["x:1", "y:2"]})
+        aggregator.add({"m": "a", "v": 2, "e": 1700000009, "t": ["y:2", "x:1"]})
+        aggregator.add({"m": "a", "v": 3, "e": 1700000010, "t": ["x:1", "y:2"]})
+        aggregator.add({"m": "b", "v": 4.5, "e": 1700000001, "t": []})
+        self.assertEqual(len(aggregator), 3)
+        self.assertEqual(
+            list(aggregator.series()),
+            [
+                ("a", ["x:1", "y:2"], 1700000000, array("d", [1, 2])),
+                ("a", ["x:1", "y:2"], 1700000010, array("d", [3])),
+                ("b", [], 1700000000, array("d", [4.5])),
+            ],
+        )
+
+    def test_interns_tags(self):
+        aggregator = LogMetricAggregator()
+        aggregator.add({"m": "a", "v": 1, "e": 0, "t": ["x:" + "1"]})
+        aggregator.add({"m": "b", "v": 1, "e": 0, "t": ["".join(["x:", "1"])]})
+        (_, tags_a, _), (_, tags_b, _) = aggregator._series
+        self.assertIs(tags_a[0], tags_b[0])
+
+
+@patch("telemetry.DD_SUBMIT_ENHANCED_METRICS", True)
+class TestSendLogMetricSeries(unittest.TestCase):
+    def test_sends_series_at_once(self):
+        lambda_stats = MagicMock()
+        with patch("telemetry.lambda_stats", lambda_stats, create=True):
+            send_log_metric_series("a", array("d", [1, 2]), 10, ["x:1"])
+        lambda_stats.thread_stats.distributions.assert_called_once_with(
+            "a", array("d", [1, 2]), timestamp=10, tags=["x:1"]
+        )
+        lambda_stats.distribution.assert_not_called()
+
+    def test_sends_values_one_by_one_without_series_api(self):
+        lambda_stats = MagicMock()
+        lambda_stats.thread_stats = MagicMock(spec=["distribution"])
+        with patch("telemetry.lambda_stats", lambda_stats, create=True):
+            send_log_metric_series("a", array("d", [1, 2]), 10, ["x:1"])
+        self.assertEqual(
+            [c.args[1] for c in lambda_stats.distribution.call_args_list], [1, 2]
+        )
+
+
+class TestThreadStatsDistributions(unittest.TestCase):
+    def test_series_roll_up_like_single_points(self):
+        points = [(1700000001, 1.0), (1700000003, 2.0), (1700000012, 3.0)]
+        stats = ThreadStats()
+        stats.start(flush_in_thread=False)
+        for timestamp, value in points:
+            stats.distribution("a", value, timestamp=timestamp, tags=["x:1"])
+
+        aggregator = LogMetricAggregator()
+        for timestamp, value in points:
+            aggregator.add({"m": "a", "v": value, "e": timestamp, "t": ["x:1"]})
+        bulk_stats = ThreadStats()
+        bulk_stats.start(flush_in_thread=False)
+        for name, tags, timestamp, values in aggregator.series():
+            bulk_stats.distributions(name, values, timestamp=timestamp, tags=tags)
+
+        expected = stats._get_aggregate_metrics_and_dists(float("inf"))[1]
+        dists = bulk_stats._get_aggregate_metrics_and_dists(float("inf"))[1]
+        self.assertEqual(
+            [(d["points"][0][0], list(d["points"][0][1])) for d in dists],
+            [(d["points"][0][0], d["points"][0][1]) for d in expected],
+        )
+
+    def test_compact_values_roll_up_like_lists(self):
+        results = []
+        for compact_values in (False, True):
+            stats = ThreadStats(compact_values=compact_values)
+            stats.start(flush_in_thread=False)
+            for i in range(2000):
+                stats.distribution("d", i % 7, timestamp=1700000000, tags=["x:1"])
+                stats.histogram("h", i % 7, timestamp=1700000000)
+            stats.distributions("d", array("d", [1, 2]), timestamp=1700000000)
+            metrics, dists = stats._get_aggregate_metrics_and_dists(float("inf"))
+            results.append(
+                (
+                    sorted((m["metric"], m["points"]) for m in metrics),
+                    sorted((d["tags"] or [], list(d["points"][0][1])) for d in dists),
+                )
+            )
+        self.assertEqual(results[0][1], results[1][1])
+        # Percentiles come from random samples, the others don't
+        for name in ("h.min", "h.max", "h.avg", "h.count"):
+            self.assertIn(next(m for m in results[0][0] if m[0] == name), results[1][0])
+
+
+class TestMetricsAggregator(unittest.TestCase):
+    def test_concurrent_points_are_all_added(self):
+        aggregator = MetricsAggregator()
+        tags = [["b:1", "a:1"], ["a:2"]]
+
+        def add_points():
+            for i in range(1000):
+                metric = f"m{i % 3}"
+                aggregator.add_point(metric, tags[i % 2], 1700000000, 1, Distribution)
+
+        threads = [threading.Thread(target=add_points) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        flushed = aggregator.flush(float("inf"))
+        self.assertEqual(len(flushed), 6)
+        self.assertEqual(sum(len(m[1]) for m in flushed), 4000)
+
+    def test_flush_order_does_not_depend_on_shards(self):
+        def flush(shard_count):
+            aggregator = MetricsAggregator(shard_count=shard_count)
+            for i in range(50):
+                aggregator.add_point(f"m{i % 7}", [f"t:{i % 5}"], i, i, Gauge)
+            return aggregator.flush(float("inf"))
+
+        self.assertEqual(flush(1), flush(16))
+
+    def test_tags_key_follows_list_changes(self):
+        aggregator = MetricsAggregator()
+        tags = ["b:1", "a:1"]
+        aggregator.add_point("m", tags, 0, 1, Gauge)
+        tags[0] = "c:1"
+        aggregator.add_point("m", tags, 0, 2, Gauge)
+        # Two series, the second one not mistaken for the first
+        self.assertEqual(sorted(m[1] for m in aggregator.flush(float("inf"))), [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from steps.parsed_event import (
+    ParsedEvent,
+    detach_json_message,
+    get_json_message,
+    set_json_message,
+)
+from steps.enrichment import extract_ddtags_from_message
+from steps.splitting import extract_metric, split
+
+
+class TestParsedEvent(unittest.TestCase):
+    def test_behaves_like_a_dict(self):
+        event = ParsedEvent({"message": "hello", "ddtags": "env:dev"})
+        self.assertEqual(event, {"message": "hello", "ddtags": "env:dev"})
+        self.assertEqual(
+            json.loads(json.dumps(event)), {"message": "hello", "ddtags": "env:dev"}
+        )
+
+    def test_decodes_message_once(self):
+        event = ParsedEvent(message='{"key": "value"}')
+        with patch("steps.parsed_event.json.loads", wraps=json.loads) as loads:
+            self.assertEqual(get_json_message(event), {"key": "value"})
+            self.assertEqual(get_json_message(event), {"key": "value"})
+            self.assertEqual(loads.call_count, 1)
+
+    def test_caches_invalid_json(self):
+        event = ParsedEvent(message="plain text log")
+        with patch("steps.parsed_event.json.loads", wraps=json.loads) as loads:
+            self.assertIsNone(get_json_message(event))
+            self.assertIsNone(get_json_message(event))
+            self.assertEqual(loads.call_count, 1)
+
+    def test_replacing_message_invalidates_cache(self):
+        event = ParsedEvent(message='{"key": "value"}')
+        self.assertEqual(get_json_message(event), {"key": "value"})
+        event["message"] = '{"key": "other"}'
+        self.assertEqual(get_json_message(event), {"key": "other"})
+
+    def test_non_string_message(self):
+        self.assertIsNone(get_json_message(ParsedEvent(message={"key": "value"})))
+        self.assertIsNone(get_json_message(ParsedEvent()))
+
+    def test_set_json_message(self):
+        event = ParsedEvent(message='{"key": "value"}')
+        set_json_message(event, {"key": "other"})
+        self.assertEqual(event["message"], '{"key": "other"}')
+        with patch("steps.parsed_event.json.loads") as loads:
+            self.assertEqual(get_json_message(event), {"key": "other"})
+            loads.assert_not_called()
+
+    def test_detach_json_message(self):
+        event = ParsedEvent(message='{"key": "value"}')
+        detached = detach_json_message(event)
+        detached["key"] = "other"
+        self.assertEqual(event["message"], '{"key": "value"}')
+        self.assertEqual(get_json_message(event), {"key": "value"})
+
+    def test_plain_dict(self):
+        event = {"message": '{"key": "value"}'}
+        self.assertEqual(get_json_message(event), {"key": "value"})
+        set_json_message(event, {"key": "other"})
+        self.assertEqual(event, {"message": '{"key": "other"}'})
+
+
+class TestParsedEventThroughSteps(unittest.TestCase):
+    def test_message_is_decoded_once_across_steps(self):
+        event = ParsedEvent(
+            message='{"ddtags": "service:app", "m": "metric", "v": 1, "e": 1, "t": []}',
+            ddtags="env:dev",
+        )
+        with patch("steps.parsed_event.json.loads", wraps=json.loads) as loads:
+            extract_ddtags_from_message(event)
+            metrics, logs, traces = split([event])
+            self.assertEqual(loads.call_count, 1)
+
+        self.assertEqual(event["ddtags"], "env:dev,service:app")
+        self.assertEqual(metrics[0]["t"], ["env:dev", "service:app"])
+        self.assertEqual(logs, [])
+        self.assertEqual(traces, [])
+
+    def test_extract_metric_does_not_mutate_message(self):
+        event = ParsedEvent(
+            message='{"m": "metric", "v": 1, "e": 1, "t": ["tag:a"]}', ddtags="env:dev"
+        )
+        metric = extract_metric(event)
+        self.assertEqual(metric["t"], ["tag:a", "env:dev"])
+        self.assertEqual(get_json_message(event)["t"], ["tag:a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,26 @@
+import base64
+import copy
+import gzip
+import json
 import unittest
+from unittest.mock import MagicMock, patch
+
+from caching.log_group_metadata_cache import LogGroupMetadataCache
 
 from steps.common import (
+    find_cloudwatch_source,
+    find_s3_source,
+    merge_dicts,
+    merge_metadata,
     parse_event_source,
     get_service_from_tags_and_remove_duplicates,
 )
-from steps.enums import AwsEventSource
+from steps.enums import (
+    AwsCwEventSourcePrefix,
+    AwsEventSource,
+    AwsS3EventSourceKeyword,
+)
+from steps.parsing import parse, parse_stream
 from settings import (
     DD_CUSTOM_TAGS,
     DD_SOURCE,
@@ -307,6 +323,96 @@ class TestParseEventSource(unittest.TestCase):
         )
 
 
+class TestSourceClassificationPrecedence(unittest.TestCase):
+    def test_cloudwatch_prefixes_in_enum_order(self):
+        for prefix in AwsCwEventSourcePrefix:
+            log_group = str(prefix) + "/vpc/name"
+            expected = next(
+                str(p.event_source)
+                for p in AwsCwEventSourcePrefix
+                if log_group.startswith(str(p))
+            )
+            self.assertEqual(find_cloudwatch_source(log_group), expected)
+
+    def test_cloudwatch_keywords_in_enum_order(self):
+        # both route53 and vpc are found, route53 comes first
+        self.assertEqual(find_cloudwatch_source("my-vpc-route53-logs"), "route53")
+        self.assertEqual(find_cloudwatch_source("my-vpc-logs"), "vpc")
+        self.assertEqual(find_cloudwatch_source("my-logs"), "cloudwatch")
+
+    def test_s3_keywords_in_enum_order(self):
+        keywords = list(AwsS3EventSourceKeyword)
+        for i, keyword in enumerate(keywords):
+            for other in keywords[i:]:
+                for key in (
+                    f"{other}/{keyword}/file.gz",
+                    f"{keyword}/{other}/file.gz",
+                    f"{other}/prefix/{keyword}.gz",
+                    f"{keyword}/prefix/{other}.gz",
+                    f"{other}_{keyword}.gz",
+                ):
+                    self.assertEqual(
+                        find_s3_source(key), str(keyword.event_source), key
+                    )
+
+    def test_s3_directory_is_reused(self):
+        self.assertEqual(find_s3_source("logs/vpcflowlogs/a.gz"), "vpc")
+        self.assertEqual(find_s3_source("logs/vpcflowlogs/waflogs.gz"), "waf")
+        self.assertEqual(find_s3_source("logs/waflogs/vpcflowlogs.gz"), "waf")
+        self.assertEqual(find_s3_source("logs/other/b.gz"), "s3")
+
+
+class TestMergeMetadata(unittest.TestCase):
+    metadata = {
+        "ddsourcecategory": "aws",
+        "aws": {"function_version": 0, "invoked_function_arn": "arn"},
+        "ddtags": "env:dev",
+        "ddsource": "s3",
+        "service": "s3",
+    }
+
+    def assert_same_merge(self, event, metadata):
+        expected = merge_dicts(copy.deepcopy(event), metadata)
+        merged = merge_metadata(copy.deepcopy(event), metadata)
+        self.assertEqual(merged, expected)
+        self.assertEqual(list(merged), list(expected))
+        self.assertEqual(list(merged["aws"]), list(expected["aws"]))
+
+    def test_same_as_merge_dicts(self):
+        self.assert_same_merge({"message": "hello"}, self.metadata)
+        self.assert_same_merge(
+            {"aws": {"s3": {"bucket": "b", "key": "k"}}, "message": "m"},
+            self.metadata,
+        )
+        self.assert_same_merge(
+            {"aws": {"function_version": 0}, "service": "s3"}, self.metadata
+        )
+        self.assert_same_merge(
+            {"aws": {"s3": {"bucket": "b"}}},
+            {"aws": {"s3": {"key": "k"}}, "ddsource": "s3"},
+        )
+
+    def test_conflicts(self):
+        for event, path in [
+            ({"ddsource": "other"}, "ddsource"),
+            ({"aws": "string"}, "aws"),
+            ({"aws": {"function_version": 1}}, "aws.function_version"),
+        ]:
+            with self.assertRaises(Exception) as context:
+                merge_metadata(event, self.metadata)
+            self.assertEqual(
+                str(context.exception),
+                "Conflict while merging metadatas and the log entry at " + path,
+            )
+
+        with self.assertRaises(Exception) as context:
+            merge_metadata({"aws": {"s3": {"key": "a"}}}, {"aws": {"s3": {"key": "b"}}})
+        self.assertEqual(
+            str(context.exception),
+            "Conflict while merging metadatas and the log entry at aws.s3.key",
+        )
+
+
 class TestGetServiceFromTags(unittest.TestCase):
     def test_get_service_from_tags(self):
         metadata = {
@@ -333,5 +439,79 @@ class TestGetServiceFromTags(unittest.TestCase):
         )
 
 
+class Context:
+    function_version = 0
+    invoked_function_arn = "arn:aws:lambda:sa-east-1:601427279990:function:forwarder"
+    function_name = "forwarder"
+    memory_limit_in_mb = "10"
+
+
+class TestParseStream(unittest.TestCase):
+    sns_event = {
+        "Records": [
+            {"Sns": {"Message": "first"}},
+            {"Sns": {"Message": "second"}},
+        ]
+    }
+
+    @patch("steps.parsing.send_event_metric")
+    def test_parse_stream_matches_parse(self, mock_send_event_metric):
+        self.assertEqual(
+            list(parse_stream(self.sns_event, Context(), None)),
+            parse(self.sns_event, Context(), None),
+        )
+
+    @patch("steps.parsing.send_event_metric")
+    def test_parse_stream_is_lazy(self, mock_send_event_metric):
+        events = parse_stream(self.sns_event, Context(), None)
+        first = next(events)
+        self.assertEqual(first["Sns"], {"Message": "first"})
+        self.assertEqual(first[DD_SOURCE], "sns")
+        mock_send_event_metric.assert_not_called()
+
+        self.assertEqual(len(list(events)), 1)
+        mock_send_event_metric.assert_called_once_with("incoming_events", 2)
+
+    @patch("steps.parsing.send_event_metric")
+    def test_parse_stream_unsupported_event(self, mock_send_event_metric):
+        events = list(parse_stream({"unsupported": True}, Context(), None))
+        self.assertEqual(len(events), 1)
+        self.assertTrue(events[0]["message"].startswith("Error parsing the object"))
+        mock_send_event_metric.assert_called_once_with("incoming_events", 1)
+
+
+class TestParseKinesis(unittest.TestCase):
+    @staticmethod
+    def record(log_group):
+        data = {
+            "logGroup": log_group,
+            "logStream": "stream",
+            "owner": "601427279990",
+            "logEvents": [{"id": "1", "timestamp": 0, "message": "hello"}],
+        }
+        payload = base64.b64encode(gzip.compress(json.dumps(data).encode()))
+        return {"kinesis": {"data": payload.decode()}}
+
+    @patch("steps.parsing.send_event_metric")
+    def test_prefetches_log_group_tags(self, mock_send_event_metric):
+        cache_layer = MagicMock()
+        cache_layer.get_log_group_metadata_cache.return_value = (
+            LogGroupMetadataCache()
+        )
+        tags_cache = cache_layer.get_cloudwatch_log_group_tags_cache.return_value
+        tags_cache.get.return_value = []
+        event = {"Records": [self.record("group-1"), self.record("group-2")]}
+
+        events = parse(event, Context(), cache_layer)
+
+        self.assertEqual(len(events), 2)
+        tags_cache.prefetch.assert_called_once_with(
+            [
+                "arn:aws:logs:sa-east-1:601427279990:log-group:group-1",
+                "arn:aws:logs:sa-east-1:601427279990:log-group:group-2",
+            ]
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,198 @@
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+from retry.backends import LocalBackend, S3Backend
+from retry.enums import RetryPrefix
+from retry.replay import Replay
+from retry.storage import Storage
+
+
+class CountingBackend(LocalBackend):
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.gets = 0
+
+    def get(self, key):
+        self.gets += 1
+        return super().get(key)
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.backend = LocalBackend(self.directory)
+        self.storage = Storage("function_prefix", backend=self.backend)
+
+    def test_store_and_get_data(self):
+        self.storage.store_data(RetryPrefix.LOGS, [{"message": "log"}])
+        self.storage.store_data(RetryPrefix.METRICS, [{"m": 1}])
+        key_data = self.storage.get_data(RetryPrefix.LOGS)
+        self.assertEqual(list(key_data.values()), [[{"message": "log"}]])
+        key = next(iter(key_data))
+        self.assertTrue(key.startswith("failed_events/function_prefix/logs/"))
+        self.assertEqual(
+            json.loads(gzip.decompress(self.backend.get(key))), [{"message": "log"}]
+        )
+
+    def test_splits_data_in_segments(self):
+        storage = Storage(
+            "function_prefix", backend=self.backend, segment_max_size_bytes=20
+        )
+        logs = ["log 1", "log 2", "log 3", "a log larger than the segments"]
+        storage.store_data(RetryPrefix.LOGS, logs)
+        key_data = storage.get_data(RetryPrefix.LOGS)
+        self.assertEqual(
+            sorted(key_data.values()),
+            sorted([["log 1", "log 2"], ["log 3"], ["a log larger than the segments"]]),
+        )
+        self.assertEqual(
+            sorted(log for data in key_data.values() for log in data), sorted(logs)
+        )
+
+    def test_reads_uncompressed_data(self):
+        key = "failed_events/function_prefix/traces/1700000000.0"
+        self.backend.put(key, json.dumps([{"trace": 1}]).encode("UTF-8"))
+        self.assertEqual(
+            self.storage.get_data(RetryPrefix.TRACES), {key: [{"trace": 1}]}
+        )
+
+    def test_corrupted_data_is_skipped(self):
+        key = "failed_events/function_prefix/logs/1700000000.0"
+        self.backend.put(key, b"not json")
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(self.storage.get_data(RetryPrefix.LOGS), {key: None})
+
+    def test_delete_keys(self):
+        self.storage.store_data(RetryPrefix.LOGS, ["log 1"])
+        self.storage.store_data(RetryPrefix.LOGS, ["log 2"])
+        self.storage.delete_keys(list(self.storage.get_data(RetryPrefix.LOGS)))
+        self.assertEqual(self.storage.get_data(RetryPrefix.LOGS), {})
+
+    def test_iter_data_fetches_ahead_lazily(self):
+        backend = CountingBackend(self.directory)
+        storage = Storage("function_prefix", backend=backend, fetch_max_workers=2)
+        for i in range(10):
+            storage.store_data(RetryPrefix.LOGS, [f"log {i}"])
+        data = storage.iter_data(RetryPrefix.LOGS)
+        self.assertEqual(next(data)[1], ["log 0"])
+        self.assertLessEqual(backend.gets, 3)
+        data.close()
+        data = list(storage.iter_data(RetryPrefix.LOGS))
+        self.assertEqual([d for _, d in data][-1], ["log 9"])
+
+    def test_checkpoint(self):
+        self.assertIsNone(self.storage.get_checkpoint(RetryPrefix.LOGS))
+        self.storage.set_checkpoint(RetryPrefix.LOGS, "key")
+        self.assertEqual(self.storage.get_checkpoint(RetryPrefix.LOGS), "key")
+        self.assertEqual(self.storage.get_data(RetryPrefix.LOGS), {})
+        self.storage.set_checkpoint(RetryPrefix.LOGS, None)
+        self.assertIsNone(self.storage.get_checkpoint(RetryPrefix.LOGS))
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.storage = Storage("function_prefix", backend=LocalBackend(self.directory))
+        for i in range(5):
+            self.storage.store_data(RetryPrefix.LOGS, [f"log {i}"])
+
+    def test_deletes_forwarded_segments(self):
+        replay = Replay(self.storage, RetryPrefix.LOGS)
+        self.assertTrue(replay.run(lambda key, data: data != ["log 1"]))
+        self.assertEqual((replay.replayed_count, replay.forwarded_count), (5, 4))
+        self.assertEqual(
+            list(self.storage.get_data(RetryPrefix.LOGS).values()), [["log 1"]]
+        )
+
+    def test_resumes_after_deadline(self):
+        deadline = MagicMock()
+        deadline.has_time_for.side_effect = [True, True, False]
+        replayed = []
+
+        def forward(key, data):
+            replayed.extend(data)
+            return data != ["log 0"]
+
+        with self.assertLogs(level="WARNING"):
+            replay = Replay(self.storage, RetryPrefix.LOGS, deadline)
+            self.assertFalse(replay.run(forward))
+        self.assertEqual(replayed, ["log 0", "log 1"])
+        self.assertEqual(len(self.storage.get_data(RetryPrefix.LOGS)), 4)
+
+        # The next round picks up after the segments replayed
+        self.assertTrue(Replay(self.storage, RetryPrefix.LOGS).run(forward))
+        self.assertEqual(replayed, ["log 0", "log 1", "log 2", "log 3", "log 4"])
+        self.assertIsNone(self.storage.get_checkpoint(RetryPrefix.LOGS))
+
+        # Then starts over from the segments that failed again
+        Replay(self.storage, RetryPrefix.LOGS).run(forward)
+        self.assertEqual(replayed[-1], "log 0")
+
+    def test_deletes_in_batches(self):
+        self.storage.delete_keys = MagicMock(wraps=self.storage.delete_keys)
+        Replay(self.storage, RetryPrefix.LOGS, checkpoint_interval=2).run(
+            lambda key, data: True
+        )
+        self.assertEqual(
+            [len(c.args[0]) for c in self.storage.delete_keys.call_args_list],
+            [2, 2, 1],
+        )
+        self.assertEqual(self.storage.get_data(RetryPrefix.LOGS), {})
+        self.assertIsNone(self.storage.get_checkpoint(RetryPrefix.LOGS))
+
+
+@patch("retry.backends.boto3")
+class TestS3Backend(unittest.TestCase):
+    def test_list_keys_follows_pages(self, boto3):
+        s3_client = boto3.client.return_value
+        s3_client.get_paginator.return_value.paginate.return_value = [
+            {"Contents": [{"Key": "a"}, {"Key": "b"}]},
+            {"Contents": [{"Key": "c"}]},
+            {},
+        ]
+        keys = S3Backend("bucket").list_keys("prefix/", start_after="0")
+        self.assertEqual(list(keys), ["a", "b", "c"])
+        s3_client.get_paginator.assert_called_once_with("list_objects_v2")
+        s3_client.get_paginator.return_value.paginate.assert_called_once_with(
+            Bucket="bucket", Prefix="prefix/", StartAfter="0"
+        )
+
+    def test_get_missing_key(self, boto3):
+        s3_client = boto3.client.return_value
+        s3_client.get_object.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchKey"}}, "GetObject"
+        )
+        self.assertIsNone(S3Backend("bucket").get("key"))
+
+    def test_delete_in_bulk(self, boto3):
+        s3_client = boto3.client.return_value
+        s3_client.delete_objects.return_value = {}
+        keys = [str(i) for i in range(1500)]
+        S3Backend("bucket").delete(keys)
+        self.assertEqual(s3_client.delete_objects.call_count, 2)
+        deleted = [
+            o["Key"]
+            for c in s3_client.delete_objects.call_args_list
+            for o in c.kwargs["Delete"]["Objects"]
+        ]
+        self.assertEqual(deleted, keys)
+
+    def test_delete_errors_are_logged(self, boto3):
+        s3_client = boto3.client.return_value
+        s3_client.delete_objects.return_value = {
+            "Errors": [{"Key": "a", "Message": "Access Denied"}]
+        }
+        with self.assertLogs(level="ERROR"):
+            S3Backend("bucket").delete(["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,17 @@
 import gzip
+import json
 import unittest
 import re
+from io import BytesIO
 from unittest.mock import MagicMock, patch
 
 from approvaltests.combination_approvals import verify_all_combinations
 from caching.cache_layer import CacheLayer
-from steps.handlers.s3_handler import S3EventDataStore, S3EventHandler
+from steps.handlers.s3_handler import (
+    JsonStreamReader,
+    S3EventDataStore,
+    S3EventHandler,
+)
 
 
 class TestS3EventsHandler(unittest.TestCase):
@@ -328,5 +334,187 @@ class TestS3EventsHandler(unittest.TestCase):
         )
 
 
+class TestS3EventsHandlerStream(unittest.TestCase):
+    class Context:
+        function_version = 0
+        invoked_function_arn = "invoked_function_arn"
+        function_name = "function_name"
+        memory_limit_in_mb = "10"
+
+    def get_lines(self, data, key="my-key", stream=False, chunk_size=7):
+        s3_handler = S3EventHandler(
+            self.Context(), {"ddtags": ""}, MagicMock(), stream=stream
+        )
+        s3_handler.multiline_regex_start_pattern = self.multiline_regex_start_pattern
+        s3_handler.multiline_regex_pattern = self.multiline_regex_pattern
+        s3_handler.data_store.bucket = "my-bucket"
+        s3_handler.data_store.key = key
+        if stream:
+            s3_handler.data_store.body = BytesIO(data)
+        else:
+            s3_handler.data_store.data = data
+        with patch("steps.handlers.s3_handler.STREAM_CHUNK_SIZE", chunk_size):
+            return list(s3_handler._get_structured_lines_for_s3_handler())
+
+    def assert_same_lines(self, data, key="my-key", chunk_size=7):
+        expected = self.get_lines(data, key)
+        self.assertEqual(
+            self.get_lines(data, key, stream=True, chunk_size=chunk_size), expected
+        )
+        return expected
+
+    def setUp(self):
+        self.multiline_regex_start_pattern = None
+        self.multiline_regex_pattern = None
+
+    def test_plain_lines(self):
+        data = b"first line\r\nsecond line\rthird\n\n  \nfourth \xc3\xa9t\xc3\xa9\r\n"
+        lines = self.assert_same_lines(data)
+        self.assertEqual(
+            [line["message"] for line in lines],
+            ["first line", "second line", "third", "fourth \u00e9t\u00e9"],
+        )
+        self.assert_same_lines(data, chunk_size=1)
+
+    def test_gzip_lines(self):
+        data = gzip.compress(b"".join(b"line %d\n" % i for i in range(1000)))
+        lines = self.assert_same_lines(data)
+        self.assertEqual(len(lines), 1000)
+        self.assertEqual(lines[-1]["message"], "line 999")
+
+    def test_gzip_detected_from_key(self):
+        data = gzip.compress(b"line")
+        self.assert_same_lines(data, key="my-key.gz")
+
+    def test_gzip_multiple_members(self):
+        data = (
+            gzip.compress(b"first\nsec")
+            + b"\x00" * 10
+            + gzip.compress(b"ond\nthird")
+        )
+        lines = self.assert_same_lines(data)
+        self.assertEqual(
+            [line["message"] for line in lines], ["first", "second", "third"]
+        )
+
+    def test_gzip_truncated(self):
+        data = gzip.compress(b"line\n" * 1000)[:-20]
+        with self.assertRaises(EOFError):
+            self.get_lines(data, stream=True)
+
+    def test_empty_object(self):
+        self.assertEqual(self.get_lines(b"", stream=True), [])
+
+    def test_multiline_regex(self):
+        self.multiline_regex_start_pattern = re.compile(r"^\d{4}-\d{2}-\d{2}")
+        self.multiline_regex_pattern = re.compile(r"[\n\r\f]+(?=\d{4}-\d{2}-\d{2})")
+        data = b"2022-02-08aaa\nbbbccc\n\n2022-02-09bbb\r\n2022-02-10ccc\n"
+        lines = self.assert_same_lines(data, chunk_size=16)
+        self.assertEqual(
+            [line["message"] for line in lines],
+            ["2022-02-08aaa\nbbbccc", "2022-02-09bbb", "2022-02-10ccc\n"],
+        )
+        self.assert_same_lines(gzip.compress(data), chunk_size=16)
+
+    def test_multiline_regex_not_matching_start(self):
+        self.multiline_regex_start_pattern = re.compile(r"^\d{4}-\d{2}-\d{2}")
+        self.multiline_regex_pattern = re.compile(r"[\n\r\f]+(?=\d{4}-\d{2}-\d{2})")
+        data = b"aaa\r\n2022-02-09bbb\r\n\x0b\xe2\x80\xa8ccc\r"
+        lines = self.assert_same_lines(data, chunk_size=1)
+        self.assertEqual(
+            [line["message"] for line in lines],
+            ["aaa", "2022-02-09bbb", "", "", "ccc"],
+        )
+
+    def test_lines_spanning_many_chunks(self):
+        data = b"a" * 100 + b"\r\n" + b"b" * 50 + b"\r" + b"c" * 100 + b"\n"
+        for chunk_size in (1, 3, 7):
+            lines = self.assert_same_lines(data, chunk_size=chunk_size)
+            self.assertEqual(
+                [line["message"] for line in lines], ["a" * 100, "b" * 50, "c" * 100]
+            )
+        self.multiline_regex_start_pattern = re.compile(r"^\d{4}-\d{2}-\d{2}")
+        self.multiline_regex_pattern = re.compile(r"[\n\r\f]+(?=\d{4}-\d{2}-\d{2})")
+        data = b"2022-02-08" + b"a" * 100 + b"\n" + b"b" * 100 + b"\n2022-02-09ccc"
+        # Chunks large enough for the head of the file to match the start pattern
+        for chunk_size in (10, 13, 16):
+            lines = self.assert_same_lines(data, chunk_size=chunk_size)
+            self.assertEqual(
+                [line["message"] for line in lines],
+                ["2022-02-08" + "a" * 100 + "\n" + "b" * 100, "2022-02-09ccc"],
+            )
+
+    def test_cloudtrail(self):
+        key = "123456779121_CloudTrail_eu-west-3_20180707T1735Z_abcdefghi0MCRL2O.json.gz"
+        records = [
+            {"eventID": str(i), "eventName": "GetObject", "n": 12345, "ok": True}
+            for i in range(100)
+        ]
+        data = gzip.compress(
+            json.dumps({"Records": records, "other": [1, 2]}, indent=2).encode()
+        )
+        lines = self.assert_same_lines(data, key=key)
+        self.assertEqual(len(lines), 100)
+        self.assertEqual(
+            lines[-1],
+            {
+                "eventID": "99",
+                "eventName": "GetObject",
+                "n": 12345,
+                "ok": True,
+                "aws": {"s3": {"bucket": "my-bucket", "key": key}},
+            },
+        )
+
+    def test_cloudtrail_records_not_first(self):
+        key = "123456779121_CloudTrail_eu-west-3_20180707T1735Z_abcdefghi0MCRL2O.json.gz"
+        data = gzip.compress(b'\xef\xbb\xbf {"version": 1.5, "Records" : [ ] }')
+        self.assertEqual(self.assert_same_lines(data, key=key), [])
+        data = gzip.compress(
+            b'{"version": {"a": [1]}, "Records": [{"eventID": "\\u00e9"}]}'
+        )
+        lines = self.assert_same_lines(data, key=key)
+        self.assertEqual([line["eventID"] for line in lines], ["\u00e9"])
+
+    def test_cloudtrail_without_records(self):
+        key = "123456779121_CloudTrail-Digest_eu-west-3_20180707T1735Z.json.gz"
+        data = gzip.compress(
+            b'{"digestEndTime": "2018-07-07T18:35:00Z",\n"Records": null}'
+        )
+        lines = self.assert_same_lines(data, key=key)
+        self.assertEqual(
+            [line["message"] for line in lines],
+            ['{"digestEndTime": "2018-07-07T18:35:00Z",', '"Records": null}'],
+        )
+
+    def test_cloudtrail_invalid_json(self):
+        key = "123456779121_CloudTrail_eu-west-3_20180707T1735Z_abcdefghi0MCRL2O.json.gz"
+        lines = self.assert_same_lines(gzip.compress(b"not json\n[1, 2]"), key=key)
+        self.assertEqual([line["message"] for line in lines], ["not json", "[1, 2]"])
+
+
+class TestJsonStreamReader(unittest.TestCase):
+    def texts(self, document, size):
+        return (document[i : i + size] for i in range(0, len(document), size))
+
+    def test_values_split_across_texts(self):
+        values = ["a\\\u00e9\U0001f600" * 20, -12.5e-3, True, None, {"k": [1]}]
+        document = json.dumps(values)
+        for size in range(1, 8):
+            reader = JsonStreamReader(self.texts(document, size))
+            reader.expect("[")
+            decoded = [reader.value()]
+            while reader.expect(",]") == ",":
+                decoded.append(reader.value())
+            self.assertEqual(decoded, values)
+
+    def test_invalid_value_raises_without_reading_further(self):
+        texts = self.texts('[{"a" 1}' + " " * 1000 + "]", 10)
+        reader = JsonStreamReader(texts)
+        reader.expect("[")
+        with self.assertRaises(json.JSONDecodeError):
+            reader.value()
+        self.assertEqual(len(list(texts)), 100)
+
 if __name__ == "__main__":
     unittest.main()
@@ -2,6 +2,8 @@ import unittest
 from steps.splitting import (
     extract_metric,
     extract_trace_payload,
+    split,
+    split_stream,
 )
 
 
@@ -51,5 +53,28 @@ class TestLambdaFunctionExtractTracePayload(unittest.TestCase):
         )
 
 
+class TestSplitStream(unittest.TestCase):
+    events = [
+        {"message": "a log", "ddtags": "env:dev"},
+        {"message": '{"m": "metric", "v": 1, "e": 1, "t": []}', "ddtags": "env:dev"},
+        {"message": '{"traces": [[{"trace_id": 1}]]}', "ddtags": "env:dev"},
+        {"message": "another log", "ddtags": "env:dev"},
+    ]
+
+    def test_split_stream_matches_split(self):
+        metrics, trace_payloads = [], []
+        logs = list(split_stream(iter(self.events), metrics, trace_payloads))
+        self.assertEqual((metrics, logs, trace_payloads), split(self.events))
+
+    def test_split_stream_collects_while_consumed(self):
+        metrics, trace_payloads = [], []
+        logs = split_stream(iter(self.events), metrics, trace_payloads)
+        self.assertEqual(next(logs)["message"], "a log")
+        self.assertEqual(metrics, [])
+        self.assertEqual(next(logs)["message"], "another log")
+        self.assertEqual(len(metrics), 1)
+        self.assertEqual(len(trace_payloads), 1)
+
+
 if __name__ == "__main__":
     unittest.main()
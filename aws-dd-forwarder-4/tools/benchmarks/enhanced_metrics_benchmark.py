@@ -0,0 +1,152 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+"""Cost of parsing and submitting the enhanced metrics of Lambda logs
+
+Compares generate_enhanced_lambda_metrics, which runs every parser on every
+log and submits each point on its own, as the forwarder did before, with
+EnhancedMetricsParser, which only runs the parsers that can match a message
+and submits the points in series, as it does now. 95% of the logs carry no
+enhanced metric. Both submit to ThreadStats, standing in for the Lambda layer.
+
+Usage: python tools/benchmarks/enhanced_metrics_benchmark.py [logs]
+"""
+
+import gc
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("DD_API_KEY", "11111111111111111111111111111111")
+
+import enhanced_lambda_metrics  # noqa: E402
+import telemetry  # noqa: E402
+from datadog.threadstats import ThreadStats  # noqa: E402
+from enhanced_lambda_metrics import (  # noqa: E402
+    EnhancedMetricsParser,
+    generate_enhanced_lambda_metrics,
+)
+from steps.parsed_event import ParsedEvent  # noqa: E402
+
+REPORT = (
+    "REPORT RequestId: 814ba7cb-071e-4181-9a09-fa41db5bccad\tDuration: 1711.87 ms"
+    "\tBilled Duration: 1800 ms\tMemory Size: 128 MB\tMax Memory Used: 98 MB"
+)
+JSON_REPORT = json.dumps(
+    {
+        "time": "2024-10-04T00:36:35.800Z",
+        "type": "platform.report",
+        "record": {
+            "requestId": "4d789d71-2f2c-4c66-a4b5-531a0223233d",
+            "metrics": {
+                "durationMs": 0.62,
+                "billedDurationMs": 100,
+                "memorySizeMB": 128,
+                "maxMemoryUsedMB": 51,
+            },
+            "status": "success",
+        },
+    }
+)
+JSON_APP_LOG = json.dumps(
+    {"level": "info", "msg": "order placed", "order_id": 1234, "duration_ms": 12}
+)
+MATCHING = [
+    REPORT,
+    JSON_REPORT,
+    "2019-07-18T18:58:22.286Z b5264ab7 Task timed out after 30.03 seconds",
+    "[ERROR] MemoryError\nTraceback (most recent call last):",
+]
+NON_MATCHING = [
+    "START RequestId: 814ba7cb-071e-4181-9a09-fa41db5bccad Version: $LATEST",
+    "END RequestId: 814ba7cb-071e-4181-9a09-fa41db5bccad",
+    "2024-06-12T10:00:00.000Z 814ba7cb INFO GET /api/orders/1234 200 12ms",
+    JSON_APP_LOG,
+]
+
+
+class _TagsCache:
+    def get(self, arn):
+        return ["team:payments"]
+
+
+class _Writer:
+    """Submits to ThreadStats like the ThreadStatsWriter of the Lambda layer"""
+
+    def __init__(self):
+        self.thread_stats = ThreadStats()
+        self.thread_stats.start(flush_in_thread=False)
+
+    def distribution(self, metric_name, value, tags=[], timestamp=None):
+        self.thread_stats.distribution(
+            metric_name, value, tags=tags, timestamp=timestamp
+        )
+
+
+def build_logs(count):
+    logs = []
+    for i in range(count):
+        if i % 20 == 0:
+            message = MATCHING[i // 20 % len(MATCHING)]
+        else:
+            message = NON_MATCHING[i % len(NON_MATCHING)]
+        arn = f"arn:aws:lambda:us-east-1:123456789012:function:f{i % 10}"
+        logs.append(
+            ParsedEvent(
+                message=message, timestamp=1718186400000 + i, **{"lambda": {"arn": arn}}
+            )
+        )
+    return logs
+
+
+def submit_per_log(logs, tags_cache):
+    for log in logs:
+        for metric in generate_enhanced_lambda_metrics(log, tags_cache):
+            metric.submit_to_dd()
+
+
+def submit_in_bulk(logs, tags_cache):
+    parser = EnhancedMetricsParser(tags_cache)
+    for log in logs:
+        parser.add(log)
+    parser.submit()
+
+
+def run(submit, logs):
+    writer = _Writer()
+    enhanced_lambda_metrics.lambda_stats = writer
+    telemetry.lambda_stats = writer
+    telemetry.DD_SUBMIT_ENHANCED_METRICS = True
+    # Like timeit, keep the garbage collector out of the measurement
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        submit(logs, _TagsCache())
+        elapsed = time.perf_counter() - start
+    finally:
+        gc.enable()
+    _, dists = writer.thread_stats._get_aggregate_metrics_and_dists(float("inf"))
+    points = sorted(
+        (d["metric"], d["points"][0][0], sorted(d["tags"]), sorted(d["points"][0][1]))
+        for d in dists
+    )
+    return elapsed, points
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"logs: {count}, 5% with enhanced metrics")
+    per_log, expected = min(run(submit_per_log, build_logs(count)) for _ in range(3))
+    bulk, points = min(run(submit_in_bulk, build_logs(count)) for _ in range(3))
+    assert points == expected
+    print(f"per log: {per_log / count * 1e6:.2f} us/log")
+    print(f"bulk:    {bulk / count * 1e6:.2f} us/log")
+    print(f"speedup: {per_log / bulk:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+"""Throughput and memory of the HTTP transports of the logs intake client
+
+Sends batches to a local stand-in for the logs intake, which answers every
+request after a fixed latency, with the thread pool of DatadogHTTPClient and
+with the asyncio event loop of DatadogAsyncHTTPClient. Peak memory is traced
+while the batches are produced and sent.
+
+Usage: python tools/benchmarks/http_transport_benchmark.py [batches] [latency_ms]
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("DD_API_KEY", "11111111111111111111111111111111")
+
+from logs.datadog_async_http_client import DatadogAsyncHTTPClient  # noqa: E402
+from logs.datadog_http_client import DatadogHTTPClient  # noqa: E402
+
+BATCH_SIZE_BYTES = 512 * 1000
+
+
+class LocalIntake(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(("127.0.0.1", 0), LocalIntakeHandler)
+        self.latency = latency
+        self.received = 0
+
+
+class LocalIntakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.server.latency)
+        self.server.received += 1
+        self.send_response(202)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def produce(count):
+    for _ in range(count):
+        # Incompressible, like the gzipped batches built by the batcher
+        yield os.urandom(BATCH_SIZE_BYTES)
+
+
+def run(client_class, intake, count):
+    client = client_class("127.0.0.1", intake.server_port, True, False, "api_key")
+    tracemalloc.start()
+    start = time.perf_counter()
+    with client:
+        for payload in produce(count):
+            client.send(payload)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+    intake = LocalIntake(latency)
+    threading.Thread(target=intake.serve_forever, daemon=True).start()
+    print(f"batches: {count} of {BATCH_SIZE_BYTES / 1000:.0f} KB")
+    print(f"intake latency: {latency * 1000:.0f} ms")
+    for name, client_class in (
+        ("thread pool", DatadogHTTPClient),
+        ("asyncio", DatadogAsyncHTTPClient),
+    ):
+        intake.received = 0
+        elapsed, peak = run(client_class, intake, count)
+        assert intake.received == count
+        print(
+            f"{name:<12} {count / elapsed:8.1f} batches/s"
+            f" {peak / 1e6:8.1f} MB peak traced memory"
+        )
+    intake.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+"""CPU time and peak memory of submitting custom metrics forwarded from logs
+
+Submits the metrics to ThreadStats one point at a time, as the forwarder did
+before, and aggregated in series by LogMetricAggregator first, each series
+submitted at once, as it does now. Memory is measured with tracemalloc, the
+metrics themselves being allocated beforehand.
+
+Usage: python tools/benchmarks/log_metrics_benchmark.py [points] [series]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("DD_API_KEY", "11111111111111111111111111111111")
+
+from datadog.threadstats import ThreadStats  # noqa: E402
+from metric_aggregator import LogMetricAggregator  # noqa: E402
+
+START = 1700000000
+
+
+def build_metrics(points, series):
+    # Tags are decoded from JSON, a new list of new strings for every point
+    return [
+        {
+            "m": f"checkout.order.latency_{i % series}",
+            "v": float(i % 997),
+            "e": START + i * 60 // points,
+            "t": [
+                f"function_arn:arn:aws:lambda:us-east-1:123456789012:function:f{i % 7}",
+                "env:prod",
+                "service:checkout",
+                f"endpoint:/api/orders/{i % series}",
+                "dd_lambda_layer:datadog-python312_6.104.0",
+            ],
+        }
+        for i in range(points)
+    ]
+
+
+def submit_points(stats, metrics):
+    for metric in metrics:
+        stats.distribution(
+            metric["m"], metric["v"], timestamp=metric["e"], tags=metric["t"]
+        )
+
+
+def submit_series(stats, metrics):
+    aggregator = LogMetricAggregator()
+    for metric in metrics:
+        aggregator.add(metric)
+    for name, tags, timestamp, values in aggregator.series():
+        stats.distributions(name, values, timestamp=timestamp, tags=tags)
+
+
+def run(submit, metrics):
+    stats = ThreadStats()
+    stats.start(flush_in_thread=False)
+    tracemalloc.start()
+    start = time.process_time()
+    submit(stats, metrics)
+    _, dists = stats._get_aggregate_metrics_and_dists(float("inf"))
+    elapsed = time.process_time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert sum(len(d["points"][0][1]) for d in dists) == len(metrics)
+    return len(dists), elapsed, peak
+
+
+def main():
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    series = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    metrics = build_metrics(points, series)
+    print(f"points: {points} in {series} series over 60 s")
+    for name, submit in (("points", submit_points), ("series", submit_series)):
+        dists, elapsed, peak = run(submit, metrics)
+        print(
+            f"{name:<8} {dists:6d} distributions {elapsed * 1000:8.0f} ms CPU "
+            f"{peak / 1e6:8.2f} MB peak"
+        )
+
+
+if __name__ == "__main__":
+    main()
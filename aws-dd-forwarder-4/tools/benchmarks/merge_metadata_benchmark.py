@@ -0,0 +1,100 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+"""Cost of merging the forwarder metadata into log events
+
+Compares merge_metadata with the recursive merge_dicts on the event shapes
+produced by the S3, CloudTrail and awslogs handlers.
+
+Usage: python tools/benchmarks/merge_metadata_benchmark.py [events]
+"""
+
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("DD_API_KEY", "11111111111111111111111111111111")
+
+from steps.common import merge_dicts, merge_metadata  # noqa: E402
+
+FORWARDER_ARN = "arn:aws:lambda:us-east-1:123456789012:function:forwarder"
+METADATA = {
+    "ddsourcecategory": "aws",
+    "aws": {"function_version": "$LATEST", "invoked_function_arn": FORWARDER_ARN},
+    "ddtags": "forwardername:forwarder,forwarder_memorysize:1024,env:prod",
+    "ddsource": "elb",
+    "service": "elb",
+    "host": "arn:aws:elasticloadbalancing:us-east-1:123456789012:loadbalancer/app",
+}
+AWSLOGS_TEMPLATE = merge_dicts(
+    {
+        "aws": {
+            "awslogs": {
+                "logGroup": "/aws/lambda/checkout",
+                "logStream": "2024/06/12/[$LATEST]0123456789abcdef",
+                "owner": "123456789012",
+            }
+        },
+        "lambda": {"arn": "arn:aws:lambda:us-east-1:123456789012:function:checkout"},
+    },
+    dict(METADATA, ddsource="lambda", service="checkout", host=None),
+)
+S3_ATTRIBUTES = {"aws": {"s3": {"bucket": "logs", "key": "AWSLogs/elb/file.log.gz"}}}
+
+
+# Events in the shape produced by each handler, with the metadata merged into them
+SHAPES = {
+    "s3 lines": (
+        lambda: {"aws": {"s3": {"bucket": "logs", "key": "k"}}, "message": "GET /"},
+        METADATA,
+    ),
+    "cloudtrail records": (
+        lambda: {"eventName": "GetObject", "eventSource": "s3.amazonaws.com"},
+        S3_ATTRIBUTES,
+    ),
+    "awslogs events": (
+        lambda: {"id": "1", "timestamp": 1, "message": "START"},
+        AWSLOGS_TEMPLATE,
+    ),
+    "string events": (lambda: {"message": "hello"}, METADATA),
+}
+
+
+def build_batch(shape, count):
+    make_event, metadata = SHAPES[shape]
+    return [(make_event(), metadata) for _ in range(count)]
+
+
+def run(merge, batch):
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for event, metadata in batch:
+            merge(event, metadata)
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"events per batch: {count}")
+    for shape in SHAPES:
+        recursive, specialized = [], []
+        for _ in range(9):
+            recursive.append(run(merge_dicts, build_batch(shape, count)))
+            specialized.append(run(merge_metadata, build_batch(shape, count)))
+        recursive, specialized = min(recursive), min(specialized)
+        print(
+            f"{shape:20} merge_dicts: {recursive * 1e3:6.1f} ms"
+            f"  merge_metadata: {specialized * 1e3:6.1f} ms"
+            f"  speedup: {recursive / specialized:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
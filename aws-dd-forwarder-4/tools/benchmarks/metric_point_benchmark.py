@@ -0,0 +1,96 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+"""Memory held by the enhanced metric points of REPORT logs
+
+Generates the enhanced metrics of REPORT logs from a fleet of Lambdas, with
+metric points holding their own list of tags, as they did before, and with
+slotted points sharing tuples of interned tags, as they do now, and measures
+the memory the points hold with tracemalloc.
+
+Usage: python tools/benchmarks/metric_point_benchmark.py [logs] [functions]
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("DD_API_KEY", "11111111111111111111111111111111")
+
+import enhanced_lambda_metrics  # noqa: E402
+from enhanced_lambda_metrics import generate_enhanced_lambda_metrics  # noqa: E402
+
+
+class PreviousMetricPoint(object):
+    """DatadogMetricPoint as it was, with a __dict__ and a list of tags"""
+
+    def __init__(self, name, value, timestamp=None, tags=[]):
+        self.name = name
+        self.value = value
+        self.tags = tags
+        self.timestamp = timestamp
+
+    def add_tags(self, tags):
+        self.tags = self.tags + tags
+
+    def set_timestamp(self, timestamp):
+        self.timestamp = timestamp
+
+
+class _TagsCache:
+    def get(self, arn):
+        # Decoded from the S3 cache, a new list of new strings per function
+        return [f"team:{arn[-1]}", "env:prod", "service:checkout", "owner:payments"]
+
+
+def build_logs(count, functions):
+    return [
+        {
+            "message": (
+                f"REPORT RequestId: 814ba7cb-071e-4181-9a09-fa41db5bccad\t"
+                f"Duration: {i % 1000}.87 ms\tBilled Duration: {i % 1000 + 1} ms\t"
+                f"Memory Size: {128 * (1 + i % 2)} MB\tMax Memory Used: 98 MB"
+                + ("\tInit Duration: 250.12 ms" if i % 10 == 0 else "")
+            ),
+            "lambda": {"arn": f"arn:aws:lambda:us-east-1:0:function:f{i % functions}"},
+            "timestamp": 1718186400000 + i,
+        }
+        for i in range(count)
+    ]
+
+
+def run(point_class, logs):
+    enhanced_lambda_metrics.DatadogMetricPoint = point_class
+    tags_cache = _TagsCache()
+    tracemalloc.start()
+    points = [
+        metric
+        for log in logs
+        for metric in generate_enhanced_lambda_metrics(log, tags_cache)
+    ]
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(points), held
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    functions = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    current = enhanced_lambda_metrics.DatadogMetricPoint
+    print(f"REPORT logs: {count} from {functions} functions")
+    for name, point_class in (
+        ("previous", PreviousMetricPoint),
+        ("slotted", current),
+    ):
+        points, held = run(point_class, build_logs(count, functions))
+        print(
+            f"{name:<10} {points} points {held / 1e6:8.2f} MB "
+            f"{held / points:6.0f} B/point"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+"""Points per second added to the ThreadStats MetricsAggregator from threads
+
+Adds distribution points from several threads at once to the aggregator as
+it was, behind a single lock sorting the tags of every point, and as it is
+now, sharded with a lock per shard and the tags keys memoized.
+
+Usage: python tools/benchmarks/metrics_aggregator_benchmark.py [points] [series]
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("DD_API_KEY", "11111111111111111111111111111111")
+
+from datadog.threadstats.metrics import Distribution, MetricsAggregator  # noqa: E402
+
+START = 1700000000
+
+
+class PreviousMetricsAggregator(object):
+    """MetricsAggregator as it was, behind a single lock"""
+
+    def __init__(self, roll_up_interval=10):
+        self._lock = threading.RLock()
+        self._metrics = defaultdict(lambda: {})
+        self._roll_up_interval = roll_up_interval
+
+    def add_point(
+        self, metric, tags, timestamp, value, metric_class, sample_rate=1, host=None
+    ):
+        interval = timestamp - timestamp % self._roll_up_interval
+        key = (metric, host, tuple(sorted(tags)) if tags else None)
+        with self._lock:
+            if key not in self._metrics[interval]:
+                self._metrics[interval][key] = metric_class(metric, tags, host)
+            self._metrics[interval][key].add_point(value)
+
+    def flush(self, timestamp):
+        with self._lock:
+            metrics = []
+            for i in list(self._metrics):
+                for m in list(self._metrics.pop(i).values()):
+                    metrics += m.flush(i, self._roll_up_interval)
+        return metrics
+
+
+def run(aggregator, threads, points, series):
+    # Like the forwarder telemetry, every point of a series reuses its tags
+    tags = [
+        [f"series:{i}", "env:prod", "service:checkout", "forwardername:forwarder"]
+        for i in range(series)
+    ]
+
+    def add_points(offset):
+        for i in range(offset, points, threads):
+            metric, timestamp = f"metric.{i % series}", START + i % 60
+            aggregator.add_point(metric, tags[i % series], timestamp, 1.0, Distribution)
+
+    workers = [
+        threading.Thread(target=add_points, args=(offset,)) for offset in range(threads)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    flushed = aggregator.flush(float("inf"))
+    assert sum(len(m[1]) for m in flushed) == points
+    return points / elapsed
+
+
+def main():
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 400000
+    series = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    print(f"points: {points} in {series} series")
+    for threads in (1, 2, 4, 8):
+        previous = run(PreviousMetricsAggregator(), threads, points, series)
+        sharded = run(MetricsAggregator(), threads, points, series)
+        print(
+            f"{threads} threads: previous {previous:10.0f} points/s "
+            f"sharded {sharded:10.0f} points/s ({sharded / previous:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
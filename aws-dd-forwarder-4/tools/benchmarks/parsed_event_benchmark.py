@@ -0,0 +1,154 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+"""Per-event cost of the enrich/transform/split/enhanced metrics steps
+
+Compares events wrapped in ParsedEvent, whose message is decoded once, with
+plain dicts, whose message is decoded again by every step reading it.
+
+Usage: python tools/benchmarks/parsed_event_benchmark.py [events]
+"""
+
+import gc
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("DD_API_KEY", "11111111111111111111111111111111")
+
+from enhanced_lambda_metrics import generate_enhanced_lambda_metrics  # noqa: E402
+from steps.enrichment import enrich  # noqa: E402
+from steps.parsed_event import ParsedEvent  # noqa: E402
+from steps.splitting import split  # noqa: E402
+from steps.transformation import transform  # noqa: E402
+
+LAMBDA_ARN = "arn:aws:lambda:us-east-1:123456789012:function:checkout"
+DDTAGS = "forwardername:forwarder,forwarder_memorysize:1024,forwarder_version:4.0.2"
+
+
+class _TagsCache:
+    def get(self, arn):
+        return ["team:payments"]
+
+
+class _CacheLayer:
+    def get_lambda_tags_cache(self):
+        return _TagsCache()
+
+
+def _lambda_event(message):
+    return {
+        "id": "1",
+        "timestamp": 1700000000000,
+        "message": message,
+        "lambda": {"arn": LAMBDA_ARN},
+        "ddsource": "lambda",
+        "ddtags": DDTAGS + ",env:none",
+        "service": "lambda",
+    }
+
+
+def _source_event(source, message):
+    return {"message": message, "ddsource": source, "ddtags": DDTAGS}
+
+
+def build_events(count):
+    cloudtrail = json.dumps(
+        {
+            "eventVersion": "1.08",
+            "userIdentity": {
+                "type": "AssumedRole",
+                "arn": "arn:aws:sts::123456789012:assumed-role/role/i-0123456789abcdef0",
+            },
+            "eventSource": "s3.amazonaws.com",
+            "eventName": "GetObject",
+            "requestParameters": {"bucketName": "bucket", "key": "a/b/c.json"},
+            "resources": [{"type": "AWS::S3::Object", "ARN": "arn:aws:s3:::b/c"}],
+            "additionalEventData": {
+                f"field{i}": {"bytesTransferredIn": i, "x-amz-id-2": "a" * 40}
+                for i in range(20)
+            },
+        }
+    )
+    waf = json.dumps(
+        {
+            "timestamp": 1700000000000,
+            "action": "ALLOW",
+            "httpRequest": {
+                "clientIp": "1.2.3.4",
+                "headers": [
+                    {"name": f"X-Header-{i}", "value": "v" * 32} for i in range(20)
+                ],
+            },
+            "ruleGroupList": [
+                {
+                    "ruleGroupId": "AWS#AWSManagedRulesCommonRuleSet",
+                    "terminatingRule": None,
+                    "nonTerminatingMatchingRules": [],
+                    "excludedRules": None,
+                }
+            ],
+            "rateBasedRuleList": [],
+            "nonTerminatingMatchingRules": [],
+        }
+    )
+    json_app_log = json.dumps(
+        {
+            "level": "info",
+            "msg": "order placed",
+            "order_id": 1234,
+            "ddtags": "version:1.2.3",
+            "context": {f"attribute{i}": {"value": i, "unit": "ms"} for i in range(30)},
+        }
+    )
+    report = (
+        "REPORT RequestId: 814ba7cb-071e-4181-9a09-fa41db5bccad\tDuration: 1711.87 ms"
+        "\tBilled Duration: 1800 ms\tMemory Size: 128 MB\tMax Memory Used: 98 MB"
+    )
+    templates = [
+        lambda: _lambda_event("START RequestId: 814ba7cb Version: $LATEST"),
+        lambda: _lambda_event(json_app_log),
+        lambda: _lambda_event(json_app_log),
+        lambda: _lambda_event(report),
+        lambda: _source_event("cloudtrail", cloudtrail),
+        lambda: _source_event("waf", waf),
+        lambda: _source_event("vpc", "2 123456789012 eni-1 10.0.0.1 10.0.0.2 OK"),
+        lambda: _source_event("elb", "https 2024-01-01T00:00:00Z app/lb 1.2.3.4:443"),
+    ]
+    return [templates[i % len(templates)]() for i in range(count)]
+
+
+def run(events):
+    cache_layer = _CacheLayer()
+    # Like timeit, keep the garbage collector out of the measurement
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        enriched = enrich(events, cache_layer)
+        transformed = transform(enriched)
+        _, logs, _ = split(transformed)
+        for log in logs:
+            generate_enhanced_lambda_metrics(log, cache_layer.get_lambda_tags_cache())
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    plain = min(run(build_events(count)) for _ in range(3))
+    parsed = min(
+        run([ParsedEvent(e) for e in build_events(count)]) for _ in range(3)
+    )
+    print(f"events: {count}")
+    print(f"plain dicts:   {plain / count * 1e6:.2f} us/event")
+    print(f"parsed events: {parsed / count * 1e6:.2f} us/event")
+    print(f"speedup:       {plain / parsed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+"""Size and fetch time of the retry storage
+
+Stores failed logs in a local directory, as the retry storage did before, one
+uncompressed object per failure fetched serially, and as it does now, in
+gzipped segments fetched concurrently. Every read from the backend waits for
+a fixed latency, standing in for an S3 round trip.
+
+Usage: python tools/benchmarks/retry_storage_benchmark.py [failures] [latency_ms]
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("DD_API_KEY", "11111111111111111111111111111111")
+
+from retry.backends import LocalBackend  # noqa: E402
+from retry.enums import RetryPrefix  # noqa: E402
+from retry.storage import Storage  # noqa: E402
+from settings import DD_RETRY_FETCH_MAX_WORKERS  # noqa: E402
+
+LOGS_PER_FAILURE = 400
+
+
+class LatentBackend(LocalBackend):
+    def __init__(self, directory, latency):
+        super().__init__(directory)
+        self.latency = latency
+
+    def get(self, key):
+        time.sleep(self.latency)
+        return super().get(key)
+
+
+def build_logs(failure):
+    return [
+        json.dumps(
+            {
+                "message": f"GET /api/orders/{i} 200 12ms request_id={failure}-{i}",
+                "ddsource": "lambda",
+                "ddtags": "env:prod,service:checkout,forwardername:forwarder",
+                "host": "arn:aws:lambda:us-east-1:123456789012:function:checkout",
+            }
+        )
+        for i in range(LOGS_PER_FAILURE)
+    ]
+
+
+def store_previous(storage, failures):
+    for failure in range(failures):
+        key = f"{storage._get_key_prefix(RetryPrefix.LOGS)}{time.time()}-{failure}"
+        storage.backend.put(key, json.dumps(build_logs(failure)).encode("UTF-8"))
+
+
+def store_current(storage, failures):
+    for failure in range(failures):
+        storage.store_data(RetryPrefix.LOGS, build_logs(failure))
+
+
+def directory_size(directory):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(directory)
+        for name in files
+    )
+
+
+def run(store, fetch_max_workers, failures, latency):
+    directory = tempfile.mkdtemp()
+    try:
+        storage = Storage(
+            "function_prefix",
+            backend=LatentBackend(directory, latency),
+            fetch_max_workers=fetch_max_workers,
+        )
+        store(storage, failures)
+        size = directory_size(directory)
+        start = time.perf_counter()
+        key_data = storage.get_data(RetryPrefix.LOGS)
+        elapsed = time.perf_counter() - start
+        assert sum(len(data) for data in key_data.values()) == (
+            failures * LOGS_PER_FAILURE
+        )
+        return size, elapsed
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    failures = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+    print(f"failures: {failures} of {LOGS_PER_FAILURE} logs")
+    print(f"read latency: {latency * 1000:.0f} ms")
+    for name, store, fetch_max_workers in (
+        ("previous", store_previous, 1),
+        ("segments", store_current, DD_RETRY_FETCH_MAX_WORKERS),
+    ):
+        size, elapsed = run(store, fetch_max_workers, failures, latency)
+        print(f"{name:<10} {size / 1e6:8.2f} MB stored {elapsed * 1000:8.0f} ms fetch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+"""Scrubbing throughput of the forwarder for each combination of scrubbing rules
+
+Compares, in MB/s of serialized logs, the scrubbing done by the forwarder
+with applying every rule to the message of each log and then again to the
+serialized log.
+
+Usage: python tools/benchmarks/scrubber_benchmark.py [megabytes]
+"""
+
+import gc
+import json
+import os
+import sys
+import time
+from itertools import combinations
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("DD_API_KEY", "11111111111111111111111111111111")
+
+from forwarder import Forwarder  # noqa: E402
+from logs.datadog_scrubber import DatadogScrubber  # noqa: E402
+from settings import SCRUBBING_RULE_CONFIGS, ScrubbingRuleConfig  # noqa: E402
+
+CONFIGS = SCRUBBING_RULE_CONFIGS[:2] + [
+    ScrubbingRuleConfig("DD_SCRUBBING_RULE", r"token=[0-9a-f]{32}", "token=xxxxx")
+]
+MESSAGES = [
+    "START RequestId: 814ba7cb-071e-4181-9a09-fa41db5bccad Version: $LATEST",
+    "GET /api/orders/1234 200 12ms client=10.0.12.34 user=jane.doe@example.com",
+    "Processed 42 records from stream shard-000000000001 in 1711.87 ms",
+    "token=0123456789abcdef0123456789abcdef refreshed for session 9f3a",
+    "Connection from 192.168.1.20 closed after 30s of inactivity",
+    '{"level": "info", "msg": "order placed", "order_id": 1234, "retries": 0}',
+    "END RequestId: 814ba7cb-071e-4181-9a09-fa41db5bccad",
+]
+
+
+def build_logs(size_bytes):
+    logs = []
+    size = 0
+    while size < size_bytes:
+        log = {
+            "message": MESSAGES[len(logs) % len(MESSAGES)],
+            "ddsource": "lambda",
+            "ddtags": "env:prod,service:checkout,forwardername:forwarder",
+            "host": "arn:aws:lambda:us-east-1:123456789012:function:checkout",
+        }
+        logs.append(log)
+        size += len(json.dumps(log, ensure_ascii=False).encode("UTF-8"))
+    return logs, size
+
+
+def previous_scrub(rules, payload):
+    for rule in rules:
+        payload = rule.regex.sub(rule.placeholder, payload)
+    return payload
+
+
+def previous_serialize_logs(scrubber, logs):
+    for log in logs:
+        if isinstance(log, dict) and log.get("message"):
+            log["message"] = previous_scrub(scrubber._rules, log["message"])
+        yield json.dumps(log, ensure_ascii=False)
+
+
+def scrub_previous(scrubber, logs):
+    for log in previous_serialize_logs(scrubber, logs):
+        previous_scrub(scrubber._rules, log)
+
+
+def scrub_forwarder(scrubber, logs):
+    forwarder = Forwarder.__new__(Forwarder)
+    for log in forwarder._serialize_logs(logs, scrubber):
+        scrubber.scrub(log)
+
+
+def measure(scrub, scrubber, logs, size):
+    best = float("inf")
+    for _ in range(3):
+        copies = [dict(log) for log in logs]
+        # Like timeit, keep the garbage collector out of the measurement
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            scrub(scrubber, copies)
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return size / best / 1e6
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    logs, size = build_logs(int(megabytes * 1e6))
+    print(f"logs: {len(logs)}, {size / 1e6:.1f} MB")
+    print(f"{'rules':<40} {'previous':>12} {'forwarder':>12}")
+    for count in range(len(CONFIGS) + 1):
+        for configs in combinations(CONFIGS, count):
+            for config in CONFIGS:
+                os.environ.pop(config.name, None)
+            for config in configs:
+                os.environ[config.name] = ""
+            scrubber = DatadogScrubber(CONFIGS)
+            previous = measure(scrub_previous, scrubber, logs, size)
+            forwarder = measure(scrub_forwarder, scrubber, logs, size)
+            name = "+".join(config.name for config in configs) or "none"
+            print(
+                f"{name:<40} {previous:>7.1f} MB/s {forwarder:>7.1f} MB/s"
+                f" ({forwarder / previous:.2f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main()
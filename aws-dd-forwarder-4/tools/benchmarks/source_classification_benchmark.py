@@ -0,0 +1,124 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+"""Cost of classifying log groups and S3 keys into a source
+
+Compares parse_event_source with the linear scans over the enums it used to
+run for every payload.
+
+Usage: python tools/benchmarks/source_classification_benchmark.py [iterations]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("DD_API_KEY", "11111111111111111111111111111111")
+
+from steps.common import CLOUDTRAIL_REGEX, parse_event_source  # noqa: E402
+from steps.enums import (  # noqa: E402
+    AwsCwEventSourcePrefix,
+    AwsEventSource,
+    AwsEventType,
+    AwsEventTypeKeyword,
+    AwsS3EventSourceKeyword,
+)
+
+LOG_GROUPS = [
+    "/aws/lambda/checkout-service-prod",
+    "/aws/lambda/payments-api-staging",
+    "/aws/api-gateway/orders",
+    "/aws/apigateway/welcome",
+    "API-Gateway-Execution-Logs_a1b2c3d4e5/prod",
+    "/aws/rds/instance/orders-db/postgresql",
+    "/aws/rds/cluster/users/mysql",
+    "/aws/eks/prod-cluster/cluster",
+    "/aws/kinesisfirehose/logs-to-s3",
+    "/aws/codebuild/frontend",
+    "/aws/vendedlogs/states/order-workflow-Logs",
+    "/ecs/fargate-web-service",
+    "vpc-flow-logs-prod",
+    "aws-waf-logs-frontend",
+    "/aws/network-firewall/flow",
+    "sns/us-east-1/123456789012/alerts",
+    "application-logs",
+    "my-app-logs-prod",
+]
+
+S3_KEYS = [
+    "AWSLogs/123456789012/elasticloadbalancing/us-east-1/2024/06/12/123456789012_elasticloadbalancing_us-east-1_app.my-alb.50dc6c495c0c9188_20240612T0845Z_10.0.0.2_1abcdef2.log.gz",
+    "AWSLogs/123456789012/vpcflowlogs/us-east-1/2024/06/12/123456789012_vpcflowlogs_us-east-1_fl-0123456789abcdef0_20240612T0845Z_1a2b3c4d.log.gz",
+    "AWSLogs/123456789012/CloudTrail/us-east-1/2024/06/12/123456789012_CloudTrail_us-east-1_20240612T0845Z_4JnGaVHRj3YHPUoS.json.gz",
+    "AWSLogs/123456789012/CloudTrail-Digest/us-east-1/2024/06/12/123456789012_CloudTrail-Digest_us-east-1_trail_us-east-1_20240612T0845Z.json.gz",
+    "AWSLogs/123456789012/WAFLogs/us-east-1/frontend-waf/2024/06/12/08/45/123456789012_waflogs_us-east-1_frontend-waf_20240612T0845Z_12756524.log.gz",
+    "2024/06/12/08/aws-waf-logs-frontend-2-2024-06-12-08-45-12-796e56c0-7fdf-47b7-9268-38b875bb62d2",
+    "cloudfront/E2EXAMPLE.2024-06-12-08.a1b2c3d4.gz",
+    "AWSLogs/123456789012/redshift/us-east-1/2024/06/12/123456789012_redshift_us-east-1_mycluster_userlog_2024-06-12T08:45.gz",
+    "AWSLogs/123456789012/vpcdnsquerylogs/vpc-0123456789abcdef0/2024/06/12/vpc-0123456789abcdef0_vpcdnsquerylogs_123456789012_20240612T0845Z_71584702.log.gz",
+    "carbon-black-cloud-forwarder/alerts/org_key=ABCDEFGH/year=2024/month=6/day=12/hour=8/minute=45/second=12/8436e850-7e78-40e4-b3cd-6ebbc854d0a2.jsonl.gz",
+    "application/2024/06/12/08/app-2-2024-06-12-08-45-12-796e56c0.gz",
+    "exports/orders/2024-06-12/part-00000.json",
+]
+
+
+def linear_parse_event_source(event, override):
+    lowercased = str(override).lower()
+    if event.get(str(AwsEventType.AWSLOGS), None):
+        for prefix in AwsCwEventSourcePrefix:
+            if lowercased.startswith(str(prefix)):
+                return str(prefix.event_source)
+        for source in AwsEventSource.cloudwatch_sources():
+            if str(source) in lowercased:
+                return str(source)
+        return str(AwsEventSource.CLOUDWATCH)
+
+    if records := event.get(str(AwsEventTypeKeyword.RECORDS), None):
+        if len(records) > 0 and str(AwsEventSource.S3) in records[0]:
+            if CLOUDTRAIL_REGEX.search(lowercased):
+                return str(AwsEventSource.CLOUDTRAIL)
+            for keyword in AwsS3EventSourceKeyword:
+                if str(keyword) in lowercased:
+                    return str(keyword.event_source)
+            return str(AwsEventSource.S3)
+
+    return str(AwsEventSource.AWS)
+
+
+def build_corpus():
+    awslogs_event = {"awslogs": {"data": ""}}
+    s3_event = {"Records": [{"s3": {}}]}
+    return [(awslogs_event, log_group) for log_group in LOG_GROUPS] + [
+        (s3_event, key) for key in S3_KEYS
+    ]
+
+
+def run(classify, corpus, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for event, override in corpus:
+            classify(event, override)
+    return time.perf_counter() - start
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    corpus = build_corpus()
+    for event, override in corpus:
+        assert parse_event_source(event, override) == linear_parse_event_source(
+            event, override
+        ), override
+
+    count = iterations * len(corpus)
+    linear = min(run(linear_parse_event_source, corpus, iterations) for _ in range(3))
+    compiled = min(run(parse_event_source, corpus, iterations) for _ in range(3))
+    print(f"classifications: {count}")
+    print(f"linear scans: {linear / count * 1e6:.2f} us/classification")
+    print(f"precompiled:  {compiled / count * 1e6:.2f} us/classification")
+    print(f"speedup:      {linear / compiled:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+"""Memory and flush latency of ThreadStats distributions and histograms
+
+Samples distribution and histogram points in ThreadStats keeping their
+values in lists, as it did before, and with compact_values, as the forwarder
+does now, then flushes them, building the JSON payload of the distributions
+the way the HTTP reporter does, without sending it.
+
+Usage: python tools/benchmarks/threadstats_benchmark.py [points] [series]
+"""
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("DD_API_KEY", "11111111111111111111111111111111")
+
+from datadog.api.format import format_points  # noqa: E402
+from datadog.threadstats import ThreadStats  # noqa: E402
+
+START = 1700000000
+
+
+def run(compact_values, points, series):
+    stats = ThreadStats(compact_values=compact_values)
+    stats.start(flush_in_thread=False)
+    tags = [[f"series:{i}", "env:prod"] for i in range(series)]
+    tracemalloc.start()
+    for i in range(points):
+        # Values decoded from logs, a new float object each
+        value = float(i % 1000) + 0.5
+        stats.distribution("d", value, timestamp=START, tags=tags[i % series])
+        stats.histogram("h", value, timestamp=START, tags=tags[i % series])
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    _, dists = stats._get_aggregate_metrics_and_dists(float("inf"))
+    for d in dists:
+        d["points"] = format_points(d["points"])
+    payload = json.dumps({"series": dists})
+    elapsed = time.perf_counter() - start
+    return held, elapsed, len(payload)
+
+
+def main():
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    series = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    print(f"points: {points} distribution and histogram points in {series} series")
+    for name, compact_values in (("lists", False), ("compact", True)):
+        held, elapsed, size = run(compact_values, points, series)
+        print(
+            f"{name:<8} {held / 1e6:8.2f} MB held {elapsed * 1000:8.0f} ms flush "
+            f"{size / 1e6:6.2f} MB payload"
+        )
+
+
+if __name__ == "__main__":
+    main()